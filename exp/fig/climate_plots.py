@@ -17,7 +17,10 @@ import cartopy.crs as ccrs  # plotting library for geospatial data
 sys.path.insert(1, os.path.abspath(os.getcwd()))
 print(os.getcwd())
 print("-------------------------------------------------------")
-from src.utils import download_dataset
+from src.climate import get_anomaly, window_mean
+from src.datasets import fetch_dataset
+from src.geometry import get_coastline_resolution
+from src.utils import write_fig
 
 plt.rcParams.update(bundles.icml2022())
 plt.rcParams.update({"figure.dpi": 200})
@@ -38,36 +41,16 @@ rb_temp = LinearSegmentedColormap.from_list(
 #######################################################
 # precipitation data
 #######################################################
-download_dataset(file_path='precip.mon.mean.nc', 
-                 url='https://downloads.psl.noaa.gov//Datasets/cmap/enh/precip.mon.mean.nc',
-                 subfolder='climate_data')
+fetch_dataset('cmap_precipitation')
 
-data = xr.open_dataset("dat/climate_data/precip.mon.mean.nc")
-df = data.to_dataframe()
-
-# do the same for the average reference frame (1979-2000)
-# data for years <1979 not available
-# select data for each month of timestpan 1979-2000
-dt64_start = np.datetime64('1979-01-01T00:00:00.000000000')
-dt64_end = np.datetime64('2000-12-01T00:00:00.000000000')
-
-filtered_data_2 = data.sel(time=slice(dt64_start, dt64_end))
-# dataframe now contains 12 months
-filtered_data_2 = filtered_data_2.mean(dim = ("time"))
-
-# average data over whole timespan 2017-2022
+# average reference frame (1979-2000), data for years <1979 not available
+# and average data over whole timespan 2017-2022
 start_year = '2017'
 end_year = '2022'
 
-# select data for each month of year 2017-2022
-dt64_start = np.datetime64(start_year + '-01-01T00:00:00.000000000')
-dt64_end = np.datetime64(end_year + '-12-01T00:00:00.000000000')
-
-filtered_data_3 = data.sel(time=slice(dt64_start, dt64_end))
-filtered_data_3 = filtered_data_3.mean(dim = ("time"))
-
-# calculate precipitation anomaly [%] 
-anomaly_2 = 100 * (filtered_data_3 - filtered_data_2) / filtered_data_2
+# calculate precipitation anomaly [%], both means are cached in dat/cache
+anomaly_2 = get_anomaly('cmap_precipitation', 'precip', baseline='1979-2000', target=(start_year, end_year),
+                        relative=True)
 
 # Create a plot
 plt.rcParams.update(bundles.icml2022(column='half', nrows=2, ncols=1))
@@ -76,8 +59,8 @@ fig = plt.figure()
 ax = fig.add_subplot(2, 1, 2, projection=ccrs.Robinson())
 #ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
 
-ax.coastlines()
-plot = anomaly_2["precip"].plot(ax=ax, transform=ccrs.PlateCarree(), cmap=rb, vmin = -50, vmax = 50, add_colorbar=False)
+ax.coastlines(resolution=get_coastline_resolution(ax))
+plot = anomaly_2.plot(ax=ax, transform=ccrs.PlateCarree(), cmap=rb, vmin = -50, vmax = 50, add_colorbar=False)
 # rename colorbar label
 cb = plt.colorbar(mappable=plot, label = 'Precipitation anomalies [\%]', extend = 'both')
 
@@ -99,23 +82,12 @@ ax.set_title("Precipitation Anomalies: " + start_year + " - " + end_year)
 #######################################################
 # temperature data
 #######################################################
-download_dataset(file_path='NOAAGlobalTemp_v5.1.0_gridded_s185001_e202312_c20240108T150239.nc', 
-                 url='https://www.ncei.noaa.gov/data/noaa-global-surface-temperature/v5.1/access/gridded/NOAAGlobalTemp_v5.1.0_gridded_s185001_e202312_c20240108T150239.nc',
-                 subfolder='climate_data')
-
-data = xr.open_dataset("dat/climate_data/NOAAGlobalTemp_v5.1.0_gridded_s185001_e202312_c20240108T150239.nc")
-df = data.to_dataframe()
-
+fetch_dataset('noaa_global_temperature')
 
 # average data over whole timespan 2017-2022
 start_year = '2017'
 end_year = '2022'
-# select data for each month of timespan 2017-2022
-dt64_start = np.datetime64(start_year+'-01-01T00:00:00.000000000')
-dt64_end = np.datetime64(end_year+'-12-01T00:00:00.000000000')
-
-filtered_data = data.sel(time=slice(dt64_start, dt64_end))
-filtered_data = filtered_data.mean(dim = ("time"))
+filtered_data = window_mean('noaa_global_temperature', 'anom', (start_year, end_year))
 
 # Create a plot
 #plt.rcParams.update(bundles.icml2022())
@@ -123,8 +95,8 @@ filtered_data = filtered_data.mean(dim = ("time"))
 ax = fig.add_subplot(2, 1, 1, projection=ccrs.Robinson())
 #ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
 
-ax.coastlines()
-plot = filtered_data["anom"].plot(ax=ax, transform=ccrs.PlateCarree(), cmap=rb_temp, vmin=-3, vmax=3, add_colorbar=False)
+ax.coastlines(resolution=get_coastline_resolution(ax))
+plot = filtered_data.plot(ax=ax, transform=ccrs.PlateCarree(), cmap=rb_temp, vmin=-3, vmax=3, add_colorbar=False)
 # rename colorbar label
 cb = plt.colorbar(mappable=plot, label = 'Surface temperature \n anomalies [°C]', extend = 'both')
 
@@ -142,6 +114,7 @@ gl.top_labels = False
 gl.right_labels = False
 ax.set_title("Surface Temperature Anomalies: " + start_year + " - " + end_year)
 
-plt.savefig('doc/water/fig/fig_climate/temp_precip_spatial.pdf')
+# Rasterize the gridded fields, coastlines, gridlines, axes and labels stay vector
+write_fig(fig, 'doc/water/fig/fig_climate/temp_precip_spatial.pdf', profile='hybrid')
 
 plt.show()
\ No newline at end of file
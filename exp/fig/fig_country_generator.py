@@ -1,10 +1,12 @@
 import os
+import time
 
 import matplotlib.pyplot as plt
 from tueplots.constants.color import rgb
 
-from src.aquastat_utils import get_aquastat, AQUASTAT_SOURCE
-from src.utils import save_fig
+from src.aquastat_utils import get_aquastat, get_variable_units, AQUASTAT_SOURCE
+from src.parallel import run_jobs
+from src.utils import figure_fingerprint, is_fig_up_to_date, save_fig
 
 FIG_PATH = 'fig_country'
 
@@ -13,6 +15,11 @@ FIG_PATH = 'fig_country'
 RELEVANT_COUNTRY = 'Peru'
 FILTER_COUNTRIES = []
 
+# Number of processes rendering the figures (None: one per core, 1: no parallelism)
+WORKERS = None
+# Render all figures, even those that were already saved with the same data and code
+FORCE = False
+
 RELEVANT_VARS = ["% of agricultural GVA produced by irrigated agriculture",
                  "% of agricultural water managed area equipped for irrigation",
                  "% of area equipped for full control irrigation actually irrigated",
@@ -140,81 +147,114 @@ RELEVANT_VARS = ["% of agricultural GVA produced by irrigated agriculture",
                  "Water withdrawal for cooling of thermoelectric plants",
                  "Water withdrawal for livestock (watering and cleaning)"]
 
-# Get the dataframe
-df = get_aquastat()
-raw_df = get_aquastat(raw=True)
-print(df.head())
+# Define colors
+colors = [rgb.tue_blue, rgb.tue_red, rgb.tue_green, rgb.tue_orange]
 
-# Format dataframe
-var_unit_map = raw_df[['Variable', 'Unit']].drop_duplicates().set_index('Variable').to_dict()['Unit']
+# Data of this process, loaded once by load_data
+country_data_map = None
+var_unit_map = None
 
-# Extract relevant variables and drop all NaN
-data = df[['Country', 'Year', *RELEVANT_VARS]]
-if FILTER_COUNTRIES:
-    data = data[data['Country'].isin(FILTER_COUNTRIES)]
-data = data.dropna()
 
-# Define colors
-colors = [rgb.tue_blue, rgb.tue_red, rgb.tue_green, rgb.tue_orange]
+def load_data():
+    """
+    Loads the data of the relevant countries, split by country in a single pass, and the units of the variables.
+    Called once in every worker process.
+    """
+    global country_data_map, var_unit_map
+
+    # Get the dataframe
+    df = get_aquastat(countries=[RELEVANT_COUNTRY])
+    country_data_map = dict(list(df.groupby('Country', observed=True, sort=False)))
+
+    # Units of the variables
+    var_unit_map = get_variable_units()
+
+
+def get_jobs() -> list[tuple[str, str]]:
+    """
+    Returns the (country, variable) combinations with data, so no figure is created for an empty one.
+    """
+    jobs = []
+    for country, country_data in country_data_map.items():
+        variables = country_data.columns.intersection(RELEVANT_VARS)
+        has_data = country_data[variables].notna().any()
+        jobs += [(country, variable) for variable in RELEVANT_VARS if has_data.get(variable, False)]
+    return jobs
+
+
+def plot_country_variable(country, variable) -> str | bool:
+    """
+    Plots the time series of one variable in one country and saves it.
+
+    :return: Path to the saved figure or None if it is up to date
+    """
+    country_data = country_data_map[country]
+
+    # Skip the figure if it was already saved with the same inputs
+    fig_name = f'{country}_{variable}'
+    fig_path = os.path.join(FIG_PATH, country)
+    fingerprint = figure_fingerprint(country_data[['Year', variable]], country, variable, var_unit_map[variable],
+                                     code=[plot_country_variable, rgb])
+    if not FORCE and is_fig_up_to_date(fingerprint, fig_name, fig_path):
+        return None
 
-for single_variable in RELEVANT_VARS:
+    years = country_data['Year']
+    years_range = [min(years), max(years)]
 
-    thiss = [single_variable]
+    # Create a figure and an axes
+    fig, ax = plt.subplots()
 
-    # Iterate over unique countries in the dataset
-    for country in df['Country'].unique():
+    # Set the title
+    ax.set_title('{} in {} ({}-{})'.format(variable, country, years_range[0], years_range[1]),
+                 fontsize=10, pad=10,
+                 color=rgb.tue_darkblue)
 
-        if country != RELEVANT_COUNTRY:
-            continue
+    # Grid
+    ax.grid(True, which='both', color=rgb.tue_gray, linestyle='--', alpha=0.5)
 
-        # Filter data for the current country
-        country_data = df[df['Country'] == country]
-        years = country_data['Year']
-        years_range = [min(years), max(years)]
+    # X-axis
+    ax.set_xlabel('year')
+    ax.xaxis.set_ticks_position('both')
+    ax.xaxis.set_minor_locator(plt.MultipleLocator(1))
 
-        # Create a figure and an axes
-        fig, ax = plt.subplots()
+    # Plotting
+    ax.plot(years, country_data[variable], marker='o', linestyle='-', color=colors[0], linewidth=1, markersize=3)
 
-        # Set the title
-        ax.set_title('{} in {} ({}-{})'.format(" and\n".join(thiss), country, years_range[0], years_range[1]),
-                     fontsize=10, pad=10,
-                     color=rgb.tue_darkblue)
+    # Y-axis
+    ax.set_ylabel(var_unit_map[variable])
+    ax.yaxis.set_ticks_position('both')
 
-        # Grid
-        ax.grid(True, which='both', color=rgb.tue_gray, linestyle='--', alpha=0.5)
+    # Add a legend
+    ax.legend([variable], loc='upper left', frameon=False)
 
-        # X-axis
-        ax.set_xlabel('year')
-        ax.xaxis.set_ticks_position('both')
-        ax.xaxis.set_minor_locator(plt.MultipleLocator(1))
+    # Add source
+    ax.text(0.99, 0.01, AQUASTAT_SOURCE, transform=ax.transAxes, fontsize=8, ha='right',
+            color=rgb.tue_gray)
 
-        for (index, variable) in enumerate(thiss):
-            if variable not in df.columns:
-                continue
+    # Save the figure
+    saved_path = save_fig(fig, fig_name=fig_name, fig_path=fig_path, fingerprint=fingerprint)
 
-            data = country_data[variable]
+    # Close the plot to avoid displaying it in the loop
+    plt.close(fig)
 
-            # Plotting
-            color = colors[index % len(colors)]
-            ax.plot(years, data, marker='o', linestyle='-', color=color, linewidth=1, markersize=3)
+    return saved_path
 
-            # Y-axis
-            ax.set_ylabel(var_unit_map[variable])
-            ax.yaxis.set_ticks_position('both')
 
-            # Add a legend
-            ax.legend(thiss, loc='upper left', frameon=False)
+def main():
+    start = time.perf_counter()
 
-            # Add source
-            ax.text(0.99, 0.01, AQUASTAT_SOURCE, transform=ax.transAxes, fontsize=8, ha='right',
-                    color=rgb.tue_gray)
+    # The workers load the data themselves, this process only needs the combinations with data
+    load_data()
+    jobs = get_jobs()
+    results = run_jobs(plot_country_variable, jobs, workers=WORKERS, initializer=load_data, verbose=True)
 
-            # Save the figure
-            save_fig(fig, fig_name=f'{country}_{variable}', fig_path=os.path.join(FIG_PATH, country))
+    seconds = time.perf_counter() - start
+    saved = sum(bool(result) for result in results)
+    print(f"Plots saved! {saved} figures in {seconds:.1f} s ({saved / max(seconds, 1e-9):.1f} figures/s), "
+          f"{results.count(None)} up to date")
 
-            # Close the plot to avoid displaying it in the loop
-            plt.close()
 
-print("Plots saved!")
+if __name__ == '__main__':
+    main()
 
 # %%
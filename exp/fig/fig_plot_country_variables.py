@@ -1,8 +1,11 @@
+import time
+
 import matplotlib.pyplot as plt
 from tueplots.constants.color import rgb
 
-from src.aquastat_utils import get_aquastat, AQUASTAT_SOURCE
-from src.utils import save_fig
+from src.aquastat_utils import get_aquastat, get_variable_units, AQUASTAT_SOURCE
+from src.parallel import run_jobs
+from src.utils import figure_fingerprint, is_fig_up_to_date, save_fig
 
 # ENTER YOUR VARIABLE HERE
 # ========================
@@ -12,33 +15,63 @@ RELEVANT_VARS = ['% of the cultivated area equipped for irrigation', '% of total
 
 FIG_PATH = 'fig_plot_country_variables'
 
-df = get_aquastat()
-raw_df = get_aquastat(raw=True)
-
-'''Create a dictionary with the units of each variable'''
-var_unit_map = raw_df[['Variable', 'Unit']].drop_duplicates().set_index('Variable').to_dict()['Unit']
-
-'''relevant variables for us'''
-# TODO: Fix this
-# df['% of the total area equipped for irrigation'] = df['% of the cultivated area equipped for irrigation'] * df['% of total country area cultivated']
-
 '''filter countries (no filter if empty)'''
 filter_countries = []
 
-'''Extract relevant variables and drop all NaN'''
-df = df[['Country', 'Year', *RELEVANT_VARS]]
-if filter_countries:
-    df = df[df['Country'].isin(filter_countries)]
-df = df.dropna()
+'''number of processes rendering the figures (None: one per core, 1: no parallelism)'''
+WORKERS = None
+
+'''render all figures, even those that were already saved with the same data and code'''
+FORCE = False
 
 colors = [rgb.tue_blue, rgb.tue_red, rgb.tue_green, rgb.tue_orange]
 
-# Iterate over unique countries in the dataset
-for country in df['Country'].unique():
+'''data of this process, loaded once by load_data'''
+country_data_map = None
+var_unit_map = None
+
+
+def load_data():
+    """
+    Loads the relevant variables, split by country in a single pass, and the units of the variables.
+    Called once in every worker process.
+    """
+    global country_data_map, var_unit_map
+
+    df = get_aquastat(variables=RELEVANT_VARS, countries=filter_countries or None)
+
+    '''Create a dictionary with the units of each variable'''
+    var_unit_map = get_variable_units()
+
+    '''relevant variables for us'''
+    # TODO: Fix this
+    # df['% of the total area equipped for irrigation'] = df['% of the cultivated area equipped for irrigation'] * df['% of total country area cultivated']
+
+    '''Extract relevant variables and drop all NaN'''
+    df = df[['Country', 'Year', *RELEVANT_VARS]]
+    df = df.dropna()
+
+    '''countries without complete rows are left out, so no empty figure is created'''
+    country_data_map = dict(list(df.groupby('Country', observed=True, sort=True)))
+
+
+def plot_country(country) -> str | bool:
+    """
+    Plots the relevant variables of one country and saves the figure.
+
+    :return: Path to the saved figure or None if it is up to date
+    """
+    country_data = country_data_map[country]
+
+    # Skip the figure if it was already saved with the same inputs
+    fig_name = f'{country}_plot'
+    fingerprint = figure_fingerprint(country_data, country, [var_unit_map[variable] for variable in RELEVANT_VARS],
+                                     code=[plot_country, rgb])
+    if not FORCE and is_fig_up_to_date(fingerprint, fig_name, FIG_PATH):
+        return None
+
     print(f"Generating plot for {country}")
 
-    # Filter data for the current country
-    country_data = df[df['Country'] == country]
     years = country_data['Year']
     years_range = [min(years), max(years)]
 
@@ -60,9 +93,6 @@ for country in df['Country'].unique():
 
     # Iterate through all variables
     for (index, variable) in enumerate(RELEVANT_VARS):
-        if variable not in df.columns:
-            continue
-
         # Filter data for the current variable
         data = country_data[variable]
 
@@ -83,11 +113,29 @@ for country in df['Country'].unique():
 
     # Show the plot
     # Save the plot as an image in the 'x' folder
-    save_fig(fig, fig_name=f'{country}_plot', fig_path=FIG_PATH)
+    saved_path = save_fig(fig, fig_name=fig_name, fig_path=FIG_PATH, fingerprint=fingerprint)
 
     # Close the plot to avoid displaying it in the loop
-    plt.close()
+    plt.close(fig)
+
+    return saved_path
+
+
+def main():
+    start = time.perf_counter()
+
+    # The workers load the data themselves, this process only needs the countries
+    load_data()
+    jobs = [(country,) for country in country_data_map]
+    results = run_jobs(plot_country, jobs, workers=WORKERS, initializer=load_data, verbose=True)
+
+    seconds = time.perf_counter() - start
+    saved = sum(bool(result) for result in results)
+    print(f"Plots saved! {saved} figures in {seconds:.1f} s ({saved / max(seconds, 1e-9):.1f} figures/s), "
+          f"{results.count(None)} up to date")
+
 
-print("Plots saved!")
+if __name__ == '__main__':
+    main()
 
 # %%
@@ -8,8 +8,6 @@ from src.utils import save_fig
 TARGET_YEAR = 1990
 FIG_PATH = 'fig_water_use'
 
-df = get_aquastat()
-
 # three types of water withdrawal: agricultural, industrial and municipal water withdrawal
 
 '''relevant variables for us'''
@@ -18,9 +16,9 @@ RELEVANT_VARS = ['Total water withdrawal', 'Municipal water withdrawal', 'Indust
 '''filter countries (no filter if empty)'''
 FILTER_COUNTRIES = []
 
+df = get_aquastat(variables=RELEVANT_VARS, countries=FILTER_COUNTRIES or None)
+
 data = df[['Country', 'Year', *RELEVANT_VARS]]
-if FILTER_COUNTRIES:
-    data = data[data['Country'].isin(FILTER_COUNTRIES)]
 data = data.dropna()
 
 years = df['Year'].unique()
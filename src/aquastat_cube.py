@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+from src.aquastat_utils import get_aquastat, normalize_countries
+
+
+class AquastatCube:
+    """
+    The AQUASTAT data as a dense country x year x variable NumPy array.
+    Countries, years and variables are integer indexes into the array, so a single country,
+    year or variable is a slice instead of a scan of the whole dataframe.
+    Empty cells are NaN in values and False in the validity mask.
+
+    Example:
+    >>> cube = get_aquastat_cube(variables=['Total population'])
+    >>> cube.series('Germany', 'Total population')
+    >>> cube.to_wide()  # Same layout as get_aquastat()
+    """
+
+    def __init__(self, countries, years, variables, values: np.ndarray, mask: np.ndarray = None):
+        """
+        :param countries: Country names, one per entry of the first axis
+        :param years: Years, one per entry of the second axis
+        :param variables: Variable names, one per entry of the third axis
+        :param values: Array of shape (countries, years, variables)
+        :param mask: Optional. Boolean array of the same shape, True where values holds data.
+        By default, all cells that are not NaN.
+        """
+        self.countries = pd.Index(countries, name='Country')
+        self.years = pd.Index(years, name='Year')
+        self.variables = pd.Index(variables, name='Variable')
+
+        expected_shape = (len(self.countries), len(self.years), len(self.variables))
+        if values.shape != expected_shape:
+            raise ValueError(f'values has shape {values.shape}, expected {expected_shape}!')
+
+        self.values = values
+        self.mask = ~np.isnan(values) if mask is None else mask
+
+    @classmethod
+    def from_raw(cls, raw_df: pd.DataFrame, dtype='float64') -> 'AquastatCube':
+        """
+        Builds the cube from the long AQUASTAT table, see get_aquastat(raw=True).
+        If a cell occurs more than once, the first value that is not NaN is used, like in get_aquastat().
+
+        :param raw_df: Dataframe with the columns 'Country', 'Year', 'Variable' and 'Value'
+        :param dtype: dtype of the values
+        """
+        country_codes, countries = _factorize_sorted(raw_df['Country'])
+        year_codes, years = _factorize_sorted(raw_df['Year'].astype('int64'))
+        variable_codes, variables = _factorize_sorted(raw_df['Variable'])
+
+        values = np.full((len(countries), len(years), len(variables)), np.nan, dtype=dtype)
+
+        # Only assign the first valid value of every cell, NumPy does not define which of several writes to the
+        # same cell wins
+        raw_values = raw_df['Value'].to_numpy(dtype='float64')
+        valid_rows = np.flatnonzero(~np.isnan(raw_values))
+        cells = np.ravel_multi_index((country_codes, year_codes, variable_codes), values.shape)
+        _, first = np.unique(cells[valid_rows], return_index=True)
+        first_rows = valid_rows[first]
+        values[country_codes[first_rows], year_codes[first_rows], variable_codes[first_rows]] = raw_values[first_rows]
+
+        return cls(countries, years, variables, values)
+
+    @classmethod
+    def from_wide(cls, df: pd.DataFrame, dtype='float64') -> 'AquastatCube':
+        """
+        Builds the cube from the pivoted AQUASTAT dataframe, see get_aquastat().
+
+        :param df: Dataframe with the columns 'Country', 'Year' and one column per variable
+        :param dtype: dtype of the values
+        """
+        variables = [column for column in df.columns if column not in ('Country', 'Year')]
+        country_codes, countries = _factorize_sorted(df['Country'])
+        year_codes, years = _factorize_sorted(df['Year'])
+
+        values = np.full((len(countries), len(years), len(variables)), np.nan, dtype=dtype)
+        values[country_codes, year_codes, :] = df[variables].to_numpy(dtype=dtype)
+
+        return cls(countries, years, variables, values)
+
+    def to_wide(self) -> pd.DataFrame:
+        """
+        Converts the cube to the pivoted dataframe layout of get_aquastat().
+        Country-year rows without any data are left out.
+        """
+        country_codes, year_codes = np.nonzero(self.mask.any(axis=2))
+
+        df = pd.DataFrame(self.values[country_codes, year_codes, :], columns=self.variables)
+        df.insert(0, 'Country', self.countries.to_numpy()[country_codes])
+        df.insert(1, 'Year', self.years.to_numpy()[year_codes])
+        df.columns.name = 'Variable'
+        return df
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self.values.shape
+
+    @property
+    def density(self) -> float:
+        """
+        Share of cells that hold data.
+        """
+        return float(self.mask.mean()) if self.mask.size else 0.0
+
+    def country(self, country) -> pd.DataFrame:
+        """
+        Returns the data of one country as a year x variable dataframe.
+        """
+        return pd.DataFrame(self.values[self.countries.get_loc(country)], index=self.years, columns=self.variables)
+
+    def year(self, year) -> pd.DataFrame:
+        """
+        Returns the data of one year as a country x variable dataframe.
+        """
+        return pd.DataFrame(self.values[:, self.years.get_loc(year)], index=self.countries, columns=self.variables)
+
+    def variable(self, variable) -> pd.DataFrame:
+        """
+        Returns the data of one variable as a country x year dataframe.
+        """
+        return pd.DataFrame(self.values[:, :, self.variables.get_loc(variable)], index=self.countries,
+                            columns=self.years)
+
+    def series(self, country, variable) -> pd.Series:
+        """
+        Returns the time series of one variable in one country, without the years that have no data.
+        """
+        country_code = self.countries.get_loc(country)
+        variable_code = self.variables.get_loc(variable)
+        valid = self.mask[country_code, :, variable_code]
+        return pd.Series(self.values[country_code, valid, variable_code], index=self.years[valid], name=variable)
+
+    def get(self, country, year, variable) -> float:
+        """
+        Returns a single value or NaN if there is no data.
+        """
+        return self.values[self.countries.get_loc(country), self.years.get_loc(year), self.variables.get_loc(variable)]
+
+
+def _factorize_sorted(values) -> tuple[np.ndarray, pd.Index]:
+    """
+    Returns integer codes into the sorted unique values and the sorted unique values.
+    """
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.remove_unused_categories()
+        return values.cat.codes.to_numpy(), pd.Index(values.cat.categories)
+
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, pd.Index(uniques)
+
+
+def get_aquastat_cube(dtype='float64', **kwargs) -> AquastatCube | None:
+    """
+    Returns the AQUASTAT data as a cube.
+
+    :param dtype: dtype of the values, e.g. 'float32' to halve the memory
+    :param kwargs: Filters passed to get_aquastat, e.g. variables, countries or years
+    :return: The cube or None if the data could not be loaded
+    """
+    raw_df = get_aquastat(raw=True, compact=True, **kwargs)
+    if raw_df is None:
+        return None
+
+    # Same country names as in get_aquastat()
+    raw_df = raw_df.assign(Country=normalize_countries(raw_df['Country']))
+    return AquastatCube.from_raw(raw_df, dtype=dtype)
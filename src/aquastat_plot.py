@@ -1,18 +1,23 @@
 import math
 
-import geopandas as gpd
 import matplotlib
+import numpy as np
 import pandas as pd
 from scipy.stats import linregress
-import seaborn as sns
 from matplotlib import patches, pyplot as plt
+from matplotlib.collections import PathCollection
+from matplotlib.colors import Normalize
 import matplotlib.ticker as mticker
 
 from tueplots import bundles
 from tueplots.constants.color import rgb
 
-from src.aquastat_utils import rename_aquastat_country, AQUASTAT_SOURCE
-from src.utils import make_list, save_fig, to_dat_path
+from src.aquastat_stats import get_growth_rates
+from src.availability import AvailabilityIndex
+from src.aquastat_utils import normalize_countries, AQUASTAT_SOURCE
+from src.country_index import to_world_values
+from src.geometry import get_world, get_world_level, get_world_paths
+from src.utils import figure_fingerprint, get_fig_file_path, is_fig_up_to_date, make_list, save_fig
 
 # Constants
 MISSING_DATA_FACECOLOR = "white"
@@ -25,7 +30,7 @@ def format_tick(val, pos):
 
 
 def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=None, cmap='RdYlGn', label=None, fig=None,
-               ax=None, log_scale=False):
+               ax=None, log_scale=False, force=False):
     """
     Plot a map to show the quality of the data for each country
     :param aquastat_dataframe: Dataframe.
@@ -36,6 +41,8 @@ def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=Non
     :param cmap: Optional. Colormap to use.
     :param fig: Optional. Figure to plot on.
     :param ax: Optional. Axis to plot on.
+    :param force: Optional. If True, plot the map even if it was already saved with the same data and parameters.
+    :return: Fig and ax, or the path to the saved map if it is up to date
     """
 
     if year is None:
@@ -58,14 +65,18 @@ def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=Non
     # Aggregate data
     countries_df = countries_df[['Country', variable]]
 
-    # Merge data with a world map
-    world = gpd.read_file(to_dat_path(
-        file_path='naturalearth/ne_110m_admin_0_countries.shx'), engine="pyogrio")
+    # Skip the map if it was already saved with the same inputs, unless it is drawn on a given figure
+    fig_name = f'world_map_{variable.replace(" ", "_")}_{year}'
+    fingerprint = None
+    if fig is None or ax is None:
+        fingerprint = figure_fingerprint(countries_df, variable, year, vmin_max, title, cmap, label, log_scale,
+                                         code=[plot_world, get_world, to_world_values, rgb])
+        if not force and is_fig_up_to_date(fingerprint, fig_name, 'water_management'):
+            print(f'{fig_name} is up to date.')
+            return get_fig_file_path(fig_name, 'water_management')
 
-    # Exclude Antarctica
-    world = world[world['SOVEREIGNT'] != 'Antarctica']
-    merged = world.set_index('SOVEREIGNT').join(
-        countries_df.set_index('Country'))
+    # Align data with the world map
+    values = to_world_values(countries_df['Country'], countries_df[variable])
 
     # Save plot settings and update with new settings
     settings = plt.rcParams.copy()
@@ -76,9 +87,12 @@ def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=Non
         fig = plt.figure()
         ax = fig.add_subplot(1, 1, 1)
 
+    # Only as much detail as the axes can show
+    world = get_world(get_world_level(ax))
+
     # Get min and max values
-    vmin = merged[variable].min()
-    vmax = merged[variable].max()
+    vmin = np.nanmin(values)
+    vmax = np.nanmax(values)
     if vmin_max is not None:
         vmin = vmin_max[0]
         vmax = vmin_max[1]
@@ -87,8 +101,8 @@ def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=Non
         label = variable
 
     # Plotting
-    merged.plot(
-        column=variable,
+    world.plot(
+        column=values,
         ax=ax,
         legend=True,
         missing_kwds={
@@ -110,6 +124,8 @@ def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=Non
             'extend': 'max',
         }
     )
+    # Country and missing data polygons, rasterized by the 'hybrid' profile
+    polygon_layers = list(ax.collections)
 
     # Create a custom legend patch for "No Data"
     no_data_patch = patches.Patch(facecolor=MISSING_DATA_FACECOLOR, edgecolor=MISSING_DATA_EDGECOLOR,
@@ -135,8 +151,8 @@ def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=Non
              transform=plt.gca().transAxes, color=rgb.tue_gray)
 
     # Save figure
-    save_fig(fig, f'world_map_{variable.replace(" ", "_")}_{year}',
-             'water_management', experimental=True)
+    save_fig(fig, fig_name, 'water_management', experimental=True, fingerprint=fingerprint,
+             rasterize=polygon_layers)
 
     # Restore plot settings
     plt.rcParams.update(settings)
@@ -146,6 +162,147 @@ def plot_world(aquastat_dataframe, variable, vmin_max=None, year=None, title=Non
     return fig, ax
 
 
+def plot_world_batch(aquastat_dataframe, specs, vmin_max=None, title=None, cmap='RdYlGn', label=None, log_scale=False,
+                     fig_path='water_management', force=False) -> list:
+    """
+    Plots and saves one world map per (variable, year) like plot_world, but much faster for many maps.
+    The countries are drawn once as a single collection, every map only updates the colors, the norm,
+    the colorbar and the title before it is saved. The maps are saved as 'world_map_batch_{variable}_{year}',
+    so they do not overwrite the maps of plot_world.
+
+    :param aquastat_dataframe: Dataframe.
+    :param specs: List of (variable, year) tuples, one per map.
+    :param vmin_max: Optional. Min and max values for the colormap. By default, the range of each map.
+    :param title: Optional. Title of the plots. The placeholders '{variable}' and '{year}' are replaced,
+    e.g. '{variable} in {year}'. Other braces are kept, e.g. in LaTeX like 'km$^{3}$'.
+    :param cmap: Optional. Colormap to use.
+    :param label: Optional. Label of the colorbar, with the placeholders of title. By default, the variable.
+    :param log_scale: Optional. If True, the values are log10 values and the ticks show the original values.
+    :param fig_path: Optional. Folder to save the figures to, see save_fig.
+    :param force: Optional. If True, plot the maps even if they were already saved with the same data and parameters.
+    :return: List with the path to every map, False for maps without data. Nothing is drawn for maps
+    that are up to date.
+
+    Example:
+    >>> plot_world_batch(df, [(variable, year) for variable in variables for year in (2000, 2010, 2020)])
+    """
+    if title is None:
+        title = 'World Map'
+    if label is None:
+        label = '{variable}'
+
+    # Only keep the needed years and split the data once
+    years = {year for _, year in specs}
+    groups = dict(list(aquastat_dataframe[aquastat_dataframe['Year'].isin(years)].groupby('Year')))
+    cmap = plt.get_cmap(cmap).with_extremes(bad=MISSING_DATA_FACECOLOR)
+
+    # Skip the maps that were already saved with the same inputs, before anything is drawn
+    saved = []
+    pending = []
+    for variable, year in specs:
+        countries_df = groups.get(year)
+        if countries_df is None or variable not in countries_df:
+            print(f'No data for {variable} in {year}!')
+            saved.append(False)
+            continue
+
+        countries_df = countries_df[['Country', variable]].dropna()
+        fig_name = f'world_map_batch_{variable.replace(" ", "_")}_{year}'
+        fingerprint = figure_fingerprint(countries_df, variable, year, vmin_max, title, cmap, label, log_scale,
+                                         code=[plot_world_batch, get_world_paths, to_world_values, rgb])
+        if not force and is_fig_up_to_date(fingerprint, fig_name, fig_path):
+            print(f'{fig_name} is up to date.')
+            saved.append(get_fig_file_path(fig_name, fig_path))
+            continue
+
+        pending.append((len(saved), variable, year, countries_df, fig_name, fingerprint))
+        saved.append(None)
+
+    if not pending:
+        return saved
+
+    # Save plot settings and update with new settings
+    settings = plt.rcParams.copy()
+    plt.rcParams.update(bundles.icml2022(column='half', nrows=1, ncols=1))
+    plt.rcParams.update({"figure.dpi": 300})
+
+    fig = plt.figure()
+    ax = fig.add_subplot(1, 1, 1)
+
+    # Draw the countries once, polygons without data are shown in the missing color
+    world_paths = get_world_paths(get_world_level(ax))
+    countries = PathCollection(world_paths, cmap=cmap, linewidth=0.3, edgecolor='black')
+    ax.add_collection(countries)
+
+    # Hatch for the polygons without data, its paths are replaced for every map
+    missing = PathCollection([], facecolor='none', edgecolor=MISSING_DATA_EDGECOLOR, linewidth=0.3, hatch='//')
+    ax.add_collection(missing)
+
+    # Same extent and aspect as the geopandas plot in plot_world
+    ax.autoscale_view()
+    min_y, max_y = ax.get_ylim()
+    ax.set_aspect(1 / math.cos(math.radians((min_y + max_y) / 2)))
+
+    cbar = fig.colorbar(countries, ax=ax, orientation='horizontal', shrink=0.5, extend='max')
+
+    # Create a custom legend patch for "No Data"
+    no_data_patch = patches.Patch(facecolor=MISSING_DATA_FACECOLOR, edgecolor=MISSING_DATA_EDGECOLOR,
+                                  label='No Data', hatch='//', linewidth=0.05, linestyle='solid', fill=False,
+                                  alpha=0.3)
+    ax.legend(handles=[no_data_patch], loc='upper right')
+
+    # Axis
+    ax.axis("off")
+    ax.grid(which='major', axis='both', linestyle='-',
+            color='lightgrey', alpha=0.5)
+
+    # Add source
+    ax.text(0.5, 0.05, AQUASTAT_SOURCE, fontsize='xx-small', horizontalalignment='center', verticalalignment='center',
+            transform=ax.transAxes, color=rgb.tue_gray)
+
+    for position, variable, year, countries_df, fig_name, fingerprint in pending:
+        # Align data with the world map
+        values = to_world_values(countries_df['Country'], countries_df[variable])
+        has_data = ~np.isnan(values)
+
+        # Get min and max values
+        if vmin_max is not None:
+            vmin, vmax = vmin_max
+        elif has_data.any():
+            vmin, vmax = np.nanmin(values), np.nanmax(values)
+        else:
+            vmin, vmax = 0, 1
+
+        # Recolor
+        countries.set_array(np.ma.masked_invalid(values))
+        countries.set_norm(Normalize(vmin=vmin, vmax=vmax))
+        missing.set_paths([world_paths[row] for row in np.flatnonzero(~has_data)])
+        cbar.update_normal(countries)
+        if log_scale:
+            # Correct ticks for log scale, a new norm resets the formatter
+            cbar.ax.xaxis.set_major_formatter(mticker.FuncFormatter(format_tick))
+        cbar.set_label(fill_placeholders(label, variable, year))
+        ax.set_title(fill_placeholders(title, variable, year))
+
+        # Save figure
+        saved[position] = save_fig(fig, fig_name, fig_path, experimental=True, fingerprint=fingerprint,
+                                   rasterize=[countries, missing])
+
+    # Restore plot settings
+    plt.rcParams.update(settings)
+    plt.close(fig)
+
+    return saved
+
+
+def fill_placeholders(text, variable, year) -> str:
+    """
+    Replaces '{variable}' and '{year}' in a title or label. Unlike str.format, other braces are kept,
+    so LaTeX like 'km$^{3}$' can be used.
+    """
+    return text.replace('{variable}', str(variable)).replace('{year}', str(year))
+
+
 def get_growth_rate(series, log_scale=False):
     """
     Calculate the relative growth rate of a series.
@@ -197,7 +354,8 @@ def plot_growth_rate(
         log_scale: bool = False,
         fig=None,
         axs=None,
-        slope=False
+        slope=False,
+        force=False
 ):
     """
     Plot relative growth rates for a variable on a world map. Can plot multiple
@@ -211,28 +369,34 @@ def plot_growth_rate(
     :param fig: Optional. Figure to plot on.
     :param axs: Optional. Axis to plot on.
     :param slope: Whether to plot the slope or the growth rate.
-    :return: Fig, axs (matplotlib figure and axes objects)
+    :param force: Optional. If True, plot the maps even if they were already saved with the same data and parameters.
+    :return: Fig, axs (matplotlib figure and axes objects), or the path to the saved maps if they are up to date
     """
 
-    # Get the world map from natual earth
-    world = gpd.read_file(to_dat_path(
-        file_path='naturalearth/ne_110m_admin_0_countries.shx'), engine="pyogrio")
-
-    # Exclude Antarctica
-    world = world[world['SOVEREIGNT'] != 'Antarctica']
-
     # Select the method to calculate the growth rate
     if slope:
-        method = get_slope
         label = f'Linear regression coefficient'
     else:
-        method = get_growth_rate
         label = f'Relative Growth Rate [$\%$]'
 
     # Make sure variables is a list
     variables = make_list(variables, 1)
     number_of_plots = len(variables)
 
+    # Get the rates of all countries and variables at once
+    rates_df = get_growth_rates(data, variables, slope=slope, log_scale=log_scale)
+
+    # Skip the maps if they were already saved with the same inputs, unless they are drawn on a given figure
+    save_name = f'growth_rate_{"_and_".join(variables).replace(" ", "_")}'
+    fingerprint = None
+    if not fig or not axs:
+        year_ranges = [data.loc[data[variable].notna(), 'Year'].agg(['min', 'max']).tolist() for variable in variables]
+        fingerprint = figure_fingerprint(rates_df, year_ranges, variables, cmaps, title_vars, log_scale, slope,
+                                         code=[plot_growth_rate, get_world, to_world_values, rgb])
+        if not force and is_fig_up_to_date(fingerprint, save_name, 'water_management'):
+            print(f'{save_name} is up to date.')
+            return get_fig_file_path(save_name, 'water_management')
+
     # Save plot settings and update with new settings
     settings = plt.rcParams.copy()
     plt.rcParams.update(bundles.icml2022(
@@ -251,27 +415,18 @@ def plot_growth_rate(
         title_vars = [None] * number_of_plots
 
     # Plotting
+    polygon_layers = []
     for ax, variable, cmap, title_var in zip(axs, variables, cmaps, title_vars):
-        '''Get Rates'''
-        # Pivot the DataFrame to have years as the index and countries as columns
-        df_pivot = data.pivot(
-            index='Year', columns='Country', values=variable).dropna()
-        # Apply the function to calculate growth rate for each country
-        rates = df_pivot.apply(method, log_scale=log_scale)
-        # Convert the results to a DataFrame
-        rates_df = rates.reset_index(name='Relative growth rate')
-
-        # Get map
-        # Join Data to map
-        merged = world.set_index('SOVEREIGNT').join(
-            rates_df.set_index('Country'))
-
-        vmax = max(abs(merged['Relative growth rate'].min()),
-                   merged['Relative growth rate'].min())
+        # Get map, only with as much detail as the axes can show
+        world = get_world(get_world_level(ax))
+        # Align data with the map
+        values = to_world_values(rates_df.index, rates_df[variable])
+
+        vmax = max(abs(np.nanmin(values)), np.nanmin(values))
 
         # Plotting
-        merged.plot(
-            column='Relative growth rate',  # Replace with your column name
+        world.plot(
+            column=values,
             ax=ax,
             legend=True,
             missing_kwds={
@@ -292,9 +447,10 @@ def plot_growth_rate(
                 'extend': 'max'
             }
         )
+        polygon_layers.extend(ax.collections)
 
         # Set title
-        years = df_pivot.index
+        years = data.loc[data[variable].notna(), 'Year']
         if not title_var:
             # If no title_var is given, use the variable name
             title_var = variable
@@ -329,9 +485,8 @@ def plot_growth_rate(
         fig.suptitle(f'Growth of Variables ({years.min()} - {years.max()})')
 
     # Save figure
-    save_name = '_and_'.join(variables)
-    save_fig(fig, f'growth_rate_{save_name.replace(" ", "_")}',
-             'water_management', experimental=True)
+    save_fig(fig, save_name, 'water_management', experimental=True, fingerprint=fingerprint,
+             rasterize=polygon_layers)
 
     # Restore plot settings
     plt.rcParams.update(settings)
@@ -341,6 +496,50 @@ def plot_growth_rate(
     return fig, axs
 
 
+def plot_coverage(coverage: pd.DataFrame, ax=None, cmap='RdYlGn'):
+    """
+    Draws a country x year matrix of data availability as a single image, one pixel block per cell.
+    Much faster than a heatmap of one rectangle per cell, even for all countries and years.
+
+    :param coverage: Dataframe with one row per country and one column per year, with values from 0 to 1,
+    e.g. AvailabilityIndex.to_frame() or AvailabilityIndex.coverage()
+    :param ax: Optional. Axes to draw on. By default, the current axes.
+    :param cmap: Optional. Colormap from 0 (no data) to 1 (data)
+    :return: The image
+    """
+    if ax is None:
+        ax = plt.gca()
+
+    n_countries, n_years = coverage.shape
+    image = ax.imshow(coverage.to_numpy(dtype='float64'), cmap=cmap, vmin=0, vmax=1, aspect='auto',
+                      interpolation='nearest')
+
+    # Label every country, but only about 20 years
+    ax.set_yticks(np.arange(n_countries), coverage.index)
+    year_step = max(math.ceil(n_years / 20), 1)
+    ax.set_xticks(np.arange(0, n_years, year_step), coverage.columns[::year_step], rotation=90)
+
+    # Cell borders
+    ax.set_xticks(np.arange(n_years + 1) - 0.5, minor=True)
+    ax.set_yticks(np.arange(n_countries + 1) - 0.5, minor=True)
+    ax.grid(which='minor', color='gray', linewidth=0.5)
+    ax.tick_params(which='minor', length=0)
+    return image
+
+
+def _get_availability(df, variables, include_countries=None) -> pd.DataFrame:
+    """
+    Returns whether all variables have data as a country x year dataframe,
+    without the countries and years that have no data at all.
+    """
+    data = df[['Country', 'Year', *variables]]
+    if include_countries:
+        data = data[data['Country'].isin(include_countries)]
+
+    availability = AvailabilityIndex.from_frame(data).to_frame(variables)
+    return availability.loc[availability.any(axis=1), availability.any(axis=0)]
+
+
 def show_data(df, variables, include_countries=None):
     """
     Creates a plot showing whether data exists for variables in countries and years.
@@ -350,27 +549,12 @@ def show_data(df, variables, include_countries=None):
     :param variables: Variables to check for.
     :param include_countries: Optional. Filter for specific countries.
     """
-    if include_countries is None:
-        include_countries = []
-
     if isinstance(variables, str):
         variables = [variables]
 
-    '''Extract relevant variables and drop all NaN'''
-    data = df[['Country', 'Year', *variables]]
-    if include_countries:
-        data = data[data['Country'].isin(include_countries)]
-    data = data.dropna()
-
-    '''Create dataframe for heatmap'''
-    years_data = data[['Country', 'Year']]
-    years_df = years_data.pivot_table(index=['Country'], columns='Year', values='Year', aggfunc=lambda x: True,
-                                      fill_value=False)
-    years_df['True_Count'] = years_df.sum(axis=1)
-    years_df = years_df.sort_values(by='True_Count', ascending=True)
-    years_df.drop('True_Count', axis=1, inplace=True)
-
-    df_numeric = years_df.replace({True: 1, False: 0})
+    '''Create dataframe for the image, countries with the fewest years first'''
+    years_df = _get_availability(df, variables, include_countries)
+    years_df = years_df.iloc[np.argsort(years_df.sum(axis=1).to_numpy(), kind='stable')]
 
     '''spaß mit colormap'''
     cmap_name = 'RdYlGn'
@@ -378,18 +562,10 @@ def show_data(df, variables, include_countries=None):
     color_0 = cmap(0.0)
     color_1 = cmap(1.0)
 
-    '''create heatmap'''
+    '''create image'''
     plt.figure(figsize=(10, math.ceil(
-        math.log(years_data['Country'].nunique(), 2)) * 5))
-    ax = sns.heatmap(df_numeric,
-                     annot=False,
-                     cmap=cmap_name,
-                     linewidths=0.5,
-                     linecolor='gray',
-                     cbar=False,
-                     vmin=0,
-                     vmax=1
-                     )
+        math.log(max(len(years_df), 1), 2)) * 5))
+    plot_coverage(years_df, cmap=cmap_name)
 
     # Manuelle Legende
     blue_patch = patches.Patch(color=color_0, label='no data')
@@ -411,47 +587,27 @@ def plot_quality(aquastat_dataframe, variables, include_countries=None):
     :param variables: Variables to check for.
     :param include_countries: Optional. Filter for specific countries.
     """
-    if include_countries is None:
-        include_countries = []
-
     if isinstance(variables, str):
         variables = [variables]
 
-    '''Extract relevant variables and drop all NaN'''
+    '''Rename some countries'''
     data = aquastat_dataframe[['Country', 'Year', *variables]]
     if include_countries:
         data = data[data['Country'].isin(include_countries)]
-    data = data.dropna()
+    data = data.assign(Country=normalize_countries(data['Country']).astype(object))
 
-    '''Create dataframe for map'''
-    countries_data = data[['Country', 'Year']]
-    countries_df = countries_data.pivot_table(index=['Country'], columns='Year', values='Year', aggfunc=lambda x: True,
-                                              fill_value=False)
-    countries_df['True_Count'] = countries_df.sum(
-        axis=1) / countries_df.shape[1]
-    countries_df = countries_df.sort_values(by='True_Count', ascending=True)
-
-    years_data = data[['Country', 'Year']]
-    years_df = years_data.pivot_table(index=['Country'], columns='Year', values='Year', aggfunc=lambda x: True,
-                                      fill_value=False)
-    years_df['True_Count'] = years_df.sum(axis=1)
-    years_df = years_df.sort_values(by='True_Count', ascending=True)
-    years_df.drop('True_Count', axis=1, inplace=True)
-
-    '''Rename some countries'''
-    for country in countries_df['Country'].unique():
-        replace_to = rename_aquastat_country(country)
-        countries_df.replace(to_replace={country: replace_to}, inplace=True)
+    '''Share of the years with data of each country'''
+    years_df = _get_availability(data, variables)
+    quality = years_df.mean(axis=1)
 
     '''Create map'''
     plt.figure(figsize=(10, math.ceil(
-        math.log(years_data['Country'].nunique(), 2)) * 5))
+        math.log(max(len(years_df), 1), 2)) * 5))
     '''Plot using geopandas'''
 
-    world = gpd.read_file(to_dat_path(
-        'naturalearth/ne_110m_admin_0_countries.shx'), engine="pyogrio")
-    world = world.merge(countries_df, left_on='SOVEREIGNT', right_on='Country')
-    world.plot(column='True_Count', cmap='RdYlGn', legend=True, figsize=(20, 20),
+    values = to_world_values(quality.index, quality)
+    has_data = ~np.isnan(values)
+    get_world()[has_data].plot(column=values[has_data], cmap='RdYlGn', legend=True, figsize=(20, 20),
                legend_kwds={'label': "Data Quality", 'orientation': "horizontal", 'shrink': 0.5})
 
     plt.title('Presence of variables in year')
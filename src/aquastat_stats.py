@@ -0,0 +1,263 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from src.aquastat_cube import AquastatCube
+from src.utils import make_list
+
+
+def signed_log10(values) -> np.ndarray:
+    """
+    Returns log10(x) for positive and -log10(-x) for negative values, 0 stays 0.
+    The log scale of get_growth_rate and get_slope for whole arrays.
+    """
+    values = np.asarray(values, dtype='float64')
+    magnitudes = np.abs(values)
+    logs = np.log10(magnitudes, out=np.zeros_like(values), where=magnitudes > 0)
+    return np.sign(values) * logs
+
+
+def _masked_moments(x, y, mask) -> tuple[np.ndarray, ...]:
+    """
+    Returns the sufficient statistics of every row of y against x, only counting the valid observations.
+    The sums of squares and products are centered on the row means for numerical stability.
+
+    :param x: Array of the x values, broadcastable to y, e.g. the years
+    :param y: Array of the y values, the observations of a row along the last axis
+    :param mask: Boolean array with the same shape as y, True for valid observations
+    :return: Tuple of n, mean_x, mean_y, sxx, syy and sxy, one value per row
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64'))
+    n = mask.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.where(mask, x, 0).sum(axis=-1) / n
+        mean_y = np.where(mask, y, 0).sum(axis=-1) / n
+
+        dx = np.where(mask, x - mean_x[..., None], 0)
+        dy = np.where(mask, y - mean_y[..., None], 0)
+    return n, mean_x, mean_y, (dx * dx).sum(axis=-1), (dy * dy).sum(axis=-1), (dx * dy).sum(axis=-1)
+
+
+def _regression_stats(n, mean_x, mean_y, sxx, syy, sxy, min_observations=3) -> dict[str, np.ndarray]:
+    """
+    Returns the results of scipy.stats.linregress from the sufficient statistics of _masked_moments.
+    Entries with less than min_observations valid observations or without variation in x or y are NaN.
+
+    :return: Dictionary of arrays with the keys 'slope', 'intercept', 'r', 'p' and 'stderr'
+    """
+    valid = (n >= max(min_observations, 3)) & (sxx > 0) & (syy > 0)
+    dof = np.where(valid, n - 2, 1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(valid, sxy / sxx, np.nan)
+        r = np.clip(np.where(valid, sxy / np.sqrt(sxx * syy), np.nan), -1, 1)
+        t = r * np.sqrt(dof / ((1 - r) * (1 + r)))
+        stderr = np.sqrt((1 - r * r) * syy / sxx / dof)
+
+    return {
+        'slope': slope,
+        'intercept': mean_y - slope * mean_x,
+        'r': r,
+        'p': 2 * stats.t.sf(np.abs(t), dof),
+        'stderr': stderr,
+    }
+
+
+def _grouped_moments(codes, n_groups, x, y) -> tuple[np.ndarray, ...]:
+    """
+    Returns the sufficient statistics of every group of observations, like _masked_moments for ragged groups.
+
+    :param codes: Group of every observation, from 0 to n_groups - 1
+    :param n_groups: Number of groups
+    :param x: x value of every observation
+    :param y: y value of every observation
+    :return: Tuple of n, mean_x, mean_y, sxx, syy and sxy, one value per group
+    """
+    n = np.bincount(codes, minlength=n_groups)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.bincount(codes, x, minlength=n_groups) / n
+        mean_y = np.bincount(codes, y, minlength=n_groups) / n
+
+    dx = x - mean_x[codes]
+    dy = y - mean_y[codes]
+    return (n, mean_x, mean_y, np.bincount(codes, dx * dx, minlength=n_groups),
+            np.bincount(codes, dy * dy, minlength=n_groups), np.bincount(codes, dx * dy, minlength=n_groups))
+
+
+def growth_rates(values, mask=None, min_observations=2) -> np.ndarray:
+    """
+    Returns the relative growth in % from the first to the last valid value of every row.
+    Vectorized version of get_growth_rate.
+
+    :param values: Array with the time series along the last axis
+    :param mask: Optional. Boolean array, True for valid values. By default, all values that are not NaN.
+    :param min_observations: Rows with less valid values get NaN
+    :return: Array with one rate per row, NaN if the first value is 0
+    """
+    values = np.asarray(values, dtype='float64')
+    mask = ~np.isnan(values) if mask is None else mask
+
+    last_index = values.shape[-1] - 1
+    first = np.take_along_axis(values, mask.argmax(axis=-1)[..., None], axis=-1)[..., 0]
+    last = np.take_along_axis(values, last_index - mask[..., ::-1].argmax(axis=-1)[..., None], axis=-1)[..., 0]
+
+    valid = (mask.sum(axis=-1) >= min_observations) & (first != 0)
+    rates = np.full(first.shape, np.nan)
+    np.divide((last - first) * 100, first, out=rates, where=valid)
+    return rates
+
+
+def ols_slopes(x, values, mask=None, min_observations=2) -> np.ndarray:
+    """
+    Returns the least squares slope of every row against x, only using its valid values.
+    Vectorized version of get_slope.
+
+    :param x: x values of the last axis, e.g. the years
+    :param values: Array with the time series along the last axis
+    :param mask: Optional. Boolean array, True for valid values. By default, all values that are not NaN.
+    :param min_observations: Rows with less valid values get NaN
+    :return: Array with one slope per row, NaN if x does not vary
+    """
+    values = np.asarray(values, dtype='float64')
+    mask = ~np.isnan(values) if mask is None else mask
+
+    n, _, _, sxx, _, sxy = _masked_moments(x, values, mask)
+    valid = (n >= min_observations) & (sxx > 0)
+    slopes = np.full(n.shape, np.nan)
+    np.divide(sxy, sxx, out=slopes, where=valid)
+    return slopes
+
+
+def get_growth_rates(data: pd.DataFrame, variables, slope=False, log_scale=False) -> pd.DataFrame:
+    """
+    Returns the growth of every country for several variables at once.
+    Every country uses all of its own years with data, not only the years in which all countries have data.
+
+    :param data: Dataframe with the columns 'Country', 'Year' and the variables, see get_aquastat()
+    :param variables: Variable or list of variables
+    :param slope: If True, the least squares slope per year. Otherwise, the relative growth in %
+    from the first to the last year with data.
+    :param log_scale: If True, return signed_log10 of the growth
+    :return: Dataframe with one row per country and one column per variable, NaN for countries
+    with less than two values
+
+    Example:
+    >>> get_growth_rates(df, ['Total population', 'Urban population'], slope=True)
+    """
+    variables = make_list(variables, 1)
+    cube = AquastatCube.from_wide(data[['Country', 'Year', *variables]])
+
+    # One time series per variable and country along the last axis
+    values = cube.values.transpose(2, 0, 1)
+    mask = cube.mask.transpose(2, 0, 1)
+
+    if slope:
+        rates = ols_slopes(cube.years.to_numpy(), values, mask)
+    else:
+        rates = growth_rates(values, mask)
+    if log_scale:
+        rates = signed_log10(rates)
+
+    return pd.DataFrame(rates.T, index=cube.countries, columns=cube.variables)
+
+
+def get_lagged_correlations(data: pd.DataFrame, target, variables=None, max_lag=10, min_lag=1,
+                            min_observations=3) -> pd.DataFrame:
+    """
+    Correlates a target variable with earlier values of other variables, for every variable and lag at once.
+    The lags are built within every country, so a value is never paired with the value of another country.
+    The pairs of all countries are pooled, and each lag is evaluated for all variables in one array operation.
+
+    :param data: Dataframe with the columns 'Country', 'Year' and the variables, see get_aquastat()
+    :param target: Variable that is explained, e.g. 'Population affected by water related disease'
+    :param variables: Optional. Variable or list of lagged variables. By default, all other variables of data.
+    :param max_lag: Optional. Largest lag in years
+    :param min_lag: Optional. Smallest lag in years, 0 pairs the values of the same year
+    :param min_observations: Optional. Pairs with less observations get NaN
+    :return: Dataframe with one row per variable and lag and the columns 'Variable', 'Lag', 'Observations',
+    'Correlation', 'Slope', 'Intercept', 'P-value' and 'Stderr', see scipy.stats.linregress.
+    NaN for pairs without variation or with too few observations.
+
+    Example:
+    >>> correlations = get_lagged_correlations(df, 'Population affected by water related disease', max_lag=10)
+    >>> correlations.dropna().sort_values('Correlation', key=abs).tail()
+    """
+    if variables is None:
+        variables = list(data.columns)
+    variables = [variable for variable in make_list(variables, 1) if variable not in ('Country', 'Year', target)]
+    cube = AquastatCube.from_wide(data[['Country', 'Year', target, *variables]])
+
+    # Spread the years over a range without gaps, so a shift by one position is a shift by one year
+    positions = cube.years.to_numpy() - cube.years.min()
+    n_years = positions.max() + 1 if len(positions) else 0
+    values = np.full((len(cube.countries), n_years, len(cube.variables)), np.nan)
+    values[:, positions] = cube.values
+
+    target_values = values[..., 0]
+    lagged_values = values[..., 1:].transpose(2, 0, 1)
+
+    results = []
+    for lag in range(min_lag, max_lag + 1):
+        # Value of the year - lag next to the target in the year, pooled over all countries
+        x = lagged_values[..., :max(n_years - lag, 0)].reshape(len(variables), -1)
+        y = target_values[:, lag:].reshape(-1)
+        mask = ~np.isnan(x) & ~np.isnan(y)
+
+        n, *moments = _masked_moments(x, y, mask)
+        regression = _regression_stats(n, *moments, min_observations=min_observations)
+        results.append(pd.DataFrame({
+            'Variable': variables,
+            'Lag': lag,
+            'Observations': n,
+            'Correlation': regression['r'],
+            'Slope': regression['slope'],
+            'Intercept': regression['intercept'],
+            'P-value': regression['p'],
+            'Stderr': regression['stderr'],
+        }))
+
+    return pd.concat(results, ignore_index=True)
+
+
+def linregress_groups(data: pd.DataFrame, x, y, by=None, min_observations=3) -> pd.DataFrame:
+    """
+    Fits y against x with least squares in every group, like scipy.stats.linregress per group,
+    but all groups are computed together from grouped sums. Rows with NaN in x, y or the group keys are left out.
+
+    :param data: Long dataframe with one observation per row
+    :param x: Column of the independent variable
+    :param y: Column of the dependent variable
+    :param by: Optional. Column or list of columns to group by, e.g. 'Year' or ['Country', 'Variable'].
+    By default, one fit of all rows. Categorical keys only get rows for the observed categories.
+    :param min_observations: Optional. Groups with less observations get NaN
+    :return: Dataframe with one row per group, indexed by the group keys, and the columns 'Observations',
+    'Correlation', 'Slope', 'Intercept', 'P-value' and 'Stderr'. NaN for groups without variation.
+
+    Example:
+    >>> linregress_groups(df, 'Treated municipal water share', 'GDP per capita', by='Year')
+    >>> linregress_groups(df, 'Year', 'Total population', by='Country')['Slope']
+    """
+    data = data.dropna(subset=[x, y])
+    if by is None:
+        codes = np.zeros(len(data), dtype='int64')
+        keys = pd.RangeIndex(1)
+    else:
+        # Rows with NaN group keys are not part of any group, ngroup would number them NaN
+        data = data[data[make_list(by, 1)].notna().all(axis=1)]
+        grouped = data.groupby(by, sort=True, observed=True, dropna=True)
+        codes = grouped.ngroup().to_numpy(dtype='intp')
+        keys = grouped.size().index
+
+    n, *moments = _grouped_moments(codes, len(keys), data[x].to_numpy(dtype='float64'),
+                                   data[y].to_numpy(dtype='float64'))
+    regression = _regression_stats(n, *moments, min_observations=min_observations)
+    return pd.DataFrame({
+        'Observations': n,
+        'Correlation': regression['r'],
+        'Slope': regression['slope'],
+        'Intercept': regression['intercept'],
+        'P-value': regression['p'],
+        'Stderr': regression['stderr'],
+    }, index=keys)
@@ -1,24 +1,22 @@
 import os
+import sys
 from pathlib import Path
 
-import geopandas as gpd
-import math
-import matplotlib
-import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import seaborn as sns
 from tueplots import bundles
-from tueplots.constants.color import rgb
 
-from src.utils import get_dataframe, to_dat_path
+from src.datasets import DATASETS
+from src.utils import download_dataset, file_hash, hash_objects, make_list, read_cached_frame, to_dat_path, \
+    write_cached_frame
 
 plt.rcParams.update(bundles.icml2022())
 plt.rcParams.update({"figure.dpi": 200})
 
 PATH_TO_DAT = Path(__file__).parent / '..' / 'dat'
-FILE_NAME = 'fao_aquastat.csv'
-CSV_URL = 'https://yaon.org/data.csv'
+FILE_NAME = DATASETS['aquastat']['file_path']
+CSV_URL = DATASETS['aquastat']['url']
 
 AQUASTAT_COUNTRY_MAPPING = {
     'Bolivia (Plurinational State of)': 'Bolivia',
@@ -73,40 +71,262 @@ AQUASTAT_COUNTRY_MAPPING = {
 AQUASTAT_SOURCE = 'Source: AQUASTAT'
 
 
-def get_aquastat(raw=False) -> pd.DataFrame | None:
+AQUASTAT_VARIABLE_MAPPING = {
+    'Area equipped for irrigation by direct use of non-treated municipal wastewater ': 'Area equipped for irrigation by direct use of not treated municipal wastewater'
+}
+
+# Bump this if the processing in get_aquastat changes, so old caches are rebuilt
+AQUASTAT_CACHE_VERSION = 4
+AQUASTAT_CACHE_SOURCE = Path(FILE_NAME).stem
+
+# Number of csv rows read at once when only a slice of the data is requested
+AQUASTAT_CHUNK_SIZE = 100_000
+
+AQUASTAT_RAW_DTYPES = {
+    'Country': 'category',
+    'Variable': 'category',
+    'Unit': 'category',
+    'Year': 'int16',
+}
+
+
+def get_aquastat(raw=False, use_cache=True, compact=False, float32=False, variables=None, countries=None,
+                 years=None) -> pd.DataFrame | None:
+    """
+    Returns the AQUASTAT dataframe.
+    The raw and the pivoted dataframe are cached in 'dat/cache'. The cache is keyed by the content
+    of the csv file and the mapping tables and is rebuilt automatically if one of them changes.
+
+    The variables, countries and years filters are applied while reading, before the table is pivoted.
+    With the cache, the first call reads the full csv file and caches the whole table, also if it is filtered.
+    Every later call then only reads its slice from the cache.
+    Only with use_cache=False, the csv file is read in chunks and only the requested slice is kept in memory.
+
+    :param raw: If True, return the long table with one row per country, year and variable,
+    with the original AQUASTAT country names. Otherwise, return the pivoted table with one column per variable
+    and the country names of the world map.
+    :param use_cache: If False, the csv file is processed again and the cache is not touched.
+    Use it for a single filtered read that should not hold the full table in memory.
+    :param compact: Only with raw. If True, Country, Variable and Unit are categorical and Year is int16.
+    The memory footprint is printed next to the one with default dtypes.
+    :param float32: Only with raw and compact. If True, Value is stored as float32.
+    :param variables: Optional. Only return these variables. Rows without any of them are dropped.
+    :param countries: Optional. Only return these countries (AQUASTAT or world map names).
+    :param years: Optional. Only return these years.
+    :return: The dataframe or None if the data could not be loaded
+
+    Example:
+    >>> get_aquastat(variables=['Total population'], countries=['Germany'], years=range(2000, 2010))
+    """
     file_path = FILE_NAME
     print(f'Getting AQUASTAT dataframe from {file_path} ...')
 
     # Download the data from https://yaon.org/data.csv
-    import_df = get_dataframe(file_path=file_path, url=CSV_URL)
-    if import_df is None:
+    if not download_dataset(file_path=file_path, url=CSV_URL):
         print('Could not get the AQUASTAT Dataframe!')
         return None
 
+    filters = _get_aquastat_filters(variables, countries, years)
+    variables = filters.get('Variable')
+
+    if not use_cache:
+        import_df = _read_aquastat_csv(to_dat_path(file_path), _to_raw_filters(filters))
+        if raw:
+            return _format_raw_aquastat(import_df, compact, float32)
+        return pivot_aquastat(import_df, variables)
+
+    name = 'raw' if raw else 'wide'
+    cache_key = get_aquastat_cache_key()
+    df = _read_cached_aquastat(name, cache_key, filters)
+    if df is None:
+        # Cache the whole table once, then read the requested slice of it
+        df = _build_aquastat_cache(name, cache_key)
+        if filters:
+            df = _read_cached_aquastat(name, cache_key, filters)
+
+    if raw:
+        return _format_raw_aquastat(df, compact, float32)
+    df.columns.name = 'Variable'
+    return df
+
+
+def _build_aquastat_cache(name, cache_key) -> pd.DataFrame:
+    """
+    Writes the full raw or pivoted AQUASTAT table to the cache and returns it.
+    The pivoted table is built from the cached raw table if there is one, otherwise the csv file is read
+    and both tables are cached.
+    """
+    import_df = _read_cached_aquastat('raw', cache_key, {})
+    if import_df is None:
+        import_df = _read_aquastat_csv(to_dat_path(FILE_NAME))
+        write_cached_frame(import_df, AQUASTAT_CACHE_SOURCE, 'raw', cache_key)
+    if name == 'raw':
+        return import_df
+
+    df = pivot_aquastat(import_df)
+    write_cached_frame(df, AQUASTAT_CACHE_SOURCE, 'wide', cache_key)
+    return df
+
+
+def _get_aquastat_filters(variables, countries, years) -> dict:
+    """
+    Returns the requested filters as a dictionary from column to list of values.
+    """
+    filters = {}
+    if variables is not None:
+        filters['Variable'] = make_list(variables, 1)
+    if countries is not None:
+        filters['Country'] = [rename_aquastat_country(country) for country in make_list(countries, 1)]
+    if years is not None:
+        filters['Year'] = [int(year) for year in ([years] if isinstance(years, int) else years)]
+    return filters
+
+
+def _to_raw_filters(filters) -> dict:
+    """
+    Converts the country filter from world map names to the names in the raw table.
+    """
+    if 'Country' not in filters:
+        return filters
+
+    normalized = set(filters['Country'])
+    raw_countries = {country for country in normalized if country not in AQUASTAT_COUNTRY_MAPPING}
+    raw_countries |= {country for country, renamed in AQUASTAT_COUNTRY_MAPPING.items() if renamed in normalized}
+    return filters | {'Country': sorted(raw_countries)}
+
+
+def _read_cached_aquastat(name, cache_key, filters) -> pd.DataFrame | None:
+    """
+    Reads the requested slice of a cached AQUASTAT dataframe or returns None if it is not cached.
+    """
+    if name == 'raw':
+        filters = _to_raw_filters(filters)
+        return read_cached_frame(AQUASTAT_CACHE_SOURCE, name, cache_key,
+                                 filters=[(column, 'in', values) for column, values in filters.items()] or None)
+
+    variables = filters.get('Variable')
+    columns = None if variables is None else ['Country', 'Year', *variables]
+    row_filters = [(column, 'in', values) for column, values in filters.items() if column != 'Variable']
+    df = read_cached_frame(AQUASTAT_CACHE_SOURCE, name, cache_key, columns=columns, filters=row_filters or None)
+
+    if df is not None and variables is not None:
+        df = df.dropna(how='all', subset=df.columns[2:]).reset_index(drop=True)
+    return df
+
+
+def _read_aquastat_csv(file_path, filters=None) -> pd.DataFrame:
+    """
+    Reads the AQUASTAT csv file into the compact long table.
+    With filters, the file is read in chunks and only matching rows are kept.
+    get_aquastat only passes filters with use_cache=False, the cache is always built from the full file.
+    """
+    if not filters:
+        return _prepare_aquastat(pd.read_csv(file_path, dtype=AQUASTAT_RAW_DTYPES))
+
+    print(f'Reading {os.path.basename(file_path)} in chunks ...')
+    chunks = []
+    for chunk in pd.read_csv(file_path, dtype=AQUASTAT_RAW_DTYPES, chunksize=AQUASTAT_CHUNK_SIZE):
+        chunk = _prepare_aquastat(chunk)
+        mask = np.ones(len(chunk), dtype=bool)
+        for column, values in filters.items():
+            mask &= chunk[column].isin(values).to_numpy()
+        chunks.append(chunk[mask])
+
+    # The chunks have different categories, so build them again for the whole slice
+    import_df = pd.concat(chunks, ignore_index=True)
+    for column in ['Country', 'Variable', 'Unit']:
+        import_df[column] = import_df[column].astype(object).astype('category')
+    return import_df
+
+
+def _prepare_aquastat(import_df) -> pd.DataFrame:
+    """
+    Formats a freshly read (part of the) AQUASTAT csv file.
+    """
     # Format dataframe
     import_df.drop(columns=['Unnamed: 0'], inplace=True)
 
     # Fix some variables
-    map_dict = {
-        'Area equipped for irrigation by direct use of non-treated municipal wastewater ': 'Area equipped for irrigation by direct use of not treated municipal wastewater'
-    }
-    for key, value in map_dict.items():
-        import_df.replace(to_replace={key: value}, inplace=True)
+    import_df['Variable'] = _map_categories(import_df['Variable'],
+                                            lambda variable: AQUASTAT_VARIABLE_MAPPING.get(variable, variable))
 
-    # Return raw dataframe
-    if raw:
-        return import_df
+    # Keep the original country names, they are only renamed in the pivoted table
+    import_df['Country'] = import_df['Country'].astype('category')
+
+    return import_df
 
-    # Pivot table
-    df = import_df.pivot_table(index=['Country', 'Year'], columns='Variable', values='Value', aggfunc='first')
-    df.reset_index(inplace=True)
 
-    # Rename some countries to be compatible with the world map
-    rename_aquastat_countries(df)
+def pivot_aquastat(raw_df: pd.DataFrame, variables=None) -> pd.DataFrame:
+    """
+    Pivots the long AQUASTAT table to one row per country and year and one column per variable.
+    The countries are renamed to the names of the world map, see normalize_countries.
+
+    :param raw_df: The raw AQUASTAT table, see get_aquastat(raw=True)
+    :param variables: Optional. Order of the variable columns. Variables without data are left out.
+    :return: The pivoted dataframe
+    """
+    # Group on the country codes, but keep plain strings as variable names
+    raw_df = raw_df.assign(Country=normalize_countries(raw_df['Country']), Variable=raw_df['Variable'].astype(object),
+                           Year=raw_df['Year'].astype('int64'))
+    df = raw_df.pivot_table(index=['Country', 'Year'], columns='Variable', values='Value', aggfunc='first',
+                            observed=True)
+    df.reset_index(inplace=True)
+    df['Country'] = df['Country'].astype(object)
 
+    if variables is not None:
+        df = df[['Country', 'Year', *[variable for variable in variables if variable in df.columns]]]
     return df
 
 
+def _format_raw_aquastat(raw_df: pd.DataFrame, compact, float32) -> pd.DataFrame:
+    """
+    Converts the compact raw AQUASTAT table to the requested dtypes.
+    """
+    if not compact:
+        return raw_df.astype({column: object for column in ['Country', 'Variable', 'Unit']} | {'Year': 'int64'})
+
+    if float32:
+        raw_df['Value'] = raw_df['Value'].astype('float32')
+
+    compact_bytes, default_bytes = get_memory_footprint(raw_df)
+    print(f'Memory footprint: {compact_bytes / 1e6:.2f} MB (default dtypes: {default_bytes / 1e6:.2f} MB)')
+    return raw_df
+
+
+def get_memory_footprint(df: pd.DataFrame) -> tuple[int, int]:
+    """
+    Returns the memory footprint of a dataframe and the footprint it would have with the dtypes
+    pd.read_csv infers, i.e. object strings instead of categories and 64 bit numbers.
+    The latter is estimated without converting the dataframe.
+
+    :param df: The dataframe
+    :return: Tuple of bytes used now and bytes used with default dtypes
+    """
+    memory = df.memory_usage(deep=True)
+    default_memory = memory.copy()
+
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # One pointer per row plus one string object per row
+            category_sizes = np.array([sys.getsizeof(category) for category in values.cat.categories])
+            counts = np.bincount(values.cat.codes[values.cat.codes >= 0], minlength=len(category_sizes))
+            default_memory[column] = len(values) * 8 + int(category_sizes @ counts)
+        elif pd.api.types.is_numeric_dtype(values.dtype):
+            default_memory[column] = len(values) * 8
+
+    return int(memory.sum()), int(default_memory.sum())
+
+
+def get_aquastat_cache_key() -> str:
+    """
+    Returns the key of the cached AQUASTAT dataframes.
+    It changes whenever the csv file, the mapping tables or the processing changes.
+    """
+    return hash_objects(file_hash(to_dat_path(FILE_NAME)), AQUASTAT_COUNTRY_MAPPING, AQUASTAT_VARIABLE_MAPPING,
+                        AQUASTAT_CACHE_VERSION)
+
+
 def rename_aquastat_country(country):
     global AQUASTAT_COUNTRY_MAPPING
 
@@ -115,13 +335,100 @@ def rename_aquastat_country(country):
     return country
 
 
+def normalize_countries(countries) -> pd.Series:
+    """
+    Maps AQUASTAT country names to the names used by the Natural Earth world map.
+    Every unique name is looked up once, the values themselves are never scanned again.
+    Names that are already normalized stay the same.
+
+    :param countries: Series (or list) of country names
+    :return: Categorical series with the sorted normalized names as categories.
+    The category codes can be used as canonical country codes.
+    """
+    return _map_categories(countries, rename_aquastat_country)
+
+
+def _map_categories(values, func) -> pd.Series:
+    """
+    Applies func to every unique value and returns a categorical series with sorted categories.
+    Values that are mapped to the same result share one category.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+
+    mapped = pd.Index([func(value) for value in uniques])
+    categories = mapped.unique().sort_values()
+
+    # Map the codes of the unique values to the codes of the categories, keep -1 for missing values
+    unique_to_category = np.append(categories.get_indexer(mapped), -1)
+    categorical = pd.Categorical.from_codes(unique_to_category[codes], categories=categories)
+
+    return pd.Series(categorical, index=values.index, name=values.name)
+
+
 def rename_aquastat_countries(df):
-    global AQUASTAT_COUNTRY_MAPPING
+    """
+    Renames the countries in the 'Country' column of df in place, see normalize_countries.
+    """
     print('Renaming countries ...')
+    df['Country'] = normalize_countries(df['Country']).astype(object)
+
+
+# Variable metadata, built on first access by get_variable_info
+_variable_info = None
+
+
+def get_variable_info() -> pd.DataFrame:
+    """
+    Returns metadata for every AQUASTAT variable.
+    The index is built on first access and cached in 'dat/cache' next to the AQUASTAT dataframes.
+
+    :return: Dataframe indexed by variable with the columns 'Unit', 'First year', 'Last year' and 'Countries'
+    """
+    global _variable_info
+
+    if _variable_info is not None:
+        return _variable_info
+
+    if not download_dataset(file_path=FILE_NAME, url=CSV_URL):
+        raise FileNotFoundError(f'Could not get {FILE_NAME}!')
+
+    cache_key = get_aquastat_cache_key()
+    info = read_cached_frame(AQUASTAT_CACHE_SOURCE, 'variables', cache_key)
+    if info is None:
+        raw_df = get_aquastat(raw=True, compact=True)
+        info = raw_df.groupby('Variable', observed=True).agg(**{
+            'Unit': ('Unit', 'first'),
+            'First year': ('Year', 'min'),
+            'Last year': ('Year', 'max'),
+            'Countries': ('Country', 'nunique'),
+        }).reset_index()
+        info = info.astype({'Variable': object, 'Unit': object, 'First year': 'int64', 'Last year': 'int64'})
+        write_cached_frame(info, AQUASTAT_CACHE_SOURCE, 'variables', cache_key)
+
+    _variable_info = info.set_index('Variable')
+    return _variable_info
+
+
+def get_variable_unit(variable) -> str | None:
+    """
+    Returns the unit of an AQUASTAT variable or None if the variable is unknown.
+    """
+    info = get_variable_info()
+    if variable not in info.index:
+        return None
+    return info.at[variable, 'Unit']
+
 
-    for country in df['Country'].unique():
-        if country in AQUASTAT_COUNTRY_MAPPING:
-            df.replace(to_replace={country: AQUASTAT_COUNTRY_MAPPING[country]}, inplace=True)
+def get_variable_units() -> dict:
+    """
+    Returns a dictionary mapping every AQUASTAT variable to its unit.
+    """
+    return get_variable_info()['Unit'].to_dict()
 
 
-VAR_TO_UNIT_DICT = get_aquastat(True)[['Variable', 'Unit']].drop_duplicates().set_index('Variable').to_dict()['Unit']
+def __getattr__(name):
+    # VAR_TO_UNIT_DICT used to be built at import time, build it lazily instead
+    if name == 'VAR_TO_UNIT_DICT':
+        return get_variable_units()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.aquastat_cube import AquastatCube
+from src.aquastat_utils import AQUASTAT_CACHE_SOURCE, get_aquastat, get_aquastat_cache_key
+from src.utils import get_cache_file_path, hash_objects, make_list, write_cached_file
+
+# Bump this if the layout of the availability index changes, so old caches are rebuilt
+AVAILABILITY_VERSION = 1
+
+# Number of set bits of every byte
+_POPCOUNT = np.unpackbits(np.arange(256, dtype='uint8')[:, None], axis=1).sum(axis=1)
+
+# The availability of all AQUASTAT data, loaded once per process by get_availability_index
+_availability_index = None
+
+
+class AvailabilityIndex:
+    """
+    Bitmap of the AQUASTAT cells that hold data: one bit per country, year and variable, packed
+    8 variables per byte. Queries over sets of variables are bitwise operations on whole bytes.
+
+    Example:
+    >>> index = get_availability_index()
+    >>> index.countries_with_all(['Total population', 'GDP per capita'], 2020)
+    >>> index.has_all(['Total population', 'GDP per capita'])  # country x year boolean array
+    """
+
+    def __init__(self, countries, years, variables, bits: np.ndarray):
+        """
+        :param countries: Country names, one per entry of the first axis
+        :param years: Years, one per entry of the second axis
+        :param variables: Variable names, in the order of the bits along the third axis
+        :param bits: uint8 array of shape (countries, years, ceil(variables / 8)), see np.packbits
+        """
+        self.countries = pd.Index(countries, name='Country')
+        self.years = pd.Index(years, name='Year')
+        self.variables = pd.Index(variables, name='Variable')
+
+        expected_shape = (len(self.countries), len(self.years), (len(self.variables) + 7) // 8)
+        if bits.shape != expected_shape:
+            raise ValueError(f'bits has shape {bits.shape}, expected {expected_shape}!')
+        self.bits = bits
+
+    @classmethod
+    def from_cube(cls, cube: AquastatCube) -> 'AvailabilityIndex':
+        """
+        Builds the index from the validity mask of a cube.
+        """
+        return cls(cube.countries, cube.years, cube.variables, np.packbits(cube.mask, axis=2))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'AvailabilityIndex':
+        """
+        Builds the index from a pivoted dataframe with the columns 'Country', 'Year' and one column
+        per variable, see get_aquastat(). A cell is available if it is not NaN.
+        """
+        return cls.from_cube(AquastatCube.from_wide(df))
+
+    def get_query(self, variables) -> np.ndarray:
+        """
+        Returns the packed bits of a set of variables, to combine with self.bits.
+
+        :param variables: Variable or list of variables. Unknown variables raise a KeyError.
+        """
+        variables = make_list(variables, 1)
+        positions = self.variables.get_indexer_for(variables)
+        if (positions < 0).any():
+            unknown = [variable for variable in variables if variable not in self.variables]
+            raise KeyError(f'Unknown variables: {", ".join(unknown)}')
+
+        selected = np.zeros(len(self.variables), dtype=bool)
+        selected[positions] = True
+        return np.packbits(selected)
+
+    def has_all(self, variables) -> np.ndarray:
+        """
+        Returns a country x year boolean array, True where all variables have data.
+        """
+        query = self.get_query(variables)
+        return ((self.bits & query) == query).all(axis=-1)
+
+    def has_any(self, variables) -> np.ndarray:
+        """
+        Returns a country x year boolean array, True where at least one of the variables has data.
+        """
+        return (self.bits & self.get_query(variables)).any(axis=-1)
+
+    def count(self, variables=None) -> np.ndarray:
+        """
+        Returns a country x year array with the number of variables that have data.
+
+        :param variables: Optional. Only count these variables. By default, all variables.
+        """
+        bits = self.bits if variables is None else self.bits & self.get_query(variables)
+        return _POPCOUNT[bits].sum(axis=-1)
+
+    def countries_with_all(self, variables, year) -> pd.Index:
+        """
+        Returns the countries that have data for all variables in a year.
+        """
+        year_bits = self.bits[:, self.years.get_loc(year)]
+        query = self.get_query(variables)
+        return self.countries[((year_bits & query) == query).all(axis=-1)]
+
+    def to_frame(self, variables) -> pd.DataFrame:
+        """
+        Returns has_all(variables) as a country x year dataframe.
+        """
+        return pd.DataFrame(self.has_all(variables), index=self.countries, columns=self.years)
+
+    def coverage(self, variables=None) -> pd.DataFrame:
+        """
+        Returns the share of variables with data as a country x year dataframe, from 0 to 1.
+
+        :param variables: Optional. Only count these variables. By default, all variables.
+        """
+        n_variables = len(self.variables) if variables is None else len(set(make_list(variables, 1)))
+        return pd.DataFrame(self.count(variables) / max(n_variables, 1), index=self.countries, columns=self.years)
+
+
+def get_availability_index() -> AvailabilityIndex:
+    """
+    Returns the availability of all AQUASTAT variables, built once per process and cached in 'dat/cache'.
+    """
+    global _availability_index
+
+    if _availability_index is None:
+        _availability_index = _load_availability_index()
+    return _availability_index
+
+
+def _load_availability_index() -> AvailabilityIndex:
+    cache_key = hash_objects(get_aquastat_cache_key(), AVAILABILITY_VERSION)
+    cache_path = get_cache_file_path(AQUASTAT_CACHE_SOURCE, 'availability', cache_key, suffix='npz')
+    if os.path.isfile(cache_path):
+        print(f'Reading cached {AQUASTAT_CACHE_SOURCE} (availability) ...')
+        with np.load(cache_path, allow_pickle=False) as cached:
+            return AvailabilityIndex(cached['countries'], cached['years'], cached['variables'], cached['bits'])
+
+    print('Building availability index ...')
+    index = AvailabilityIndex.from_frame(get_aquastat())
+
+    def write(tmp_path):
+        # np.savez appends '.npz' to paths, but not to open files
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, countries=index.countries.to_numpy(dtype=str), years=index.years.to_numpy(),
+                     variables=index.variables.to_numpy(dtype=str), bits=index.bits)
+
+    write_cached_file(write, AQUASTAT_CACHE_SOURCE, 'availability', cache_key, suffix='npz')
+    return index
@@ -0,0 +1,260 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+from src.datasets import DATASETS, get_dataset_path
+from src.utils import file_hash, get_cache_file_path, hash_objects, write_cached_file
+
+# Maximum number of bytes of a variable that are read from a file at once
+CLIMATE_CHUNK_BYTES = 64 << 20
+
+# Bump this if the computation of the rollups changes, so old caches are rebuilt
+CLIMATE_CACHE_VERSION = 1
+
+# Named baseline windows for get_climatology
+CLIMATE_BASELINES = {
+    '1979-2000': ('1979', '2000'),
+    '1991-2020': ('1991', '2020'),
+}
+
+# Meteorological seasons by month, December belongs to the winter of the next year
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+
+def get_climate_file_path(dataset) -> str:
+    """
+    Returns the path of a gridded climate dataset.
+
+    :param dataset: Name of the dataset in DATASETS, e.g. 'cmap_precipitation', or the path to a NetCDF file
+    """
+    file_path = get_dataset_path(dataset) if dataset in DATASETS else dataset
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f'{file_path} does not exist! Download it with src.datasets.fetch_dataset.')
+    return file_path
+
+
+def open_climate_data(dataset) -> xr.Dataset:
+    """
+    Opens a gridded climate dataset lazily, values are only read when they are accessed.
+
+    :param dataset: Name of the dataset in DATASETS, e.g. 'cmap_precipitation', or the path to a NetCDF file
+    """
+    return xr.open_dataset(get_climate_file_path(dataset))
+
+
+def accumulate_time_groups(data_array: xr.DataArray, labels, n_groups,
+                           chunk_bytes=CLIMATE_CHUNK_BYTES) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sums a variable over groups of time steps, reading the file in chunks of time steps.
+    Only the time steps between the first and the last labeled one are read and at most
+    chunk_bytes of values are in memory at once. NaN values are skipped.
+
+    :param data_array: Lazily opened variable with a 'time' dimension
+    :param labels: Group of every time step, from 0 to n_groups - 1, or -1 to skip the time step
+    :param n_groups: Number of groups
+    :param chunk_bytes: Optional. Maximum number of bytes read at once
+    :return: Tuple of the sums and the numbers of valid values, both with the shape (n_groups, *grid shape)
+    """
+    data_array = data_array.transpose('time', ...)
+    grid_shape = data_array.shape[1:]
+    labels = np.asarray(labels)
+
+    sums = np.zeros((n_groups, *grid_shape))
+    counts = np.zeros((n_groups, *grid_shape), dtype='int64')
+
+    labeled = np.flatnonzero(labels >= 0)
+    if not labeled.size:
+        return sums, counts
+
+    step_bytes = max(int(np.prod(grid_shape)) * 8, 1)
+    chunk_size = max(chunk_bytes // step_bytes, 1)
+    for start in range(labeled[0], labeled[-1] + 1, chunk_size):
+        stop = min(start + chunk_size, labeled[-1] + 1)
+        chunk_labels = labels[start:stop]
+        chunk = data_array.isel(time=slice(start, stop)).to_numpy().astype('float64', copy=False)
+        valid = ~np.isnan(chunk)
+
+        for label in np.unique(chunk_labels[chunk_labels >= 0]):
+            steps = chunk_labels == label
+            sums[label] += np.where(valid[steps], chunk[steps], 0).sum(axis=0)
+            counts[label] += valid[steps].sum(axis=0)
+
+    return sums, counts
+
+
+def to_means(sums, counts) -> np.ndarray:
+    """
+    Divides sums by counts, NaN where there are no values.
+    """
+    means = np.full(np.shape(sums), np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means
+
+
+def to_grid(values, data_array: xr.DataArray, name=None) -> xr.DataArray:
+    """
+    Wraps values without the time dimension into a DataArray with the grid coordinates of data_array.
+    """
+    data_array = data_array.transpose('time', ...)
+    coords = {key: coord for key, coord in data_array.coords.items() if 'time' not in coord.dims}
+    return xr.DataArray(values, coords=coords, dims=data_array.dims[1:], name=name or data_array.name,
+                        attrs=data_array.attrs)
+
+
+def get_window_labels(data_array: xr.DataArray, window) -> np.ndarray:
+    """
+    Returns 0 for the time steps in the window and -1 for all others.
+
+    :param window: Tuple of the first and last time, inclusive like sel(time=slice(start, end)),
+    e.g. ('1979-01-01', '2000-12-01') or ('1979', '2000')
+    """
+    labels = np.full(data_array.sizes['time'], -1)
+    labels[data_array.indexes['time'].slice_indexer(*window)] = 0
+    return labels
+
+
+def _get_cached_rollup(dataset, variable, name, params, compute) -> xr.DataArray:
+    """
+    Returns a rollup from the NetCDF cache in 'dat/cache' or computes it with compute(data_array) and caches it.
+    The cache is keyed by the content hash of the dataset file, the variable and params.
+    """
+    file_path = get_climate_file_path(dataset)
+    source = Path(file_path).stem
+    cache_key = hash_objects(file_hash(file_path), variable, params, CLIMATE_CACHE_VERSION)
+    cache_path = get_cache_file_path(source, name, cache_key, suffix='nc')
+    if os.path.isfile(cache_path):
+        print(f'Reading cached {source} ({name}) ...')
+        return xr.load_dataset(cache_path)[variable]
+
+    with xr.open_dataset(file_path) as data:
+        rollup = compute(data[variable])
+
+    write_cached_file(lambda tmp_path: rollup.to_dataset(name=variable).to_netcdf(tmp_path), source, name,
+                      cache_key, suffix='nc')
+    return rollup
+
+
+def window_mean(dataset, variable, window, chunk_bytes=CLIMATE_CHUNK_BYTES, use_cache=True) -> xr.DataArray:
+    """
+    Returns the mean of a variable over a time window for every grid cell, skipping NaN values.
+    Same result as data[variable].sel(time=slice(*window)).mean('time'), but the file is read in chunks,
+    so the memory does not grow with the length of the window.
+    The mean is cached in 'dat/cache' per file content, variable and window.
+
+    :param dataset: Name of the dataset in DATASETS or the path to a NetCDF file
+    :param variable: Name of the variable, e.g. 'precip'
+    :param window: Tuple of the first and last time, see get_window_labels
+    :param chunk_bytes: Optional. Maximum number of bytes read at once
+    :param use_cache: Optional. If False, always read the dataset and don't cache the mean.
+
+    Example:
+    >>> window_mean('noaa_global_temperature', 'anom', ('2017', '2022')).plot()
+    """
+    def compute(data_array):
+        sums, counts = accumulate_time_groups(data_array, get_window_labels(data_array, window), 1, chunk_bytes)
+        return to_grid(to_means(sums, counts)[0], data_array)
+
+    if not use_cache:
+        with open_climate_data(dataset) as data:
+            return compute(data[variable])
+
+    name = f'{variable}_mean_{window[0]}_{window[1]}'
+    return _get_cached_rollup(dataset, variable, name, list(window), compute)
+
+
+def get_climatology(dataset, variable, baseline='1979-2000') -> xr.DataArray:
+    """
+    Returns the mean of a variable over a named baseline window, cached like window_mean.
+
+    :param dataset: Name of the dataset in DATASETS or the path to a NetCDF file
+    :param variable: Name of the variable, e.g. 'precip'
+    :param baseline: Optional. Name of the window in CLIMATE_BASELINES
+    """
+    return window_mean(dataset, variable, CLIMATE_BASELINES[baseline])
+
+
+def get_annual_means(dataset, variable, chunk_bytes=CLIMATE_CHUNK_BYTES) -> xr.DataArray:
+    """
+    Returns the mean of a variable in every year and grid cell, with a 'year' instead of the 'time' dimension.
+    The rollup is computed in one chunked pass over the file and cached in 'dat/cache'.
+
+    :param dataset: Name of the dataset in DATASETS or the path to a NetCDF file
+    :param variable: Name of the variable, e.g. 'precip'
+    :param chunk_bytes: Optional. Maximum number of bytes read at once
+
+    Example:
+    >>> get_annual_means('cmap_precipitation', 'precip').sel(year=slice(2017, 2022)).mean('year')
+    """
+    def compute(data_array):
+        years = data_array.indexes['time'].year.to_numpy()
+        labels = years - years.min()
+        sums, counts = accumulate_time_groups(data_array, labels, labels.max() + 1, chunk_bytes)
+
+        grid = to_grid(sums[0], data_array)
+        return xr.DataArray(to_means(sums, counts), coords={'year': np.arange(years.min(), years.max() + 1),
+                                                            **grid.coords}, dims=('year', *grid.dims),
+                            name=variable, attrs=data_array.attrs)
+
+    return _get_cached_rollup(dataset, variable, f'{variable}_annual', 'annual', compute)
+
+
+def get_seasonal_means(dataset, variable, chunk_bytes=CLIMATE_CHUNK_BYTES) -> xr.DataArray:
+    """
+    Returns the mean of a variable in every season of every year and grid cell, with the dimensions 'year'
+    and 'season' (see SEASONS) instead of 'time'. The December of a year is part of the winter of the next year.
+    The rollup is computed in one chunked pass over the file and cached in 'dat/cache'.
+
+    :param dataset: Name of the dataset in DATASETS or the path to a NetCDF file
+    :param variable: Name of the variable, e.g. 'precip'
+    :param chunk_bytes: Optional. Maximum number of bytes read at once
+
+    Example:
+    >>> get_seasonal_means('cmap_precipitation', 'precip').sel(season='JJA', year=slice(2017, 2022)).mean('year')
+    """
+    def compute(data_array):
+        time = data_array.indexes['time']
+        season_years = time.year.to_numpy() + (time.month.to_numpy() == 12)
+        seasons = time.month.to_numpy() % 12 // 3
+        first_year = season_years.min()
+        n_years = season_years.max() - first_year + 1
+
+        labels = (season_years - first_year) * len(SEASONS) + seasons
+        sums, counts = accumulate_time_groups(data_array, labels, n_years * len(SEASONS), chunk_bytes)
+        means = to_means(sums, counts)
+        means = means.reshape(n_years, len(SEASONS), *means.shape[1:])
+
+        grid = to_grid(means[0, 0], data_array)
+        return xr.DataArray(means, coords={'year': np.arange(first_year, first_year + n_years), 'season': SEASONS,
+                                           **grid.coords}, dims=('year', 'season', *grid.dims), name=variable,
+                            attrs=data_array.attrs)
+
+    return _get_cached_rollup(dataset, variable, f'{variable}_seasonal', 'seasonal', compute)
+
+
+def get_anomaly(dataset, variable, baseline, target, relative=False,
+                chunk_bytes=CLIMATE_CHUNK_BYTES) -> xr.DataArray:
+    """
+    Returns the difference between the mean of a target window and the mean of a baseline window.
+    Both means are cached, so a new target window only needs its own pass over the file.
+
+    :param dataset: Name of the dataset in DATASETS or the path to a NetCDF file
+    :param variable: Name of the variable, e.g. 'precip'
+    :param baseline: Baseline window, e.g. ('1979', '2000'), see get_window_labels, or a name in CLIMATE_BASELINES
+    :param target: Target window, e.g. ('2017', '2022')
+    :param relative: Optional. If True, the difference in % of the baseline mean
+    :param chunk_bytes: Optional. Maximum number of bytes read at once
+
+    Example:
+    >>> get_anomaly('cmap_precipitation', 'precip', ('1979', '2000'), ('2017', '2022'), relative=True)
+    """
+    if isinstance(baseline, str):
+        baseline = CLIMATE_BASELINES[baseline]
+    baseline_mean = window_mean(dataset, variable, baseline, chunk_bytes)
+    target_mean = window_mean(dataset, variable, target, chunk_bytes)
+
+    anomaly = target_mean - baseline_mean
+    if relative:
+        anomaly = 100 * anomaly / baseline_mean
+    return anomaly.rename(variable)
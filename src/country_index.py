@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from src.aquastat_utils import AQUASTAT_CACHE_SOURCE, get_aquastat, get_aquastat_cache_key, normalize_countries
+from src.geometry import get_world, get_world_cache_key
+from src.utils import hash_objects, read_cached_frame, write_cached_frame
+
+# Bump this if the matching in get_country_index changes, so old caches are rebuilt
+COUNTRY_INDEX_VERSION = 3
+
+# The crosswalk and the country code of every world map polygon, built once per process
+_country_index = None
+
+
+def get_country_index() -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Returns the crosswalk between AQUASTAT countries and the Natural Earth world map.
+
+    Every AQUASTAT country gets an integer code, its position in the crosswalk. A world map polygon
+    belongs to the country with the same 'SOVEREIGNT', like the joins on the world map index did before
+    (e.g. Greenland and Puerto Rico are shown with the data of Denmark and the United States).
+    The index is persisted in 'dat/cache'. Countries without a polygon are reported once, when it is built.
+
+    :return: Tuple of the crosswalk with the columns 'Country', 'ADM0_A3', 'ISO_A3' and 'Polygons'
+    (number of polygons of the country), and an array with the country code of every row of get_world(),
+    -1 for polygons without an AQUASTAT country
+    """
+    global _country_index
+
+    if _country_index is None:
+        _country_index = _load_country_index()
+    return _country_index
+
+
+def _load_country_index() -> tuple[pd.DataFrame, np.ndarray]:
+    cache_key = hash_objects(get_aquastat_cache_key(), get_world_cache_key(), COUNTRY_INDEX_VERSION)
+    crosswalk = read_cached_frame(AQUASTAT_CACHE_SOURCE, 'crosswalk', cache_key)
+    world_codes = read_cached_frame(AQUASTAT_CACHE_SOURCE, 'world_codes', cache_key)
+    if crosswalk is not None and world_codes is not None:
+        return crosswalk, world_codes['Code'].to_numpy()
+
+    print('Building country index ...')
+    countries = pd.Index(normalize_countries(get_aquastat(raw=True, compact=True)['Country']).cat.categories)
+    world = get_world()
+
+    # Match the polygons by sovereignty
+    world_codes = countries.get_indexer(world.index)
+
+    # The record of a country is the first polygon with its name or else the first polygon of its sovereignty,
+    # it only sets the codes in the crosswalk
+    record_rows = np.full(len(countries), -1)
+    for codes in (world_codes, countries.get_indexer(world['ADMIN'])):
+        rows = np.flatnonzero(codes >= 0)
+        matched_codes, first = np.unique(codes[rows], return_index=True)
+        record_rows[matched_codes] = rows[first]
+
+    # Natural Earth sets ISO_A3 to -99 for some countries, e.g. France, ISO_A3_EH has the code anyway
+    iso_codes = world['ISO_A3'].where(world['ISO_A3'] != '-99', world['ISO_A3_EH']).to_numpy()
+
+    matched = record_rows >= 0
+    crosswalk = pd.DataFrame({
+        'Country': countries,
+        'ADM0_A3': np.where(matched, world['ADM0_A3'].to_numpy()[record_rows], None),
+        'ISO_A3': np.where(matched, iso_codes[record_rows], None),
+        'Polygons': np.bincount(world_codes[world_codes >= 0], minlength=len(countries)),
+    })
+
+    unmatched = crosswalk.loc[crosswalk['Polygons'] == 0, 'Country']
+    if len(unmatched):
+        print(f'{len(unmatched)} AQUASTAT countries are not on the world map: {", ".join(unmatched)}')
+
+    write_cached_frame(crosswalk, AQUASTAT_CACHE_SOURCE, 'crosswalk', cache_key)
+    write_cached_frame(pd.DataFrame({'Code': world_codes}), AQUASTAT_CACHE_SOURCE, 'world_codes', cache_key)
+    return crosswalk, world_codes
+
+
+def get_country_codes(countries) -> np.ndarray:
+    """
+    Returns the integer codes of countries in the crosswalk, -1 for unknown countries.
+    Every unique name is looked up once.
+
+    :param countries: Series (or list) of AQUASTAT or world map country names
+    """
+    crosswalk, _ = get_country_index()
+    normalized = normalize_countries(countries)
+    category_codes = pd.Index(crosswalk['Country']).get_indexer(normalized.cat.categories)
+    return np.append(category_codes, -1)[normalized.cat.codes.to_numpy()]
+
+
+def to_world_values(countries, values) -> np.ndarray:
+    """
+    Aligns country values with the rows of get_world() by positional lookups.
+
+    :param countries: Series (or list) of country names. Every country may only appear once, also under
+    another name (e.g. 'Viet Nam' and 'Vietnam'). Aggregate the values first, otherwise a ValueError is raised.
+    Unknown countries are ignored.
+    :param values: Values of the countries, same length as countries
+    :return: Array with one value per world map polygon, NaN for polygons without a value
+
+    Example:
+    >>> get_world().plot(column=to_world_values(df['Country'], df['Total population']))
+    """
+    crosswalk, world_codes = get_country_index()
+    codes = get_country_codes(countries)
+    values = np.asarray(values, dtype='float64')
+
+    # One slot per country and a last NaN slot for the polygons without a country
+    country_values = np.full(len(crosswalk) + 1, np.nan)
+    known = codes >= 0
+    counts = np.bincount(codes[known], minlength=len(crosswalk))
+    if (counts > 1).any():
+        duplicated = crosswalk['Country'].to_numpy()[counts > 1]
+        raise ValueError(f'Countries with more than one value: {", ".join(duplicated)}!')
+    country_values[codes[known]] = values[known]
+    return country_values[world_codes]
@@ -0,0 +1,187 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils import download_dataset, to_dat_path
+
+# Every entry holds the arguments of download_dataset.
+# Add 'sha256' to an entry to verify the download.
+DATASETS = {
+    'aquastat': {
+        'file_path': 'fao_aquastat.csv',
+        'url': 'https://yaon.org/data.csv',
+    },
+    'cmap_precipitation': {
+        'file_path': 'precip.mon.mean.nc',
+        'url': 'https://downloads.psl.noaa.gov//Datasets/cmap/enh/precip.mon.mean.nc',
+        'subfolder': 'climate_data',
+    },
+    'noaa_global_temperature': {
+        'file_path': 'NOAAGlobalTemp_v5.1.0_gridded_s185001_e202312_c20240108T150239.nc',
+        'url': 'https://www.ncei.noaa.gov/data/noaa-global-surface-temperature/v5.1/access/gridded/'
+               'NOAAGlobalTemp_v5.1.0_gridded_s185001_e202312_c20240108T150239.nc',
+        'subfolder': 'climate_data',
+    },
+    'epa_precipitation': {
+        'file_path': 'precipitation_annualy_mean.csv',
+        'url': 'https://www.epa.gov/system/files/other-files/2022-07/precipitation_fig-2.csv',
+        'subfolder': 'climate_data',
+    },
+    'ncei_temperature': {
+        'file_path': 'temp_anomalies_annualy_timeseries.csv',
+        'url': 'https://www.ncei.noaa.gov/access/monitoring/climate-at-a-glance/global/time-series/globe/'
+               'land_ocean/ann/12/1850-2023.csv',
+        'subfolder': 'climate_data',
+    },
+}
+
+# Maximum number of concurrent downloads and open connections
+PREFETCH_WORKERS = 4
+# Seconds between two progress lines of the same download
+PREFETCH_PROGRESS_INTERVAL = 2
+
+
+def get_dataset_path(name) -> str:
+    """
+    Returns the path of a dataset from the manifest in 'dat' folder.
+
+    :param name: Name of the dataset in DATASETS
+    """
+    dataset = DATASETS[name]
+    return to_dat_path(os.path.join(dataset.get('subfolder') or '', dataset['file_path']))
+
+
+def fetch_dataset(name, session=None, refresh=False, progress=None) -> bool:
+    """
+    Downloads a dataset from the manifest if it does not exist yet.
+
+    :param name: Name of the dataset in DATASETS
+    :param session: Optional. requests.Session to reuse connections.
+    :param refresh: Optional. If True, download the dataset again if the server has a newer version.
+    :param progress: Optional. Function called with the bytes received so far and the total bytes, see download_dataset
+    :return: bool indicating success
+    """
+    return download_dataset(**DATASETS[name], session=session, refresh=refresh, progress=progress)
+
+
+def _make_progress_printer(name, lock):
+    """
+    Returns a progress function for download_dataset that prints at most one line per PREFETCH_PROGRESS_INTERVAL.
+    """
+    last_print = time.perf_counter()
+
+    def progress(received, total):
+        nonlocal last_print
+        now = time.perf_counter()
+        if now - last_print < PREFETCH_PROGRESS_INTERVAL:
+            return
+        last_print = now
+
+        status = f'{received / 1e6:.1f} MB'
+        if total:
+            status += f' of {total / 1e6:.1f} MB ({100 * received / total:.0f} %)'
+        with lock:
+            print(f'{name}: {status}')
+
+    return progress
+
+
+def prefetch(names=None, workers=PREFETCH_WORKERS, refresh=False) -> dict:
+    """
+    Downloads datasets from the manifest concurrently with a bounded number of connections.
+    Prints the progress of every running download every few seconds, a line per dataset when it is done
+    and a summary at the end.
+
+    :param names: Optional. Names of the datasets to download. By default, all datasets.
+    :param workers: Maximum number of concurrent downloads
+    :param refresh: If True, check existing datasets and download newer versions
+    :return: Dictionary from dataset name to bool indicating success
+    """
+    names = list(DATASETS) if names is None else names
+    unknown = [name for name in names if name not in DATASETS]
+    if unknown:
+        raise KeyError(f'Unknown datasets: {", ".join(unknown)}')
+
+    # One session for all threads, with a connection pool as big as the thread pool
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def modified_time(name):
+        path = get_dataset_path(name)
+        return os.stat(path).st_mtime_ns if os.path.isfile(path) else None
+
+    print_lock = threading.Lock()
+
+    def fetch(name):
+        before = modified_time(name)
+        start = time.perf_counter()
+        print_progress = _make_progress_printer(name, print_lock)
+        transferred = 0
+        previous = None
+
+        def progress(received, total):
+            nonlocal transferred, previous
+            # A transfer starts with the bytes that are already there, e.g. of a resumed download
+            if previous is not None and received >= previous:
+                transferred += received - previous
+            previous = received
+            print_progress(received, total)
+
+        success = fetch_dataset(name, session=session, refresh=refresh, progress=progress)
+        unchanged = before is not None and before == modified_time(name)
+        return success, unchanged, transferred, time.perf_counter() - start
+
+    results = {}
+    total_bytes = 0
+    start = time.perf_counter()
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, name): name for name in names}
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            success, unchanged, transferred, seconds = future.result()
+            results[name] = success
+
+            # Only the bytes of this run, not the ones of an earlier interrupted transfer
+            total_bytes += transferred
+            if not success:
+                status = 'failed'
+            elif unchanged:
+                status = 'up to date' if refresh else 'already exists'
+            else:
+                status = (f'{transferred / 1e6:.1f} MB in {seconds:.1f} s '
+                          f'({transferred / 1e6 / max(seconds, 1e-9):.1f} MB/s)')
+            with print_lock:
+                print(f'[{done}/{len(names)}] {name}: {status}')
+
+    seconds = time.perf_counter() - start
+    print(f'Downloaded {total_bytes / 1e6:.1f} MB in {seconds:.1f} s '
+          f'({total_bytes / 1e6 / max(seconds, 1e-9):.1f} MB/s), '
+          f'{sum(results.values())} of {len(names)} datasets available.')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download the external datasets into dat.')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f'datasets to download (default: all of {", ".join(DATASETS)})')
+    parser.add_argument('--workers', type=int, default=PREFETCH_WORKERS, help='number of concurrent downloads')
+    parser.add_argument('--refresh', action='store_true', help='download newer versions of existing datasets')
+    args = parser.parse_args()
+
+    try:
+        results = prefetch(args.names or None, workers=args.workers, refresh=args.refresh)
+    except KeyError as e:
+        parser.error(e.args[0])
+    if not all(results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from matplotlib.path import Path
+
+from src.utils import file_hash, get_cache_file_path, get_fig_profile, hash_objects, to_dat_path, write_cached_file
+
+WORLD_FILE_PATH = 'naturalearth/ne_110m_admin_0_countries.shx'
+WORLD_CACHE_SOURCE = 'ne_110m_admin_0_countries'
+# Bump this if the processing in get_world changes, so old caches are rebuilt
+WORLD_CACHE_VERSION = 2
+
+# Sovereignties that are never shown on the world maps
+EXCLUDED_SOVEREIGNTIES = ['Antarctica']
+
+# Simplification tolerance in degrees of every level of detail of the world map, level 0 is the full geometry
+WORLD_LEVEL_TOLERANCES = [0, 0.1, 0.25, 0.5, 1.0]
+
+# Coastline resolutions of cartopy from coarse to fine and the size of their details in degrees
+COASTLINE_RESOLUTIONS = {'110m': 0.1, '50m': 0.05, '10m': 0.01}
+
+# The levels of the world map, loaded once per process by get_world
+_world_levels = {}
+# One matplotlib path per country of each level, built once per process by get_world_paths
+_world_paths = {}
+
+
+def get_world(level=0) -> gpd.GeoDataFrame:
+    """
+    Returns the Natural Earth countries without Antarctica, indexed by 'SOVEREIGNT'.
+    The shapefile is read once per process and cached as GeoParquet in 'dat/cache' for fast cold starts.
+
+    Higher levels have simplified geometries with fewer vertices, see WORLD_LEVEL_TOLERANCES and
+    get_world_level. Every level has the same rows in the same order.
+
+    The same GeoDataFrame is returned on every call, so don't modify it. Joins and merges return
+    new frames and are fine, otherwise use world.copy().
+
+    :param level: Optional. Level of detail, 0 is the full geometry.
+
+    Example:
+    >>> merged = get_world().join(countries_df.set_index('Country'))
+    """
+    if level not in _world_levels:
+        _world_levels[level] = _load_world() if level == 0 else _load_simplified_world(level)
+    return _world_levels[level]
+
+
+def _load_world() -> gpd.GeoDataFrame:
+    cache_key = get_world_cache_key()
+    cache_path = get_cache_file_path(WORLD_CACHE_SOURCE, 'world', cache_key)
+    if os.path.isfile(cache_path):
+        print('Reading cached world map ...')
+        return gpd.read_parquet(cache_path)
+
+    print('Reading world map ...')
+    world = gpd.read_file(to_dat_path(file_path=WORLD_FILE_PATH), engine="pyogrio")
+
+    # Exclude Antarctica
+    world = world[~world['SOVEREIGNT'].isin(EXCLUDED_SOVEREIGNTIES)]
+    world = world.set_index('SOVEREIGNT')
+
+    write_cached_file(world.to_parquet, WORLD_CACHE_SOURCE, 'world', cache_key)
+    return world
+
+
+def get_world_cache_key() -> str:
+    """
+    Returns the key of the cached world map. It changes whenever one of the shapefile parts changes.
+    """
+    shapefile_path = os.path.splitext(to_dat_path(file_path=WORLD_FILE_PATH))[0]
+    parts = [f'{shapefile_path}.{extension}' for extension in ('shp', 'shx', 'dbf', 'prj', 'cpg')]
+    return hash_objects([file_hash(part) for part in parts if os.path.isfile(part)], EXCLUDED_SOVEREIGNTIES,
+                        WORLD_CACHE_VERSION)
+
+
+def _load_simplified_world(level) -> gpd.GeoDataFrame:
+    """
+    Simplifies the borders of the full world map, see simplify_shared_borders.
+    """
+    tolerance = WORLD_LEVEL_TOLERANCES[level]
+    cache_key = hash_objects(get_world_cache_key(), tolerance)
+    cache_path = get_cache_file_path(WORLD_CACHE_SOURCE, f'world_level{level}', cache_key)
+    if os.path.isfile(cache_path):
+        return gpd.read_parquet(cache_path)
+
+    print(f'Simplifying world map to level {level} ...')
+    world = get_world()
+    world = world.set_geometry(simplify_shared_borders(world.geometry.to_numpy(), tolerance), crs=world.crs)
+
+    write_cached_file(world.to_parquet, WORLD_CACHE_SOURCE, f'world_level{level}', cache_key)
+    return world
+
+
+def simplify_shared_borders(geometries, tolerance) -> np.ndarray:
+    """
+    Simplifies (multi) polygons that share borders without gaps or overlaps between them.
+    The boundaries are split into arcs between the points where countries meet, every arc is simplified once
+    for both of its sides, and the countries are rebuilt from the faces enclosed by the simplified arcs.
+    Arcs that collapse onto another arc, e.g. the two sides of a small island, keep their full detail.
+
+    :param geometries: Array of (multi) polygons, e.g. world.geometry.to_numpy()
+    :param tolerance: Maximum distance between the original and the simplified arcs
+    :return: Array with the simplified geometry of every input geometry
+    """
+    geometries = np.asarray(geometries)
+    arcs = shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(geometries))))
+    # The lines of a collection are simplified together, so no arc crosses another one
+    simplified = shapely.get_parts(shapely.simplify(shapely.multilinestrings(arcs), tolerance,
+                                                    preserve_topology=True))
+    arc_tree = shapely.STRtree(arcs)
+
+    while True:
+        faces, cuts, _, _ = shapely.polygonize_full(simplified)
+        faces = shapely.get_parts(faces)
+        owners = _get_face_owners(faces, geometries)
+
+        # Restore the arcs next to collapsed faces and around geometries that lost all of their faces
+        missing = np.setdiff1d(np.arange(len(geometries)), owners)
+        broken = shapely.union_all([cuts, *shapely.boundary(geometries[missing])])
+        restore = arc_tree.query(broken, predicate='intersects')
+        restore = restore[~shapely.equals(simplified[restore], arcs[restore])]
+        if not len(restore):
+            break
+        simplified[restore] = arcs[restore]
+
+    result = np.array([shapely.union_all(faces[owners == row]) for row in range(len(geometries))])
+    # Fallback for geometries without faces, e.g. polygons that overlap others in the input
+    result[missing] = shapely.simplify(geometries[missing], tolerance, preserve_topology=True)
+    return result
+
+
+def _get_face_owners(faces, geometries) -> np.ndarray:
+    """
+    Returns the position of the geometry that covers the biggest part of every face, -1 for faces that
+    are mostly outside all geometries, e.g. lakes enclosed by several countries.
+    """
+    face_positions, geometry_positions = shapely.STRtree(geometries).query(faces, predicate='intersects')
+    areas = shapely.area(shapely.intersection(faces[face_positions], geometries[geometry_positions]))
+
+    # The biggest overlap of every face is the first one after sorting by face and decreasing area
+    order = np.lexsort((-areas, face_positions))
+    _, first = np.unique(face_positions[order], return_index=True)
+    best = order[first]
+
+    owners = np.full(len(faces), -1)
+    owner_areas = np.zeros(len(faces))
+    owners[face_positions[best]] = geometry_positions[best]
+    owner_areas[face_positions[best]] = areas[best]
+    owners[owner_areas < shapely.area(faces) / 2] = -1
+    return owners
+
+
+def get_pixel_size(ax, dpi=None, extent=360) -> float:
+    """
+    Returns the size of a pixel of a world map axes in degrees, when it is saved with dpi.
+
+    :param ax: The axes of the map
+    :param dpi: Optional. Resolution of the saved figure. By default, the dpi of the active save_fig profile,
+    see DEFAULT_FIG_PROFILE.
+    :param extent: Optional. Longitudes shown across the axes
+    """
+    if dpi is None:
+        dpi = get_fig_profile()['dpi']
+    width_inches = ax.get_position().width * ax.figure.get_figwidth()
+    return extent / max(width_inches * dpi, 1)
+
+
+def get_world_level(ax, dpi=None) -> int:
+    """
+    Returns the coarsest level of the world map whose simplification is not bigger than a pixel of the axes.
+    Small multiples and previews then draw far fewer vertices without a visible difference.
+
+    :param ax: The axes of the map
+    :param dpi: Optional. Resolution of the saved figure, see get_pixel_size.
+
+    Example:
+    >>> world = get_world(get_world_level(ax))
+    """
+    pixel_size = get_pixel_size(ax, dpi)
+    return max(level for level, tolerance in enumerate(WORLD_LEVEL_TOLERANCES) if tolerance <= pixel_size)
+
+
+def get_coastline_resolution(ax, dpi=None) -> str:
+    """
+    Returns the coarsest cartopy coastline resolution whose details are not bigger than a pixel of the axes.
+
+    :param ax: The axes of the map
+    :param dpi: Optional. Resolution of the saved figure, see get_pixel_size.
+
+    Example:
+    >>> ax.coastlines(resolution=get_coastline_resolution(ax))
+    """
+    pixel_size = get_pixel_size(ax, dpi)
+    for resolution, detail in COASTLINE_RESOLUTIONS.items():
+        if detail <= pixel_size:
+            return resolution
+    return '10m'
+
+
+def get_world_paths(level=0) -> list[Path]:
+    """
+    Returns one matplotlib path per row of get_world(level), built once per process.
+    Use them to draw the countries as a single collection and only recolor it, see plot_world_batch.
+
+    :param level: Optional. Level of detail, see get_world.
+    """
+    if level not in _world_paths:
+        _world_paths[level] = [_to_path(geometry) for geometry in get_world(level).geometry]
+    return _world_paths[level]
+
+
+def _to_path(geometry) -> Path:
+    """
+    Converts a (multi) polygon to a compound path with the exterior and interior rings of all parts.
+    """
+    polygons = geometry.geoms if geometry.geom_type == 'MultiPolygon' else [geometry]
+    rings = [ring for polygon in polygons for ring in (polygon.exterior, *polygon.interiors)]
+    return Path.make_compound_path(*[Path(np.asarray(ring.coords)[:, :2]) for ring in rings])
@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+
+def get_default_workers() -> int:
+    """
+    Returns the number of cores this process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def run_jobs(func, jobs, workers=None, initializer=None, initargs=(), chunksize=1, verbose=False, pool=None) -> list:
+    """
+    Runs func(*job) for every job, spread across a pool of processes.
+
+    Every worker is a fresh process (spawned, not forked) with the non-interactive Agg backend, so it
+    has its own matplotlib state. Use initializer to load the data once per worker into a module global.
+    The results are returned in the order of jobs, no matter which worker finished first, so the output
+    does not depend on the number of workers.
+    Scripts that call this must guard their entry point with `if __name__ == '__main__':`.
+
+    :param func: Function to run, must be defined at module level so it can be sent to the workers
+    :param jobs: List of argument tuples, one per call of func
+    :param workers: Optional. Number of processes. By default, one per core. With 1, the jobs run in this process.
+    :param initializer: Optional. Function called once in every worker before its first job
+    :param initargs: Optional. Arguments of initializer
+    :param chunksize: Optional. Number of jobs sent to a worker at once
+    :param verbose: Optional. If True, print the number of jobs and processes and how long they took
+    :param pool: Optional. Pool of job_pool to run the jobs on instead of starting new processes.
+    initializer and initargs are then the ones of the pool.
+    :return: List with the result of every job
+
+    Example:
+    >>> run_jobs(plot_country, [(country,) for country in countries], initializer=load_data)
+    """
+    jobs = list(jobs)
+    workers = min(workers or get_default_workers(), max(len(jobs), 1))
+
+    start = time.perf_counter()
+    if pool is None and workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        results = [func(*job) for job in jobs]
+    else:
+        if verbose:
+            print(f'Running {len(jobs)} jobs on {workers} processes ...')
+        with nullcontext(pool) if pool is not None else job_pool(workers, initializer, initargs) as executor:
+            results = list(executor.map(_call, [func] * len(jobs), jobs, chunksize=chunksize))
+
+    if verbose:
+        print(f'Ran {len(jobs)} jobs on {workers} processes in {time.perf_counter() - start:.1f} s.')
+    return results
+
+
+@contextmanager
+def job_pool(workers=None, initializer=None, initargs=()):
+    """
+    Starts a pool of processes like run_jobs, which several calls of run_jobs can share with pool=...
+    The processes and their initializer then only start once. With 1 worker, no processes are started,
+    None is returned and run_jobs runs the jobs in this process.
+
+    :param workers: Optional. Number of processes. By default, one per core.
+    :param initializer: Optional. Function called once in every worker before its first job
+    :param initargs: Optional. Arguments of initializer
+
+    Example:
+    >>> with job_pool(workers) as pool:
+    ...     results = [run_jobs(plot_country, jobs, workers, pool=pool) for jobs in (first_jobs, second_jobs)]
+    """
+    workers = workers or get_default_workers()
+    if workers == 1:
+        yield None
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(initializer, initargs)) as executor:
+        yield executor
+
+
+def _init_worker(initializer, initargs):
+    import matplotlib
+    matplotlib.use('Agg')
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _call(func, job):
+    return func(*job)
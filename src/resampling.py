@@ -0,0 +1,234 @@
+import numpy as np
+import pandas as pd
+
+from src.parallel import job_pool, run_jobs
+from src.utils import make_list
+
+# Number of replicates generated and evaluated at once. The replicates are split into shards of this size,
+# every shard gets its own seed, so the results do not depend on the number of workers.
+RESAMPLING_BATCH_SIZE = 10000
+
+
+def permutation_indices(rng: np.random.Generator, n, n_replicates) -> np.ndarray:
+    """
+    Returns an index matrix with one random permutation of range(n) per row.
+    """
+    return rng.permuted(np.tile(np.arange(n), (n_replicates, 1)), axis=1)
+
+
+def bootstrap_indices(rng: np.random.Generator, n, n_replicates) -> np.ndarray:
+    """
+    Returns an index matrix with n draws with replacement from range(n) per row.
+    """
+    return rng.integers(0, n, size=(n_replicates, n))
+
+
+def mean_difference(values, labels) -> np.ndarray:
+    """
+    Returns the mean of the values with label True minus the mean of the values with label False.
+    Statistics like this one get the replicates along the first axis and the observations along the last axis.
+
+    :param values: Array of the values, e.g. the total water withdrawal
+    :param labels: Boolean array of the group of every value, broadcastable to values
+    """
+    values, labels = np.broadcast_arrays(np.asarray(values, dtype='float64'), np.asarray(labels, dtype=bool))
+    n_true = labels.sum(axis=-1)
+    sum_true = np.where(labels, values, 0).sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sum_true / n_true - (values.sum(axis=-1) - sum_true) / (labels.shape[-1] - n_true)
+
+
+def correlation(x, y) -> np.ndarray:
+    """
+    Returns the Pearson correlation of x and y along the last axis.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64'))
+    dx = x - x.mean(axis=-1, keepdims=True)
+    dy = y - y.mean(axis=-1, keepdims=True)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (dx * dy).sum(axis=-1) / np.sqrt((dx * dx).sum(axis=-1) * (dy * dy).sum(axis=-1))
+
+
+def f_statistic(values, groups) -> np.ndarray:
+    """
+    Returns the F statistic of a one-way ANOVA of the values between the groups along the last axis.
+    Groups without values in a replicate are left out of that replicate.
+
+    :param values: Array of the values
+    :param groups: Integer array of the group of every value, from 0 to the number of groups - 1
+    """
+    values, groups = np.broadcast_arrays(np.asarray(values, dtype='float64'), np.asarray(groups, dtype='int64'))
+    n_groups = groups.max() + 1
+    rows = values.reshape(-1, values.shape[-1])
+
+    # Group sums of all replicates with one bincount, every replicate has its own range of bins
+    bins = (groups.reshape(rows.shape) + n_groups * np.arange(len(rows))[:, None]).ravel()
+    counts = np.bincount(bins, minlength=len(rows) * n_groups).reshape(len(rows), n_groups)
+    sums = np.bincount(bins, rows.ravel(), minlength=len(rows) * n_groups).reshape(len(rows), n_groups)
+
+    n = rows.shape[-1]
+    k = (counts > 0).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        group_means = sums / counts
+        ss_between = np.nansum(counts * (group_means - rows.mean(axis=-1, keepdims=True)) ** 2, axis=-1)
+        ss_within = (rows * rows).sum(axis=-1) - np.nansum(sums * group_means, axis=-1)
+        f = (ss_between / (k - 1)) / (ss_within / (n - k))
+    return f.reshape(values.shape[:-1])
+
+
+def _get_shards(n_replicates, seed) -> list[tuple[int, np.random.SeedSequence]]:
+    """
+    Splits the replicates into shards of at most RESAMPLING_BATCH_SIZE, each with an independent seed.
+    """
+    sizes = [RESAMPLING_BATCH_SIZE] * (n_replicates // RESAMPLING_BATCH_SIZE)
+    if n_replicates % RESAMPLING_BATCH_SIZE:
+        sizes.append(n_replicates % RESAMPLING_BATCH_SIZE)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return list(zip(sizes, seed.spawn(len(sizes))))
+
+
+def _permutation_shard(statistic, x, y, n_replicates, seed) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return statistic(x, y[permutation_indices(rng, len(y), n_replicates)])
+
+
+def _bootstrap_shard(statistic, samples, n_replicates, seed) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    indices = bootstrap_indices(rng, len(samples[0]), n_replicates)
+    return statistic(*(sample[indices] for sample in samples))
+
+
+def permutation_test(statistic, x, y, n_permutations=10000, alternative='two-sided', seed=None,
+                     workers=1, pool=None) -> tuple[float, float, np.ndarray]:
+    """
+    Tests whether x and y are independent by permuting y against x.
+    Every batch of permutations is an index matrix, and the statistic is evaluated for the whole batch at once.
+    The batches can be spread across processes, see run_jobs. With the same seed, the result is the same
+    for any number of workers.
+
+    :param statistic: Function of x and y that returns one value per row of y, e.g. mean_difference or
+    correlation. Must be defined at module level, so it can be sent to the workers.
+    :param x: Array of the observations that stay in place, e.g. the total water withdrawal
+    :param y: Array of the observations that are permuted, e.g. the labels of the groups
+    :param n_permutations: Optional. Number of permutations
+    :param alternative: Optional. 'two-sided', 'greater' or 'less', the direction of the alternative hypothesis
+    :param seed: Optional. Seed of the random generator, e.g. 1, or a np.random.SeedSequence.
+    By default, a new seed on every call.
+    :param workers: Optional. Number of processes, see run_jobs. By default, the permutations run in this process.
+    :param pool: Optional. Pool of processes to reuse, see job_pool
+    :return: Tuple of the statistic of the data, the p-value and the statistics of all permutations
+
+    Example:
+    >>> statistic, p_value, permuted = permutation_test(mean_difference, withdrawal, population < median, seed=1)
+    """
+    if alternative not in ('two-sided', 'greater', 'less'):
+        raise ValueError(f"alternative must be 'two-sided', 'greater' or 'less', not {alternative}!")
+    if n_permutations < 1:
+        raise ValueError(f'n_permutations must be at least 1, not {n_permutations}!')
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    observed = statistic(x, y)
+
+    shards = _get_shards(n_permutations, seed)
+    replicates = np.concatenate(run_jobs(_permutation_shard, [(statistic, x, y, size, shard_seed)
+                                                              for size, shard_seed in shards],
+                                          workers=workers, pool=pool))
+
+    # Count the data itself as one of the permutations, so the p-value is never 0
+    p_greater = (np.sum(replicates >= observed) + 1) / (n_permutations + 1)
+    p_less = (np.sum(replicates <= observed) + 1) / (n_permutations + 1)
+    if alternative == 'greater':
+        p_value = p_greater
+    elif alternative == 'less':
+        p_value = p_less
+    else:
+        p_value = min(1.0, 2 * min(p_greater, p_less))
+
+    return float(observed), float(p_value), replicates
+
+
+def bootstrap(statistic, samples, n_resamples=10000, confidence_level=0.95, seed=None,
+              workers=1, pool=None) -> tuple[float, tuple[float, float], np.ndarray]:
+    """
+    Returns a percentile bootstrap confidence interval of a statistic.
+    The observations are resampled with replacement, rows of several samples are kept together.
+    Resamples are generated and evaluated in batches and spread across processes like in permutation_test.
+
+    :param statistic: Function of the samples that returns one value per row, e.g. mean_difference
+    :param samples: Array or list of arrays of the same length, e.g. [values, labels]
+    :param n_resamples: Optional. Number of resamples
+    :param confidence_level: Optional. Confidence level of the interval
+    :param seed: Optional. Seed of the random generator. By default, a new seed on every call.
+    :param workers: Optional. Number of processes, see run_jobs. By default, the resamples run in this process.
+    :param pool: Optional. Pool of processes to reuse, see job_pool
+    :return: Tuple of the statistic of the data, the confidence interval (low, high) and the statistics
+    of all resamples
+
+    Example:
+    >>> statistic, (low, high), _ = bootstrap(mean_difference, [withdrawal, population < median], seed=1)
+    """
+    if n_resamples < 1:
+        raise ValueError(f'n_resamples must be at least 1, not {n_resamples}!')
+
+    samples = [np.asarray(sample) for sample in (samples if isinstance(samples, (list, tuple)) else [samples])]
+    observed = statistic(*samples)
+
+    shards = _get_shards(n_resamples, seed)
+    replicates = np.concatenate(run_jobs(_bootstrap_shard, [(statistic, samples, size, shard_seed)
+                                                            for size, shard_seed in shards],
+                                          workers=workers, pool=pool))
+
+    alpha = 1 - confidence_level
+    low, high = np.nanquantile(replicates, [alpha / 2, 1 - alpha / 2])
+    return float(observed), (float(low), float(high)), replicates
+
+
+def compare_groups(data: pd.DataFrame, variables, group, n_resamples=10000, confidence_level=0.95, seed=None,
+                   workers=1) -> pd.DataFrame:
+    """
+    Tests for every variable whether its values differ between groups of rows.
+    With two groups, the statistic is the difference of the means, otherwise the F statistic of a one-way ANOVA.
+    Each variable gets a permutation test of the group labels and a bootstrap confidence interval.
+
+    :param data: Dataframe with the variables and the group column, e.g. the countries of one year
+    :param variables: Variable or list of variables
+    :param group: Column with the group of every row, e.g. 'Water scarce' or 'Region'. Rows without a group
+    are left out. With two groups, the difference is the group that sorts last minus the group that sorts first.
+    :param n_resamples: Optional. Number of permutations and of bootstrap resamples
+    :param confidence_level: Optional. Confidence level of the bootstrap interval
+    :param seed: Optional. Seed of the random generator, every variable gets its own stream
+    :param workers: Optional. Number of processes, started once for all variables. By default, all tests run
+    in this process.
+    :return: Dataframe with one row per variable and the columns 'Observations', 'Statistic', 'P-value',
+    'CI low' and 'CI high'
+
+    Example:
+    >>> compare_groups(df[df['Year'] == 2020], ['Treated municipal wastewater'], 'Water scarce', seed=1)
+    """
+    variables = make_list(variables, 1)
+    seeds = (seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)).spawn(len(variables))
+
+    results = []
+    with job_pool(workers) as pool:
+        for variable, variable_seed in zip(variables, seeds):
+            rows = data[[variable, group]].dropna()
+            codes, groups = pd.factorize(rows[group], sort=True)
+            values = rows[variable].to_numpy(dtype='float64')
+            if len(groups) == 2:
+                statistic, labels, alternative = mean_difference, codes == 1, 'two-sided'
+            else:
+                statistic, labels, alternative = f_statistic, codes, 'greater'
+
+            permutation_seed, bootstrap_seed = variable_seed.spawn(2)
+            observed, p_value, _ = permutation_test(statistic, values, labels, n_resamples, alternative,
+                                                    seed=permutation_seed, workers=workers, pool=pool)
+            _, (low, high), _ = bootstrap(statistic, [values, labels], n_resamples, confidence_level,
+                                          seed=bootstrap_seed, workers=workers, pool=pool)
+            results.append({'Variable': variable, 'Observations': len(rows), 'Statistic': observed,
+                            'P-value': p_value, 'CI low': low, 'CI high': high})
+
+    return pd.DataFrame(results).set_index('Variable')
@@ -1,18 +1,64 @@
+import hashlib
+import inspect
+import json
 import os.path
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from typing import TextIO
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from matplotlib.collections import QuadMesh
+from matplotlib.colors import Colormap
 import requests
+import urllib3
 from tueplots import bundles
 
+try:
+    import fcntl
+except ImportError:
+    # Windows, files are only locked between threads
+    fcntl = None
+
 plt.rcParams.update(bundles.icml2022())
 plt.rcParams.update({"figure.dpi": 200})
 
 FIG_PATH = Path(__file__).parent / '..' / 'doc' / 'fig'
 FIG_EXP_PATH = Path(__file__).parent / '..' / 'exp' / 'fig'
 PATH_TO_DAT = Path(__file__).parent / '..' / 'dat'
+PATH_TO_CACHE = PATH_TO_DAT / 'cache'
+FILE_HASHES_NAME = 'file_hashes.json'
+
+# Downloads are streamed in chunks of this many bytes, an interrupted transfer loses at most one chunk
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+# Seconds to wait for the server to connect or send data
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_VALIDATORS_NAME = 'download_validators.json'
+_download_validators_lock = threading.Lock()
+# Fingerprints of the saved figures, see save_fig
+FIGURE_MANIFEST_NAME = 'figure_manifest.json'
+_figure_manifest_lock = threading.Lock()
+
+# Output profiles of save_fig. 'hybrid' rasterizes mesh layers (pcolormesh grids) and the artists passed
+# as rasterize (e.g. the country polygons of the world maps) at dpi inside a vector PDF, everything else
+# stays vector. 'png' is a quick raster preview.
+FIG_PROFILES = {
+    'vector': {'format': 'pdf', 'dpi': 300, 'rasterize': False},
+    'hybrid': {'format': 'pdf', 'dpi': 300, 'rasterize': True},
+    'png': {'format': 'png', 'dpi': 150, 'rasterize': False},
+}
+# Profile of save_fig if none is given, e.g. run a figure script with FIG_PROFILE=png for previews
+DEFAULT_FIG_PROFILE = os.environ.get('FIG_PROFILE', 'vector')
+
+
+def get_fig_profile(profile=None) -> dict:
+    """
+    Returns the settings of an output profile in FIG_PROFILES, by default the one of DEFAULT_FIG_PROFILE.
+    """
+    return FIG_PROFILES[profile or DEFAULT_FIG_PROFILE]
 
 
 def to_fig_path(file_path=None, experimental=True):
@@ -49,13 +95,203 @@ def to_dat_path(file_path=None):
     return dat_path
 
 
-def download_dataset(file_path=None, url=None, subfolder=None) -> bool:
+def to_cache_path(file_path=None):
+    """
+    Returns the path to a file in 'dat/cache' folder.
+
+    :param file_path: The location of the file in the 'dat/cache' folder.
+    :return: The path to the file
+    """
+    cache_path = PATH_TO_CACHE
+
+    if file_path is not None:
+        cache_path = os.path.join(cache_path, file_path)
+
+    return cache_path
+
+
+def hash_objects(*objects) -> str:
+    """
+    Returns a stable hash of JSON serializable objects, e.g. mapping tables.
+
+    :param objects: The objects to hash
+    :return: Hex digest of the objects
+    """
+    dump = json.dumps(objects, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+
+def file_hash(file_path, chunk_size=1 << 20) -> str:
+    """
+    Returns the SHA-256 content hash of a file.
+    The hash is remembered in 'dat/cache/file_hashes.json' together with the size
+    and modification time of the file, so unchanged files are not read again.
+
+    :param file_path: The file to hash
+    :param chunk_size: Number of bytes read at once
+    :return: Hex digest of the file content
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    hashes_path = to_cache_path(FILE_HASHES_NAME)
+
+    hashes = {}
+    if os.path.isfile(hashes_path):
+        with open(hashes_path, 'r') as f:
+            hashes = json.load(f)
+
+    entry = hashes.get(file_path)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    hashes[file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                         'sha256': _sha256_of_file(file_path, chunk_size)}
+    os.makedirs(to_cache_path(), exist_ok=True)
+    _write_atomic(hashes_path, lambda tmp_path: _dump_json(hashes, tmp_path))
+
+    return hashes[file_path]['sha256']
+
+
+def _dump_json(obj, file_path):
+    with open(file_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+
+
+def _write_atomic(file_path, write):
+    """
+    Calls write(tmp_path) and moves the temporary file to file_path,
+    so readers never see a half written file.
+    """
+    tmp_path = f'{file_path}.{os.getpid()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_cache_file_path(source, name, key, suffix='parquet') -> str:
+    """
+    Returns the path of a cached file in 'dat/cache'.
+
+    :param source: Name of the dataset the file is derived from, e.g. 'fao_aquastat'
+    :param name: Name of the derived data, e.g. 'wide'
+    :param key: Hash of everything the data depends on
+    :param suffix: File extension
+    """
+    return to_cache_path(f'{source}__{name}__{key[:16]}.{suffix}')
+
+
+def write_cached_file(write, source, name, key, suffix='parquet') -> str:
+    """
+    Writes a file to 'dat/cache' with write(path). The file appears atomically.
+    Cached files of the same source and name with another key are stale and removed.
+
+    :param write: Function that writes the data to the given path
+    :param source: Name of the dataset the file is derived from, e.g. 'fao_aquastat'
+    :param name: Name of the derived data, e.g. 'wide'
+    :param key: Hash of everything the data depends on
+    :param suffix: File extension
+    :return: The path to the cached file
+    """
+    os.makedirs(to_cache_path(), exist_ok=True)
+    cache_path = get_cache_file_path(source, name, key, suffix)
+
+    print(f'Caching {source} ({name}) ...')
+    _write_atomic(cache_path, write)
+
+    invalidate_cache(source, name=name, keep_key=key)
+    return cache_path
+
+
+def read_cached_frame(source, name, key, columns=None, filters=None) -> pd.DataFrame | None:
+    """
+    Reads a dataframe from the binary cache in 'dat/cache'.
+
+    :param source: Name of the dataset the frame is derived from, e.g. 'fao_aquastat'
+    :param name: Name of the derived frame, e.g. 'wide'
+    :param key: Hash of everything the frame depends on
+    :param columns: Optional. Only read these columns. Columns that are not cached are skipped.
+    :param filters: Optional. Row filters passed to pd.read_parquet, e.g. [('Year', 'in', [2000, 2001])].
+    :return: The cached dataframe or None if there is no cache for this key
+    """
+    cache_path = get_cache_file_path(source, name, key)
+    if not os.path.isfile(cache_path):
+        return None
+
+    if columns is not None:
+        import pyarrow.parquet as pq
+        cached_columns = set(pq.read_schema(cache_path).names)
+        columns = [column for column in columns if column in cached_columns]
+
+    print(f'Reading cached {source} ({name}) ...')
+    return pd.read_parquet(cache_path, columns=columns, filters=filters)
+
+
+def write_cached_frame(df: pd.DataFrame, source, name, key) -> str:
+    """
+    Writes a dataframe to the binary cache in 'dat/cache'.
+    Cached frames of the same source and name with another key are stale and removed.
+
+    :param df: The dataframe to cache. It must have a default index.
+    :param source: Name of the dataset the frame is derived from, e.g. 'fao_aquastat'
+    :param name: Name of the derived frame, e.g. 'wide'
+    :param key: Hash of everything the frame depends on
+    :return: The path to the cached file
+    """
+    return write_cached_file(lambda tmp_path: df.to_parquet(tmp_path, index=False), source, name, key)
+
+
+def invalidate_cache(source, name=None, keep_key=None) -> int:
+    """
+    Removes cached files derived from a dataset.
+
+    :param source: Name of the dataset, e.g. 'fao_aquastat'
+    :param name: Optional. Only remove this derived frame.
+    :param keep_key: Optional. Keep the cache for this key.
+    :return: Number of removed files
+    """
+    if not os.path.isdir(to_cache_path()):
+        return 0
+
+    prefix = f'{source}__' if name is None else f'{source}__{name}__'
+    keep = None if keep_key is None else f'__{keep_key[:16]}.'
+
+    removed = 0
+    for cache_file in os.listdir(to_cache_path()):
+        if not cache_file.startswith(prefix) or (keep is not None and keep in cache_file):
+            continue
+        os.remove(to_cache_path(cache_file))
+        removed += 1
+
+    return removed
+
+
+def download_dataset(file_path=None, url=None, subfolder=None, sha256=None, session=None, refresh=False,
+                     progress=None) -> bool:
     """
     Downloads data from a URL and saves it to a file.
 
+    The file is streamed in chunks to '<file>.part' and only renamed to its final name when it is complete,
+    so an existing file is always a complete download. If a '.part' file is left over from an
+    interrupted download, the transfer is resumed with an HTTP Range request. The request carries the ETag
+    or Last-Modified of the interrupted transfer in If-Range, so the download starts over if the file changed.
+    Zip archives are extracted member by member into the same folder and removed afterwards.
+
+    The ETag, Last-Modified and size of every download are stored in 'dat/cache/download_validators.json'.
+    With refresh, an existing file is checked with a conditional request and only transferred again if the
+    server has a newer version. If its content really changed, the cached data derived from it is removed.
+
     :param file_path: The location to save the file in 'dat' folder. If None, the basename of the url is used
     :param url: the URL to download from
     :param subfolder: (optional) - name of subfolder in dat directory
+    :param sha256: (optional) - expected SHA-256 hash of the downloaded file (of the archive for zip files)
+    :param session: (optional) - requests.Session to reuse connections across downloads
+    :param refresh: (optional) - if True, check whether an existing file is up to date
+    :param progress: (optional) - function called with the bytes received so far and the total bytes
+    (None if unknown) when the transfer starts and after every chunk. The first call of a resumed download
+    reports the bytes that were already there.
     :return: bool indicating success
 
     Example:
@@ -70,56 +306,276 @@ def download_dataset(file_path=None, url=None, subfolder=None) -> bool:
         return False
 
     url_file_name = os.path.basename(url)
+    if file_path is None:
+        file_path = url_file_name
 
-    if subfolder is None:
-        dat_file_path = os.path.join(PATH_TO_DAT, file_path)
-        dat_url_file_path = os.path.join(PATH_TO_DAT, url_file_name)
-    else:
-        dat_file_path = os.path.join(PATH_TO_DAT, subfolder, file_path)
-        dat_url_file_path = os.path.join(PATH_TO_DAT, subfolder, url_file_name)
+    dat_folder = PATH_TO_DAT if subfolder is None else os.path.join(PATH_TO_DAT, subfolder)
+    dat_file_path = os.path.join(dat_folder, file_path)
+    dat_url_file_path = os.path.join(dat_folder, url_file_name)
+    part_file_path = f'{dat_url_file_path}.part'
 
-    if os.path.isfile(dat_file_path):
+    exists = os.path.isfile(dat_file_path)
+    validators = None
+    if exists and not refresh:
         print(f'{file_path} already exists.')
+        return True
+    elif exists:
+        print(f'Checking whether {file_path} is up to date ...')
+        validators = _get_download_validators(dat_file_path)
+        # A left-over part file may belong to another version
+        if os.path.isfile(part_file_path):
+            os.remove(part_file_path)
     else:
         print(f'{file_path} does not exist.')
-        print(f'Downloading {url_file_name} ...')
-        r = requests.get(url)
-        with open(dat_url_file_path, 'wb') as f:
-            bytes_written = f.write(r.content)
-            if bytes_written == 0:
-                print(f'Error downloading {url_file_name}!')
-                return False
-
-        # Check if the file exists
-        if not os.path.isfile(dat_url_file_path):
-            print(f'Downloaded {url_file_name} does not exist.')
+        os.makedirs(dat_folder, exist_ok=True)
+
+    # Download to a temporary file first
+    print(f'Downloading {url_file_name} ...')
+    try:
+        response_headers = _stream_to_file(url, part_file_path, session=session, validators=validators,
+                                           progress=progress)
+    except (requests.RequestException, OSError) as e:
+        print(f'Error downloading {url_file_name}: {e}')
+        return False
+
+    if response_headers is None:
+        print(f'{file_path} is up to date.')
+        return True
+
+    if os.path.getsize(part_file_path) == 0:
+        print(f'Error downloading {url_file_name}!')
+        os.remove(part_file_path)
+        return False
+
+    # Verify the hash
+    part_sha256 = _sha256_of_file(part_file_path)
+    if sha256 is not None and part_sha256 != sha256.lower():
+        print(f'Hash of {url_file_name} does not match! Expected {sha256}, got {part_sha256}.')
+        os.remove(part_file_path)
+        return False
+
+    new_validators = {
+        'url': url,
+        'etag': response_headers.get('ETag'),
+        'last_modified': response_headers.get('Last-Modified'),
+        'size': os.path.getsize(part_file_path),
+        'sha256': part_sha256,
+    }
+
+    # The server sent the file again, but it did not change
+    if exists and _get_downloaded_sha256(dat_file_path, validators, url_file_name) == part_sha256:
+        print(f'{file_path} did not change.')
+        os.remove(part_file_path)
+        _set_download_validators(dat_file_path, new_validators)
+        return True
+
+    # Check if the file is a zip file
+    if url_file_name.endswith('.zip'):
+        print(f'Unzipping {url_file_name} ...')
+        _extract_zip(part_file_path, dat_folder)
+        # Remove the zip file
+        print(f'Removing ZIP ...')
+        os.remove(part_file_path)
+
+        # Check if the file in the zip exists
+        if not os.path.isfile(dat_file_path):
+            print(f'Unzipped {file_path} does not exist.')
             return False
+    else:
+        # Rename the file, this is atomic
+        print(f'Renaming {url_file_name} to {file_path} ...')
+        os.replace(part_file_path, dat_file_path)
+        print("File saved to: ", dat_file_path)
 
-        # Check if the file is a zip file
-        if dat_url_file_path.endswith('.zip'):
-            # Unzip the file
-            import zipfile
-            print(f'Unzipping {dat_url_file_path} ...')
-            with zipfile.ZipFile(dat_url_file_path, 'r') as zip_ref:
-                zip_ref.extractall(os.path.dirname(file_path))
-            # Remove the zip file
-            print(f'Removing ZIP ...')
-            os.remove(dat_url_file_path)
-
-            # Check if the file in the zip exists
-            if not os.path.isfile(file_path):
-                print(f'Unzipped {file_path} does not exist.')
-                return False
-        else:
-            # Rename the file
-            print(f'Renaming {url_file_name} to {file_path} ...')
-            os.rename(dat_url_file_path, dat_file_path)
-            print("File saved to: ", dat_file_path)
+    _set_download_validators(dat_file_path, new_validators)
+
+    # Data derived from the old version is stale now
+    if exists:
+        source = Path(file_path).stem
+        removed = invalidate_cache(source)
+        print(f'{file_path} changed, removed {removed} cached files derived from it.')
 
     # If we get here, the file exists
     return True
 
 
+def _stream_to_file(url, part_file_path, chunk_size=DOWNLOAD_CHUNK_SIZE, session=None, validators=None,
+                    progress=None):
+    """
+    Streams url to part_file_path. If part_file_path exists, only the missing bytes are requested.
+    Raises an OSError if the transfer ends before all announced bytes arrived.
+
+    The file is requested without content encoding, so Content-Length and Range count the bytes of the file
+    itself. If the server compresses it anyway, the decoded file is written and cannot be resumed.
+
+    A part file is only resumed if the ETag or Last-Modified of the response that started it is known.
+    It is sent in If-Range, so a server with a newer version of the file answers with the whole file.
+
+    :param validators: Optional. Stored validators of an existing file, they make the request conditional.
+    :param progress: Optional. Function called with the bytes in the part file and the expected size
+    (None if unknown) when the transfer starts and after every chunk.
+    :return: The response headers or None if the server answered that the file did not change
+    """
+    offset = os.path.getsize(part_file_path) if os.path.isfile(part_file_path) else 0
+    if_range = _get_if_range(_get_download_validators(part_file_path)) if offset else None
+    if offset and if_range is None:
+        print('Starting over, the version of the part file is unknown ...')
+        offset = 0
+
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = if_range
+    if validators is not None:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    with (session or requests).get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+        if r.status_code == 304:
+            return None
+        if offset and r.status_code == 416:
+            # The part file is bigger than the remote file, start over
+            os.remove(part_file_path)
+            return _stream_to_file(url, part_file_path, chunk_size, session, validators, progress)
+        r.raise_for_status()
+
+        # Content-Length and Range refer to the compressed bytes, so the size can't be checked
+        encoded = r.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+
+        # The server ignored the Range header or the file changed, start over
+        if r.status_code != 206 or encoded:
+            offset = 0
+        elif offset:
+            print(f'Resuming at {offset} bytes ...')
+
+        # Remember the version of the part file, so an interrupted transfer can be resumed
+        if not offset:
+            _set_download_validators(part_file_path, {'etag': r.headers.get('ETag'),
+                                                      'last_modified': r.headers.get('Last-Modified')})
+
+        expected_size = r.headers.get('Content-Length')
+        expected_size = None if expected_size is None or encoded else offset + int(expected_size)
+
+        received = offset
+        if progress is not None:
+            progress(received, expected_size)
+        try:
+            with open(part_file_path, 'ab' if offset else 'wb') as f:
+                for chunk in r.raw.stream(chunk_size, decode_content=encoded):
+                    f.write(chunk)
+                    received += len(chunk)
+                    if progress is not None:
+                        progress(received, expected_size)
+        except urllib3.exceptions.HTTPError as e:
+            if encoded:
+                os.remove(part_file_path)
+            raise requests.ConnectionError(e) from e
+
+    size = os.path.getsize(part_file_path)
+    if expected_size is not None and size != expected_size:
+        raise OSError(f'received {size} of {expected_size} bytes, run again to resume')
+
+    _set_download_validators(part_file_path, None)
+    return r.headers
+
+
+def _get_if_range(validators) -> str | None:
+    """
+    Returns the If-Range value of the stored validators of a part file or None if it can not be resumed safely.
+    Weak ETags are not allowed in If-Range, then the Last-Modified date is used.
+    """
+    if validators is None:
+        return None
+    etag = validators.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return validators.get('last_modified')
+
+
+def _get_download_validators(dat_file_path) -> dict | None:
+    """
+    Returns the stored validators of a downloaded file or None if there are none.
+    """
+    validators_path = to_cache_path(DOWNLOAD_VALIDATORS_NAME)
+    with _download_validators_lock:
+        if not os.path.isfile(validators_path):
+            return None
+        with open(validators_path, 'r') as f:
+            return json.load(f).get(_download_key(dat_file_path))
+
+
+def _set_download_validators(dat_file_path, validators):
+    """
+    Stores the validators of a downloaded file, None removes them. Safe to call from several threads.
+    """
+    validators_path = to_cache_path(DOWNLOAD_VALIDATORS_NAME)
+    with _download_validators_lock:
+        all_validators = {}
+        if os.path.isfile(validators_path):
+            with open(validators_path, 'r') as f:
+                all_validators = json.load(f)
+
+        if validators is None:
+            if all_validators.pop(_download_key(dat_file_path), None) is None:
+                return
+        else:
+            all_validators[_download_key(dat_file_path)] = validators
+        os.makedirs(to_cache_path(), exist_ok=True)
+        _write_atomic(validators_path, lambda tmp_path: _dump_json(all_validators, tmp_path))
+
+
+def _download_key(dat_file_path) -> str:
+    return os.path.relpath(dat_file_path, PATH_TO_DAT)
+
+
+def _get_downloaded_sha256(dat_file_path, validators, url_file_name) -> str | None:
+    """
+    Returns the hash of the file as it was downloaded. For zip files only the stored hash of the archive is known.
+    """
+    if validators is not None and validators.get('sha256'):
+        return validators['sha256']
+    if url_file_name.endswith('.zip'):
+        return None
+    return _sha256_of_file(dat_file_path)
+
+
+def _extract_zip(zip_file_path, folder):
+    """
+    Extracts a zip archive member by member. Every member is streamed to a temporary file and renamed,
+    so no half extracted files are left behind.
+    """
+    import zipfile
+
+    folder = os.path.abspath(folder)
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+        for member in zip_ref.infolist():
+            target_path = os.path.abspath(os.path.join(folder, member.filename))
+            # Skip directories and members that would end up outside of the folder
+            if member.is_dir() or os.path.commonpath([folder, target_path]) != folder:
+                continue
+
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with zip_ref.open(member) as source:
+                _write_atomic(target_path, lambda tmp_path: _copy_to(source, tmp_path))
+
+
+def _copy_to(source, file_path):
+    import shutil
+
+    with open(file_path, 'wb') as target:
+        shutil.copyfileobj(source, target, DOWNLOAD_CHUNK_SIZE)
+
+
+def _sha256_of_file(file_path, chunk_size=1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 def open_dataset(file_path=None, mode='r') -> TextIO | None:
     """
     Opens a file in 'dat' folder.
@@ -174,7 +630,180 @@ def get_dataframe(file_path=None, url=None) -> pd.DataFrame | None:
     return import_df
 
 
-def save_fig(fig: plt, fig_name=None, fig_path=None, experimental=True) -> str | bool:
+def figure_fingerprint(*objects, code=None) -> str:
+    """
+    Returns the fingerprint of a figure: a hash of its input data, its parameters and the code generating it.
+    Dataframes, series and arrays are hashed by content, colormaps by their colors and everything else as JSON.
+
+    :param objects: Data slice and parameters of the figure
+    :param code: Optional. Function, module or list of them. The source code of their whole modules is part of
+    the fingerprint, so edits to the helpers next to a function change it too. List the helpers from other
+    modules as well, e.g. get_world_paths or the rgb palette module.
+    :return: Hex digest of the figure inputs
+
+    Example:
+    >>> fingerprint = figure_fingerprint(countries_df, variable, year, code=[plot_world, get_world_paths, rgb])
+    >>> if not is_fig_up_to_date(fingerprint, f'world_map_{variable}_{year}', 'water_management'):
+    ...     save_fig(fig, f'world_map_{variable}_{year}', 'water_management', fingerprint=fingerprint)
+    """
+    parts = [_fingerprint_part(obj) for obj in objects]
+    for obj in make_list(code, 1):
+        module = obj if inspect.ismodule(obj) else inspect.getmodule(obj)
+        try:
+            parts.append(inspect.getsource(module if module is not None else obj))
+        except (OSError, TypeError):
+            parts.append(getattr(obj, '__qualname__', repr(obj)))
+    return hash_objects(*parts)
+
+
+def _fingerprint_part(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        columns = list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name
+        content = pd.util.hash_pandas_object(obj, index=not isinstance(obj, pd.Index)).to_numpy()
+        return [columns, str(obj.dtypes), hashlib.sha256(content.tobytes()).hexdigest()]
+    if isinstance(obj, np.ndarray):
+        return [str(obj.dtype), obj.shape, hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()]
+    if isinstance(obj, Colormap):
+        return [obj.name, _fingerprint_part(obj(np.linspace(0, 1, obj.N)))]
+    if isinstance(obj, (list, tuple)):
+        return [_fingerprint_part(item) for item in obj]
+    if isinstance(obj, dict):
+        return {str(key): _fingerprint_part(value) for key, value in obj.items()}
+    return obj
+
+
+def get_fig_file_path(fig_name, fig_path=None, experimental=True, profile=None) -> str:
+    """
+    Returns the file a figure is saved to by save_fig.
+
+    :param fig_name: The name of the figure
+    :param fig_path: The location of the figure in 'fig' or 'exp/fig'
+    :param experimental: If True, the figure is in 'exp/fig'. Otherwise, in 'fig'.
+    :param profile: Optional. Output profile in FIG_PROFILES, it sets the file extension.
+    """
+    file_format = get_fig_profile(profile)['format']
+
+    # If fig_name does not begin with 'fig_', add it
+    if not fig_name.startswith('fig_'):
+        fig_name = f'fig_{fig_name}'
+
+    # If fig_name ends with '.pdf', remove it
+    if fig_name.endswith('.pdf'):
+        fig_name = fig_name[:-4]
+
+    # Start with 'exp/fig' or 'fig' and add fig_path
+    folder = to_fig_path(fig_path, experimental=experimental)
+    return os.path.join(folder, f'{fig_name}.{file_format}')
+
+
+def is_fig_up_to_date(fingerprint, fig_name, fig_path=None, experimental=True, profile=None) -> bool:
+    """
+    Returns True if the figure file exists and was saved with the same fingerprint, see figure_fingerprint.
+    Figure functions use this to skip rendering figures whose inputs did not change.
+
+    :param fingerprint: Fingerprint of the figure that would be rendered
+    :param fig_name: The name of the figure, see save_fig
+    :param fig_path: The location of the figure, see save_fig
+    :param experimental: If True, the figure is in 'exp/fig'. Otherwise, in 'fig'.
+    :param profile: Optional. Output profile in FIG_PROFILES, see save_fig.
+    """
+    profile = profile or DEFAULT_FIG_PROFILE
+    file_path = get_fig_file_path(fig_name, fig_path, experimental, profile)
+    if not os.path.isfile(file_path):
+        return False
+
+    entry = _read_figure_manifest().get(_figure_key(file_path))
+    return (entry is not None and entry['fingerprint'] == fingerprint and entry.get('profile') == profile
+            and entry['size'] == os.path.getsize(file_path))
+
+
+def _figure_key(file_path) -> str:
+    return os.path.relpath(os.path.abspath(file_path), os.path.abspath(PATH_TO_DAT / '..'))
+
+
+def _read_figure_manifest() -> dict:
+    manifest_path = to_cache_path(FIGURE_MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+@contextmanager
+def _locked_file(file_path, thread_lock):
+    """
+    Holds a thread lock and an exclusive lock on 'file_path.lock', so threads and processes can read,
+    change and write file_path in turn. Without fcntl, only threads of the same process wait for each other.
+    """
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(f'{file_path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _set_figure_fingerprint(file_path, fingerprint, profile):
+    """
+    Records the fingerprint of a saved figure in 'dat/cache/figure_manifest.json', None removes it.
+    Safe to call from several threads and processes, e.g. figure scripts using run_jobs.
+    """
+    key = _figure_key(file_path)
+    with _locked_file(to_cache_path(FIGURE_MANIFEST_NAME), _figure_manifest_lock):
+        manifest = _read_figure_manifest()
+        if fingerprint is None:
+            if manifest.pop(key, None) is None:
+                return
+        else:
+            manifest[key] = {'fingerprint': fingerprint, 'profile': profile, 'size': os.path.getsize(file_path)}
+
+        os.makedirs(to_cache_path(), exist_ok=True)
+        _write_atomic(to_cache_path(FIGURE_MANIFEST_NAME), lambda tmp_path: _dump_json(manifest, tmp_path))
+
+
+def write_fig(fig, file_path, profile=None, rasterize=None) -> str:
+    """
+    Writes a figure to a file with an output profile and prints how long it took and how big the file is.
+
+    :param fig: The figure to write
+    :param file_path: The file to write to. Its extension is replaced by the format of the profile.
+    :param profile: Optional. Output profile in FIG_PROFILES. By default, DEFAULT_FIG_PROFILE.
+    :param rasterize: Optional. Artists to rasterize in addition to the meshes if the profile rasterizes,
+    e.g. the polygon collection of a world map.
+    :return: The path to the written file
+    """
+    settings = get_fig_profile(profile)
+    file_path = f'{os.path.splitext(file_path)[0]}.{settings["format"]}'
+
+    # Rasterize the heavy layers for this file only
+    rasterized = []
+    if settings['rasterize']:
+        meshes = [artist for ax in fig.axes for artist in ax.get_children() if isinstance(artist, QuadMesh)]
+        rasterized = [artist for artist in dict.fromkeys(meshes + list(rasterize or []))
+                      if not artist.get_rasterized()]
+        for artist in rasterized:
+            artist.set_rasterized(True)
+
+    print(f'Saving figure to {os.path.relpath(file_path)} ...', end=' ')
+    start = time.perf_counter()
+    try:
+        fig.savefig(file_path, format=settings['format'], dpi=settings['dpi'], bbox_inches='tight')
+    finally:
+        for artist in rasterized:
+            artist.set_rasterized(False)
+    print(f'Done! ({os.path.getsize(file_path) / 1e6:.2f} MB in {time.perf_counter() - start:.2f} s)')
+
+    return file_path
+
+
+def save_fig(fig: plt, fig_name=None, fig_path=None, experimental=True, fingerprint=None,
+             profile=None, rasterize=None) -> str | bool:
     """
     Saves a figure to a file.
 
@@ -182,6 +811,12 @@ def save_fig(fig: plt, fig_name=None, fig_path=None, experimental=True) -> str |
     :param fig: The figure to save
     :param fig_name: the name of the figure
     :param fig_path: the location to save the figure to. IMPORTANT! You don't need to specify 'out' folder.
+    :param fingerprint: Optional. Fingerprint of the figure inputs, see figure_fingerprint.
+    It is recorded in the figure manifest, so is_fig_up_to_date can skip the figure next time.
+    :param profile: Optional. Output profile in FIG_PROFILES: 'vector' PDF, 'hybrid' PDF with rasterized
+    meshes or 'png' preview. By default, DEFAULT_FIG_PROFILE ('vector' unless the FIG_PROFILE
+    environment variable is set).
+    :param rasterize: Optional. More artists to rasterize with the 'hybrid' profile, see write_fig.
     :return: Bool indicating success or the path to the saved figure
 
     Example:
@@ -207,37 +842,21 @@ def save_fig(fig: plt, fig_name=None, fig_path=None, experimental=True) -> str |
     if fig_name is None:
         fig_name = random_fig_name()
 
-    # If fig_name does not begin with 'fig_', add it
-    if not fig_name.startswith('fig_'):
-        fig_name = f'fig_{fig_name}'
-
-    # If fig_name ends with '.pdf', remove it
-    if fig_name.endswith('.pdf'):
-        fig_name = fig_name[:-4]
-
-    # Start with 'exp/fig' or 'fig'
-    _internal_fig_path = FIG_PATH
-    if experimental:
-        _internal_fig_path = FIG_EXP_PATH
-
-    # If fig_path is not None, add it
-    if fig_path is not None:
-        _internal_fig_path = os.path.join(_internal_fig_path, fig_path)
+    profile = profile or DEFAULT_FIG_PROFILE
+    _internal_fig_path = get_fig_file_path(fig_name, fig_path, experimental, profile)
 
     # If fig_path does not exist, create it
-    if not os.path.isdir(_internal_fig_path):
-        print(f'{_internal_fig_path} does not exist.')
-        print(f'Creating {_internal_fig_path} ...')
-        os.makedirs(_internal_fig_path, exist_ok=True)
-
-    # Add file name
-    _internal_fig_path = os.path.join(_internal_fig_path, f'{fig_name}.pdf')
+    _internal_fig_folder = os.path.dirname(_internal_fig_path)
+    if not os.path.isdir(_internal_fig_folder):
+        print(f'{_internal_fig_folder} does not exist.')
+        print(f'Creating {_internal_fig_folder} ...')
+        os.makedirs(_internal_fig_folder, exist_ok=True)
 
     # Save figure
-    _print_fig_path = os.path.relpath(_internal_fig_path)
-    print(f'Saving figure to {_print_fig_path} ...', end=' ')
-    fig.savefig(_internal_fig_path, dpi=300, bbox_inches='tight')
-    print('Done!')
+    write_fig(fig, _internal_fig_path, profile, rasterize=rasterize)
+
+    # Remember the inputs of the figure, a figure without fingerprint is never up to date
+    _set_figure_fingerprint(_internal_fig_path, fingerprint, profile)
 
     return _internal_fig_path
 
@@ -0,0 +1,178 @@
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy import sparse
+
+from src.aquastat_utils import AQUASTAT_CACHE_SOURCE, get_aquastat_cache_key
+from src.climate import CLIMATE_CHUNK_BYTES, open_climate_data
+from src.country_index import COUNTRY_INDEX_VERSION, get_country_index
+from src.geometry import get_world, get_world_cache_key
+from src.utils import get_cache_file_path, hash_objects, write_cached_file
+
+# Bump this if the computation of the weights changes, so old caches are rebuilt
+COUNTRY_WEIGHTS_VERSION = 1
+
+
+def get_cell_bounds(centers, limits=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the lower and upper bound of every grid cell of a regular axis, halfway between the centers.
+
+    :param centers: Cell centers, ascending or descending
+    :param limits: Optional. Tuple of the smallest and largest allowed bound, e.g. (-90, 90) for latitudes
+    """
+    centers = np.asarray(centers, dtype='float64')
+    if len(centers) == 1:
+        raise ValueError('A grid axis needs at least two cells!')
+
+    middles = (centers[1:] + centers[:-1]) / 2
+    edges = np.concatenate([[2 * centers[0] - middles[0]], middles, [2 * centers[-1] - middles[-1]]])
+    if limits is not None:
+        edges = np.clip(edges, *limits)
+    return np.minimum(edges[:-1], edges[1:]), np.maximum(edges[:-1], edges[1:])
+
+
+def get_country_weights(lat, lon) -> tuple[sparse.csr_matrix, pd.Index]:
+    """
+    Returns the area weights of every AQUASTAT country on a regular latitude-longitude grid.
+
+    The weight of a country in a cell is the area of their intersection, in square degrees times
+    the cosine of the cell latitude, so it is proportional to the area on the globe. The countries are
+    the polygons of get_world() mapped to AQUASTAT countries like in to_world_values.
+    The matrix is cached in 'dat/cache' per grid.
+
+    :param lat: Latitudes of the cell centers
+    :param lon: Longitudes of the cell centers, from -180 to 180 or from 0 to 360
+    :return: Tuple of a sparse matrix with one row per country and one column per cell (latitude major,
+    like values.reshape(-1)), and the AQUASTAT names of the rows
+
+    Example:
+    >>> weights, countries = get_country_weights(data['lat'], data['lon'])
+    >>> country_means = weights @ np.nan_to_num(grid.ravel()) / (weights @ ~np.isnan(grid.ravel()))
+    """
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    crosswalk, world_codes = get_country_index()
+    countries = pd.Index(crosswalk['Country'], name='Country')
+
+    cache_key = hash_objects(lat.tolist(), lon.tolist(), get_world_cache_key(), get_aquastat_cache_key(),
+                             COUNTRY_INDEX_VERSION, COUNTRY_WEIGHTS_VERSION)
+    name = f'country_weights_{len(lat)}x{len(lon)}'
+    cache_path = get_cache_file_path(AQUASTAT_CACHE_SOURCE, name, cache_key, suffix='npz')
+    if os.path.isfile(cache_path):
+        print(f'Reading cached {AQUASTAT_CACHE_SOURCE} ({name}) ...')
+        return sparse.load_npz(cache_path).tocsr(), countries
+
+    print(f'Building country weights for a {len(lat)} x {len(lon)} grid ...')
+    polygon_weights = _get_polygon_weights(lat, lon)
+
+    # Add up the polygons of every country, polygons without an AQUASTAT country are dropped
+    has_country = world_codes >= 0
+    polygons_to_countries = sparse.csr_matrix(
+        (np.ones(has_country.sum()), (world_codes[has_country], np.flatnonzero(has_country))),
+        shape=(len(countries), len(world_codes)))
+    weights = (polygons_to_countries @ polygon_weights).tocsr()
+
+    def write(tmp_path):
+        # save_npz appends '.npz' to paths, but not to open files
+        with open(tmp_path, 'wb') as f:
+            sparse.save_npz(f, weights)
+
+    write_cached_file(write, AQUASTAT_CACHE_SOURCE, name, cache_key, suffix='npz')
+    return weights, countries
+
+
+def _get_polygon_weights(lat, lon) -> sparse.csr_matrix:
+    """
+    Returns the area weights of every row of get_world() on the grid, see get_country_weights.
+    """
+    south, north = get_cell_bounds(lat, limits=(-90, 90))
+    west, east = get_cell_bounds(lon)
+
+    # Move the cells to the longitudes of the world map, from -180 to 180
+    shift = 360 * np.floor((west + 180) / 360)
+    west, east = west - shift, east - shift
+
+    # One box per cell, latitude major. Boxes across the date line get a copy on the other side.
+    cell_south, cell_west = np.meshgrid(south, west, indexing='ij')
+    cell_north, cell_east = np.meshgrid(north, east, indexing='ij')
+    cells = np.arange(cell_south.size)
+    boxes_cells = [cells]
+    boxes = [shapely.box(cell_west.ravel(), cell_south.ravel(), cell_east.ravel(), cell_north.ravel())]
+    for shift, outside in ((360, cell_west.ravel() < -180), (-360, cell_east.ravel() > 180)):
+        boxes_cells.append(cells[outside])
+        boxes.append(shapely.box(cell_west.ravel()[outside] + shift, cell_south.ravel()[outside],
+                                 cell_east.ravel()[outside] + shift, cell_north.ravel()[outside]))
+    boxes_cells = np.concatenate(boxes_cells)
+    boxes = np.concatenate(boxes)
+
+    # Intersect every polygon only with the boxes it touches
+    polygons = get_world().geometry.to_numpy()
+    polygon_rows, box_rows = shapely.STRtree(boxes).query(polygons, predicate='intersects')
+    areas = shapely.area(shapely.intersection(polygons[polygon_rows], boxes[box_rows]))
+
+    cell_rows = boxes_cells[box_rows]
+    cell_lat = np.repeat((south + north) / 2, len(lon))
+    weights = areas * np.cos(np.radians(cell_lat[cell_rows]))
+
+    # Duplicated entries of the copied boxes are summed up
+    return sparse.csr_matrix((weights, (polygon_rows, cell_rows)), shape=(len(polygons), cell_south.size))
+
+
+def get_country_series(dataset, variable, window=None, chunk_bytes=CLIMATE_CHUNK_BYTES) -> pd.DataFrame:
+    """
+    Returns the area weighted mean of a gridded variable in every AQUASTAT country and time step.
+    The file is read in time chunks and each chunk is reduced with one sparse matrix product.
+    Cells without a value (e.g. NaN over the ocean) are left out of the mean.
+
+    :param dataset: Name of the dataset in DATASETS or the path to a NetCDF file, see open_climate_data
+    :param variable: Name of the variable with the dimensions 'time', 'lat' and 'lon', e.g. 'precip'.
+    Other dimensions must have a single entry.
+    :param window: Optional. Tuple of the first and last time, see get_window_labels. By default, all time steps.
+    :param chunk_bytes: Optional. Maximum number of bytes read at once
+    :return: Dataframe with one row per time step and one column per AQUASTAT country,
+    NaN for countries without values
+
+    Example:
+    >>> series = get_country_series('noaa_global_temperature', 'anom')
+    >>> series.groupby(series.index.year).mean()['Peru']
+    """
+    with open_climate_data(dataset) as data:
+        data_array = data[variable]
+        if window is not None:
+            data_array = data_array.sel(time=slice(*window))
+
+        # Drop dimensions like a single depth level
+        extra_dims = [dim for dim in data_array.dims if dim not in ('time', 'lat', 'lon')]
+        if any(data_array.sizes[dim] != 1 for dim in extra_dims):
+            raise ValueError(f'{variable} has more than one entry along {", ".join(extra_dims)}!')
+        data_array = data_array.isel({dim: 0 for dim in extra_dims}).transpose('time', 'lat', 'lon')
+
+        weights, countries = get_country_weights(data_array['lat'], data_array['lon'])
+        n_cells = data_array.sizes['lat'] * data_array.sizes['lon']
+        chunk_size = max(chunk_bytes // (n_cells * 8), 1)
+
+        means = np.full((data_array.sizes['time'], len(countries)), np.nan)
+        for start in range(0, data_array.sizes['time'], chunk_size):
+            chunk = data_array.isel(time=slice(start, start + chunk_size)).to_numpy().reshape(-1, n_cells)
+            valid = ~np.isnan(chunk)
+            sums = weights @ np.where(valid, chunk, 0).T
+            covered = weights @ valid.T
+            np.divide(sums, covered, out=means[start:start + len(chunk)].T, where=covered > 0)
+
+        return pd.DataFrame(means, index=data_array.indexes['time'], columns=countries)
+
+
+def to_aquastat_frame(series: pd.DataFrame, name) -> pd.DataFrame:
+    """
+    Converts country series to yearly means in the layout of get_aquastat(),
+    so they can be merged with the AQUASTAT variables on 'Country' and 'Year'.
+
+    :param series: Dataframe of get_country_series
+    :param name: Name of the new variable, e.g. 'Annual precipitation'
+    :return: Dataframe with the columns 'Country', 'Year' and name
+    """
+    yearly = series.groupby(series.index.year).mean()
+    yearly.index.name = 'Year'
+    return yearly.stack().rename(name).reset_index()[['Country', 'Year', name]]
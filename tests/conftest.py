@@ -0,0 +1,39 @@
+import os
+import sys
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+# Make the src package importable and keep the tests off any display
+sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+matplotlib.use('Agg')
+
+
+@pytest.fixture
+def make_panel():
+    """
+    Returns a function that builds a synthetic table in the layout of get_aquastat(), with the columns
+    'Country', 'Year' and one column of random values per variable.
+    """
+    def make(countries, years, variables, seed, missing=0.0, drop=(), adjust=None) -> pd.DataFrame:
+        """
+        :param countries: Countries of the table
+        :param years: Years of the table
+        :param variables: Names of the value columns
+        :param seed: Seed of the random values
+        :param missing: Optional. Share of values that are set to NaN
+        :param drop: Optional. (country, year) tuples without a row at all
+        :param adjust: Optional. Function applied to the frame with a (Country, Year) index before values are
+        set to NaN, e.g. to add a dependency between variables
+        """
+        rng = np.random.default_rng(seed)
+        index = pd.MultiIndex.from_product([countries, years], names=['Country', 'Year'])
+        df = pd.DataFrame(rng.normal(size=(len(index), len(variables))), index=index, columns=variables)
+        if adjust is not None:
+            df = adjust(df)
+        df = df.mask(rng.random(df.shape) < missing)
+        return df.drop(list(drop)).reset_index()
+
+    return make
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from src.aquastat_cube import AquastatCube
+
+
+def make_raw():
+    return pd.DataFrame({
+        'Country': ['Peru', 'Peru', 'Peru', 'Chile', 'Chile', 'Peru'],
+        'Year': [2000, 2001, 2000, 2001, 2001, 2000],
+        'Variable': ['Population', 'Population', 'Rainfall', 'Rainfall', 'Population', 'Population'],
+        'Value': [1.0, 2.0, 3.0, 4.0, 5.0, 99.0],
+    })
+
+
+def test_from_raw_matches_pivot_table():
+    raw_df = make_raw()
+    cube = AquastatCube.from_raw(raw_df)
+
+    expected = raw_df.pivot_table(index=['Country', 'Year'], columns='Variable', values='Value', aggfunc='first')
+    wide = cube.to_wide().set_index(['Country', 'Year'])
+    pd.testing.assert_frame_equal(wide, expected, check_names=False, check_column_type=False)
+
+
+def test_from_raw_keeps_first_duplicate():
+    cube = AquastatCube.from_raw(make_raw())
+    assert cube.get('Peru', 2000, 'Population') == 1.0
+
+
+def test_from_raw_skips_missing_duplicates():
+    raw_df = make_raw()
+    raw_df.loc[0, 'Value'] = np.nan
+    # A cell with only a missing value
+    raw_df.loc[len(raw_df)] = ['Chile', 2000, 'Rainfall', np.nan]
+    cube = AquastatCube.from_raw(raw_df)
+
+    assert cube.get('Peru', 2000, 'Population') == 99.0
+    assert np.isnan(cube.get('Chile', 2000, 'Rainfall'))
+    expected = raw_df.pivot_table(index=['Country', 'Year'], columns='Variable', values='Value', aggfunc='first')
+    wide = cube.to_wide().set_index(['Country', 'Year'])
+    pd.testing.assert_frame_equal(wide, expected, check_names=False, check_column_type=False)
+
+
+def test_from_wide_round_trip():
+    wide = AquastatCube.from_raw(make_raw()).to_wide()
+    cube = AquastatCube.from_wide(wide)
+
+    pd.testing.assert_frame_equal(cube.to_wide(), wide)
+    assert cube.shape == (2, 2, 2)
+    assert cube.density == 5 / 8
+    assert np.isnan(cube.get('Chile', 2000, 'Population'))
+
+
+def test_series_skips_missing_years():
+    cube = AquastatCube.from_raw(make_raw())
+
+    series = cube.series('Chile', 'Rainfall')
+    assert series.index.tolist() == [2001]
+    assert series.tolist() == [4.0]
+    assert cube.variable('Rainfall').loc['Peru', 2000] == 3.0
+
+
+def test_from_raw_matches_from_wide(make_panel):
+    wide = make_panel(['Chile', 'Peru', 'Spain'], range(2000, 2008), ['Population', 'Rainfall', 'Withdrawal'],
+                      seed=8, missing=0.4, drop=[('Spain', 2003)])
+    raw_df = wide.melt(id_vars=['Country', 'Year'], var_name='Variable', value_name='Value').dropna()
+
+    cube = AquastatCube.from_wide(wide)
+    pd.testing.assert_frame_equal(AquastatCube.from_raw(raw_df).to_wide(), cube.to_wide())
+    assert cube.density == wide[cube.variables].notna().sum().sum() / (3 * 8 * 3)
@@ -0,0 +1,145 @@
+import geopandas as gpd
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from src import aquastat_plot, utils
+from src.geometry import _to_path
+
+COUNTRIES = ['Chile', 'Peru', 'Spain']
+
+
+class NoBundles:
+    # The tueplots bundles render text with LaTeX, which is not needed to check the output
+    @staticmethod
+    def icml2022(**kwargs):
+        return {}
+
+
+@pytest.fixture
+def world(tmp_path, monkeypatch):
+    """
+    Replaces the world map with one box per country and writes figures and the manifest to tmp_path.
+    """
+    world = gpd.GeoDataFrame({'SOVEREIGNT': COUNTRIES},
+                             geometry=[shapely.box(i * 10, 0, i * 10 + 8, 8) for i in range(len(COUNTRIES))])
+    world = world.set_index('SOVEREIGNT')
+
+    def to_world_values(countries, values):
+        return pd.Series(np.asarray(values, dtype='float64'), index=list(countries)).reindex(COUNTRIES).to_numpy()
+
+    def get_world(level=0):
+        draws.append('world')
+        return world
+
+    def get_world_paths(level=0):
+        draws.append('paths')
+        return [_to_path(geometry) for geometry in world.geometry]
+
+    # Every drawn map loads the world map once
+    draws = []
+    world.attrs['draws'] = draws
+
+    monkeypatch.setattr(aquastat_plot, 'bundles', NoBundles)
+    monkeypatch.setattr(aquastat_plot, 'get_world', get_world)
+    monkeypatch.setattr(aquastat_plot, 'get_world_paths', get_world_paths)
+    monkeypatch.setattr(aquastat_plot, 'to_world_values', to_world_values)
+    monkeypatch.setattr(aquastat_plot.plt, 'show', lambda: None)
+    monkeypatch.setattr(utils, 'FIG_EXP_PATH', tmp_path / 'fig')
+    monkeypatch.setattr(utils, 'PATH_TO_CACHE', tmp_path / 'cache')
+    monkeypatch.setitem(plt.rcParams, 'text.usetex', False)
+    yield world
+    plt.close('all')
+
+
+@pytest.fixture
+def data():
+    return pd.DataFrame({'Country': ['Chile', 'Peru', 'Chile', 'Peru'], 'Year': [2000, 2000, 2010, 2010],
+                         'Rainfall': [1.0, 2.0, 3.0, np.nan]})
+
+
+def _count_images(file_path) -> int:
+    with open(file_path, 'rb') as f:
+        return f.read().count(b'/Subtype /Image')
+
+
+def _render(data, profile, monkeypatch) -> tuple[int, int]:
+    """
+    Returns the number of images in the batch map and in the plot_world map saved with a profile.
+    """
+    monkeypatch.setattr(utils, 'DEFAULT_FIG_PROFILE', profile)
+    batch_path, = aquastat_plot.plot_world_batch(data, [('Rainfall', 2000)], force=True)
+    _, ax = aquastat_plot.plot_world(data, 'Rainfall', year=2010, force=True)
+    # Only rasterized while saving
+    assert not any(collection.get_rasterized() for collection in ax.collections)
+
+    world_path = utils.get_fig_file_path('world_map_Rainfall_2010', 'water_management', profile=profile)
+    return _count_images(batch_path), _count_images(world_path)
+
+
+def test_hybrid_world_map_rasterizes_polygons(world, data, monkeypatch):
+    # The colorbar is an image in every profile, the polygons only in 'hybrid'
+    vector_images = _render(data, 'vector', monkeypatch)
+    hybrid_images = _render(data, 'hybrid', monkeypatch)
+    assert all(hybrid > vector for hybrid, vector in zip(hybrid_images, vector_images))
+
+
+def test_plot_world_skips_up_to_date_maps(world, data):
+    draws = world.attrs['draws']
+    fig, _ = aquastat_plot.plot_world(data, 'Rainfall', year=2000)
+    assert len(draws) == 1
+
+    # Nothing is drawn for the same inputs, the saved map is returned
+    assert aquastat_plot.plot_world(data, 'Rainfall', year=2000) == utils.get_fig_file_path(
+        'world_map_Rainfall_2000', 'water_management')
+    assert len(draws) == 1
+
+    aquastat_plot.plot_world(data, 'Rainfall', year=2000, force=True)
+    assert len(draws) == 2
+    aquastat_plot.plot_world(data.assign(Rainfall=data['Rainfall'] * 2), 'Rainfall', year=2000)
+    assert len(draws) == 3
+    aquastat_plot.plot_world(data, 'Rainfall', year=2000, title='Rainfall')
+    assert len(draws) == 4
+
+
+def test_plot_world_batch_skips_up_to_date_maps(world, data):
+    draws = world.attrs['draws']
+    specs = [('Rainfall', 2000), ('Rainfall', 2010), ('Rainfall', 1990)]
+    first = aquastat_plot.plot_world_batch(data, specs)
+    assert first[2] is False
+    assert len(draws) == 1
+
+    # All maps are up to date, the figure is not even built
+    assert aquastat_plot.plot_world_batch(data, specs) == first
+    assert len(draws) == 1
+
+    changed = data.copy()
+    changed.loc[changed['Year'] == 2010, 'Rainfall'] = 7.0
+    assert aquastat_plot.plot_world_batch(changed, specs) == first
+    assert len(draws) == 2
+    assert aquastat_plot.plot_world_batch(data, specs[:1], force=True) == first[:1]
+    assert len(draws) == 3
+
+
+def test_plot_growth_rate_skips_up_to_date_maps(world, data):
+    draws = world.attrs['draws']
+    aquastat_plot.plot_growth_rate(data, 'Rainfall')
+    assert len(draws) == 1
+    assert aquastat_plot.plot_growth_rate(data, 'Rainfall') == utils.get_fig_file_path(
+        'growth_rate_Rainfall', 'water_management')
+    assert len(draws) == 1
+    aquastat_plot.plot_growth_rate(data, 'Rainfall', force=True)
+    assert len(draws) == 2
+
+
+def test_fill_placeholders():
+    assert aquastat_plot.fill_placeholders('{variable} in {year}', 'Rainfall', 2000) == 'Rainfall in 2000'
+    assert aquastat_plot.fill_placeholders('{variable} (km$^{3}$)', 'Rainfall', 2000) == 'Rainfall (km$^{3}$)'
+
+
+def test_plot_world_batch_with_latex_braces(world, data):
+    saved = aquastat_plot.plot_world_batch(data, [('Rainfall', 2000)], title='{variable} in {year}',
+                                           label='{variable} in 10$^{9}$ m$^{3}$/year')
+    assert saved[0].endswith('.pdf')
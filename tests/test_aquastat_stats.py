@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from src.aquastat_plot import get_growth_rate, get_slope
+from src.aquastat_stats import get_growth_rates, get_lagged_correlations, growth_rates, linregress_groups, ols_slopes
+
+VARIABLES = ['Rainfall', 'Population', 'Withdrawal']
+
+
+@pytest.fixture
+def wide(make_panel):
+    def add_lagged_rainfall(df):
+        df['Withdrawal'] += 0.5 * df.groupby('Country')['Rainfall'].shift(2)
+        return df
+
+    # Years without a row at all, a lag by one row is then not a lag by one year
+    return make_panel(['Chile', 'Peru', 'Spain', 'Togo', 'Yemen'], range(2000, 2016), VARIABLES, seed=2,
+                      missing=0.2, drop=[('Peru', 2004), ('Peru', 2005), ('Togo', 2010)], adjust=add_lagged_rainfall)
+
+
+def _reference(wide, target, variable, lag):
+    """
+    Returns scipy.stats.linregress of the target against the variable lag years earlier in the same country.
+    """
+    years = range(wide['Year'].min(), wide['Year'].max() + 1)
+    full = wide.set_index(['Country', 'Year']).reindex(
+        pd.MultiIndex.from_product([wide['Country'].unique(), years], names=['Country', 'Year']))
+    pairs = pd.DataFrame({'x': full.groupby('Country')[variable].shift(lag), 'y': full[target]}).dropna()
+    if len(pairs) < 3:
+        return len(pairs), None
+    return len(pairs), stats.linregress(pairs['x'], pairs['y'])
+
+
+@pytest.mark.parametrize('min_lag', [0, 1])
+def test_lagged_correlations_match_scipy(wide, min_lag):
+    result = get_lagged_correlations(wide, 'Withdrawal', max_lag=4, min_lag=min_lag)
+    assert len(result) == 2 * (5 - min_lag)
+
+    for _, row in result.iterrows():
+        n, expected = _reference(wide, 'Withdrawal', row['Variable'], row['Lag'])
+        assert row['Observations'] == n
+        assert np.allclose(row[['Correlation', 'Slope', 'Intercept', 'P-value', 'Stderr']].astype(float),
+                           [expected.rvalue, expected.slope, expected.intercept, expected.pvalue, expected.stderr])
+
+    strongest = result.loc[result['Correlation'].abs().idxmax()]
+    assert (strongest['Variable'], strongest['Lag']) == ('Rainfall', 2)
+
+
+def test_lagged_correlations_too_few_observations(wide):
+    result = get_lagged_correlations(wide[wide['Country'] == 'Chile'].head(4), 'Withdrawal', 'Rainfall',
+                                     max_lag=3, min_lag=3)
+    assert result['Observations'].tolist() == [1]
+    assert result[['Correlation', 'Slope', 'P-value']].isna().all(axis=None)
+
+
+@pytest.fixture
+def long():
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({
+        'Country': rng.choice(['Chile', 'Peru', 'Spain', None], size=200),
+        'Region': rng.choice(['North', 'South'], size=200),
+        'x': rng.normal(size=200),
+    })
+    df['y'] = 2 * df['x'] + rng.normal(size=200)
+    df.loc[rng.random(200) < 0.1, 'y'] = np.nan
+    return df
+
+
+def _check_groups(result, df, by):
+    rows = df.dropna(subset=['x', 'y', *by])
+    for key, group in rows.groupby(by, observed=True):
+        expected = stats.linregress(group['x'], group['y'])
+        row = result.loc[key[0] if len(by) == 1 else key]
+        assert row['Observations'] == len(group)
+        assert np.allclose(row[['Correlation', 'Slope', 'Intercept', 'P-value', 'Stderr']].astype(float),
+                           [expected.rvalue, expected.slope, expected.intercept, expected.pvalue, expected.stderr])
+
+
+@pytest.mark.parametrize('by', [['Country'], ['Country', 'Region']])
+def test_linregress_groups_match_scipy(long, by):
+    result = linregress_groups(long, 'x', 'y', by=by if len(by) > 1 else by[0])
+    assert len(result) == len(long.dropna(subset=by).groupby(by))
+    _check_groups(result, long, by)
+
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_linregress_groups_categorical_keys(long):
+    long['Country'] = pd.Categorical(long['Country'], categories=['Togo', 'Spain', 'Peru', 'Chile'])
+    result = linregress_groups(long, 'x', 'y', by='Country')
+    # Only observed categories, in the order of the categories
+    assert list(result.index) == ['Spain', 'Peru', 'Chile']
+    _check_groups(result, long, ['Country'])
+
+
+def test_linregress_groups_without_by(long):
+    result = linregress_groups(long, 'x', 'y')
+    rows = long.dropna(subset=['x', 'y'])
+    assert result['Observations'].tolist() == [len(rows)]
+    assert np.isclose(result['Slope'].iloc[0], stats.linregress(rows['x'], rows['y']).slope)
+
+
+@pytest.fixture
+def ragged(make_panel):
+    """
+    Two variables of six countries, every country misses other years and Yemen only has one value.
+    """
+    df = make_panel(['Chile', 'Peru', 'Spain', 'Togo', 'Yemen', 'Zambia'], range(2000, 2012),
+                    ['Rainfall', 'Population'], seed=6, missing=0.3,
+                    drop=[('Peru', 2000), ('Togo', 2011), ('Zambia', 2003)], adjust=lambda df: 50 * df.abs() + 1)
+    yemen = df['Country'] == 'Yemen'
+    df.loc[yemen, 'Rainfall'] = np.where(df.loc[yemen, 'Year'] == 2005, 50.0, np.nan)
+    return df
+
+
+def _reference_rates(df, variable, slope=False, log_scale=False) -> pd.Series:
+    """
+    Returns the rates of get_growth_rate or get_slope on the own years with data of every country.
+    """
+    rates = {}
+    for country, series in df.pivot(index='Year', columns='Country', values=variable).items():
+        series = series.dropna()
+        if len(series) < 2:
+            rates[country] = np.nan
+        elif slope:
+            rates[country] = get_slope(series, log_scale)
+        else:
+            rates[country] = get_growth_rate(series, log_scale)
+    return pd.Series(rates)
+
+
+@pytest.mark.parametrize('slope', [False, True])
+@pytest.mark.parametrize('log_scale', [False, True])
+def test_growth_rates_match_the_loop(ragged, slope, log_scale):
+    result = get_growth_rates(ragged, ['Rainfall', 'Population'], slope=slope, log_scale=log_scale)
+    assert list(result.columns) == ['Rainfall', 'Population']
+    for variable in result.columns:
+        pd.testing.assert_series_equal(result[variable], _reference_rates(ragged, variable, slope, log_scale),
+                                       check_names=False, check_index_type=False)
+
+
+def test_growth_rates_keep_countries_with_gaps(ragged):
+    # The pivoted table keeps no year in which every country has data
+    assert ragged.pivot(index='Year', columns='Country', values='Rainfall').dropna().empty
+
+    result = get_growth_rates(ragged, 'Rainfall')
+    assert result['Rainfall'].notna().sum() == 5
+    # Too few values
+    assert np.isnan(result.loc['Yemen', 'Rainfall'])
+
+
+def test_growth_rates_min_observations():
+    values = np.array([[1, np.nan, 3, np.nan], [np.nan, 2, np.nan, np.nan], [0, 1, 2, 3], [4, 2, 1, 1]])
+    assert np.allclose(growth_rates(values), [200, np.nan, np.nan, -75], equal_nan=True)
+    assert np.allclose(growth_rates(values, min_observations=3), [np.nan, np.nan, np.nan, -75], equal_nan=True)
+
+    years = np.arange(2000, 2004)
+    assert np.allclose(ols_slopes(years, values), [1, np.nan, 1, -1], equal_nan=True)
+    assert np.allclose(ols_slopes(years, values, min_observations=3), [np.nan, np.nan, 1, -1], equal_nan=True)
+    # A mask instead of NaN values
+    assert np.allclose(ols_slopes(years, np.nan_to_num(values), mask=~np.isnan(values)), [1, np.nan, 1, -1],
+                       equal_nan=True)
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.availability import AvailabilityIndex
+
+# More than 8 variables, so queries span several bytes
+VARIABLES = [f'Variable {i}' for i in range(11)]
+
+
+@pytest.fixture
+def wide(make_panel):
+    # One country-year without a row at all
+    return make_panel(['Chile', 'Peru', 'Spain', 'Togo'], range(2000, 2006), VARIABLES, seed=1, missing=0.3,
+                      drop=[('Togo', 2003)])
+
+
+def _available(wide) -> pd.DataFrame:
+    """
+    Returns the notna mask of every country, year and variable, with all country-year combinations.
+    """
+    grid = pd.MultiIndex.from_product([sorted(wide['Country'].unique()), sorted(wide['Year'].unique())],
+                                      names=['Country', 'Year'])
+    return wide.set_index(['Country', 'Year']).reindex(grid).notna()
+
+
+@pytest.mark.parametrize('variables', [['Variable 0'], ['Variable 1', 'Variable 9'], VARIABLES[2:]])
+def test_queries_match_pandas(wide, variables):
+    index = AvailabilityIndex.from_frame(wide)
+    available = _available(wide)[variables]
+
+    assert np.array_equal(index.has_all(variables), available.all(axis=1).unstack().to_numpy())
+    assert np.array_equal(index.has_any(variables), available.any(axis=1).unstack().to_numpy())
+    assert np.array_equal(index.count(variables), available.sum(axis=1).unstack().to_numpy())
+    pd.testing.assert_frame_equal(index.coverage(variables), available.mean(axis=1).unstack(),
+                                  check_names=False, check_index_type=False, check_column_type=False)
+
+
+def test_count_all_variables(wide):
+    index = AvailabilityIndex.from_frame(wide)
+    assert np.array_equal(index.count(), _available(wide).sum(axis=1).unstack().to_numpy())
+
+
+def test_countries_with_all(wide):
+    index = AvailabilityIndex.from_frame(wide)
+    variables = ['Variable 3', 'Variable 10']
+    year_rows = wide[wide['Year'] == 2002].set_index('Country')[variables]
+    expected = year_rows.index[year_rows.notna().all(axis=1)]
+
+    assert list(index.countries_with_all(variables, 2002)) == sorted(expected)
+
+
+def test_unknown_variable(wide):
+    index = AvailabilityIndex.from_frame(wide)
+    with pytest.raises(KeyError, match='Unknown variable'):
+        index.has_all(['Variable 0', 'Rainfall'])
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src import climate, utils
+from src.climate import accumulate_time_groups, get_anomaly, get_window_labels, to_means, window_mean
+
+# Bytes of one time step of the test grid
+STEP_BYTES = 4 * 5 * 8
+
+
+def make_grid(seed=5) -> xr.Dataset:
+    """
+    Monthly values from 1995 to 2004 on a 4 x 5 grid, with NaN cells, one cell without any value
+    and one time step without any value.
+    """
+    rng = np.random.default_rng(seed)
+    time = pd.date_range('1995-01-01', '2004-12-01', freq='MS')
+    values = rng.normal(10, 3, size=(len(time), 4, 5))
+    values[rng.random(values.shape) < 0.15] = np.nan
+    values[:, 0, 0] = np.nan
+    values[30] = np.nan
+    return xr.Dataset({'precip': (('time', 'lat', 'lon'), values, {'units': 'mm/day'})},
+                      coords={'time': time, 'lat': [-30.0, -10.0, 10.0, 30.0], 'lon': [0.0, 60, 120, 180, 240]})
+
+
+@pytest.fixture
+def grid_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'PATH_TO_CACHE', tmp_path / 'cache')
+    file_path = tmp_path / 'grid.nc'
+    make_grid().to_netcdf(file_path)
+    return str(file_path)
+
+
+def _reference_mean(file_path, window) -> np.ndarray:
+    with xr.open_dataset(file_path) as data:
+        return data['precip'].sel(time=slice(*window)).mean('time').to_numpy()
+
+
+WINDOWS = [('1995', '2004'), ('1996-03', '1999-10'), ('1997-07-01', '1997-07-01'), ('1997-06', '1997-08')]
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 7 * STEP_BYTES, 25 * STEP_BYTES, climate.CLIMATE_CHUNK_BYTES],
+                         ids=['one step', '7 steps', '25 steps', 'default'])
+@pytest.mark.parametrize('window', WINDOWS, ids=str)
+def test_window_mean_matches_xarray(grid_file, window, chunk_bytes):
+    mean = window_mean(grid_file, 'precip', window, chunk_bytes=chunk_bytes, use_cache=False)
+    assert mean.dims == ('lat', 'lon')
+    assert mean.attrs['units'] == 'mm/day'
+    np.testing.assert_allclose(mean.to_numpy(), _reference_mean(grid_file, window))
+    assert np.isnan(mean.to_numpy()[0, 0])
+
+
+def test_accumulate_time_groups_counts_valid_values(grid_file):
+    with xr.open_dataset(grid_file) as data:
+        data_array = data['precip']
+        labels = np.arange(data_array.sizes['time']) % 3 - 1
+        sums, counts = accumulate_time_groups(data_array, labels, 2, chunk_bytes=11 * STEP_BYTES)
+        values = data_array.to_numpy()
+
+    for label in range(2):
+        steps = values[labels == label]
+        np.testing.assert_allclose(sums[label], np.nansum(steps, axis=0))
+        assert np.array_equal(counts[label], (~np.isnan(steps)).sum(axis=0))
+    assert np.isnan(to_means(sums, counts)[:, 0, 0]).all()
+
+
+def test_accumulate_time_groups_without_labels(grid_file):
+    with xr.open_dataset(grid_file) as data:
+        sums, counts = accumulate_time_groups(data['precip'], np.full(data.sizes['time'], -1), 1)
+    assert not sums.any() and not counts.any()
+
+
+def test_window_labels(grid_file):
+    with xr.open_dataset(grid_file) as data:
+        labels = get_window_labels(data['precip'], ('1996-03', '1996-05'))
+        assert np.array_equal(np.flatnonzero(labels == 0), [14, 15, 16])
+        assert (labels[labels != 0] == -1).all()
+
+
+@pytest.mark.parametrize('relative', [False, True])
+def test_anomaly_matches_xarray(grid_file, relative):
+    baseline, target = ('1995', '1999'), ('2001-06', '2004')
+    anomaly = get_anomaly(grid_file, 'precip', baseline, target, relative=relative, chunk_bytes=9 * STEP_BYTES)
+
+    baseline_mean = _reference_mean(grid_file, baseline)
+    expected = _reference_mean(grid_file, target) - baseline_mean
+    if relative:
+        expected = 100 * expected / baseline_mean
+    assert anomaly.name == 'precip'
+    np.testing.assert_allclose(anomaly.to_numpy(), expected)
+
+
+def test_annual_means_match_xarray(grid_file):
+    annual = climate.get_annual_means(grid_file, 'precip', chunk_bytes=5 * STEP_BYTES)
+    with xr.open_dataset(grid_file) as data:
+        expected = data['precip'].groupby('time.year').mean('time')
+
+    assert annual.dims == ('year', 'lat', 'lon')
+    assert np.array_equal(annual['year'], expected['year'])
+    np.testing.assert_allclose(annual.to_numpy(), expected.to_numpy())
+
+
+def test_seasonal_means_match_xarray(grid_file):
+    seasonal = climate.get_seasonal_means(grid_file, 'precip', chunk_bytes=5 * STEP_BYTES)
+    assert seasonal.dims == ('year', 'season', 'lat', 'lon')
+    assert list(seasonal['season'].to_numpy()) == climate.SEASONS
+    # The December of 2004 is the first month of the winter of 2005
+    assert list(seasonal['year'].to_numpy()) == list(range(1995, 2006))
+
+    with xr.open_dataset(grid_file) as data:
+        time = data.indexes['time']
+        season_years = time.year + (time.month == 12)
+        for year in range(1995, 2006):
+            expected = data['precip'].isel(time=season_years == year).groupby('time.season').mean('time')
+            for season in climate.SEASONS:
+                actual = seasonal.sel(year=year, season=season).to_numpy()
+                if season in expected['season']:
+                    np.testing.assert_allclose(actual, expected.sel(season=season).to_numpy())
+                else:
+                    assert np.isnan(actual).all()
+
+
+@pytest.fixture
+def computations(monkeypatch):
+    """
+    Counts the passes over the dataset file.
+    """
+    passes = []
+    accumulate = climate.accumulate_time_groups
+
+    def counted(*args, **kwargs):
+        passes.append(args[1])
+        return accumulate(*args, **kwargs)
+
+    monkeypatch.setattr(climate, 'accumulate_time_groups', counted)
+    return passes
+
+
+@pytest.mark.parametrize('rollup', [climate.get_annual_means, climate.get_seasonal_means,
+                                    lambda file_path, variable: window_mean(file_path, variable, ('1996', '1998'))],
+                         ids=['annual', 'seasonal', 'window'])
+def test_rollups_are_cached(grid_file, computations, capsys, rollup):
+    first = rollup(grid_file, 'precip')
+    assert len(computations) == 1
+    capsys.readouterr()
+
+    second = rollup(grid_file, 'precip')
+    assert len(computations) == 1
+    assert 'Reading cached grid' in capsys.readouterr().out
+    xr.testing.assert_identical(second, first)
+
+
+def test_changed_file_rebuilds_rollups(grid_file, computations, tmp_path):
+    first = climate.get_annual_means(grid_file, 'precip')
+
+    # Replace the file like a refreshed download
+    make_grid(seed=6).to_netcdf(tmp_path / 'new.nc')
+    (tmp_path / 'new.nc').replace(grid_file)
+
+    second = climate.get_annual_means(grid_file, 'precip')
+    assert len(computations) == 2
+    assert not np.allclose(first.to_numpy(), second.to_numpy(), equal_nan=True)
+    with xr.open_dataset(grid_file) as data:
+        np.testing.assert_allclose(second.to_numpy(), data['precip'].groupby('time.year').mean('time').to_numpy())
+
+
+def test_changed_window_rebuilds_the_mean(grid_file, computations, monkeypatch):
+    monkeypatch.setattr(climate, 'CLIMATE_BASELINES', {'early': ('1995', '1997'), 'late': ('2000', '2002')})
+    early = climate.get_climatology(grid_file, 'precip', 'early')
+    late = climate.get_climatology(grid_file, 'precip', 'late')
+    assert len(computations) == 2
+    np.testing.assert_allclose(late.to_numpy(), _reference_mean(grid_file, ('2000', '2002')))
+
+    xr.testing.assert_identical(climate.get_climatology(grid_file, 'precip', 'early'), early)
+    assert len(computations) == 2
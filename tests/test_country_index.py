@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import country_index
+from src.country_index import to_world_values
+
+COUNTRIES = ['Chile', 'Peru', 'Vietnam']
+# Country of every world map polygon, -1 for polygons without an AQUASTAT country
+WORLD_CODES = np.array([0, 2, -1, 1, 2])
+
+
+@pytest.fixture(autouse=True)
+def crosswalk(monkeypatch):
+    monkeypatch.setattr(country_index, 'get_country_index',
+                        lambda: (pd.DataFrame({'Country': COUNTRIES}), WORLD_CODES))
+
+
+def test_world_values():
+    values = to_world_values(['Viet Nam', 'Chile', 'Atlantis', 'Atlantis'], [3.0, 1.0, 7.0, 8.0])
+    assert np.array_equal(values, [1, 3, np.nan, np.nan, 3], equal_nan=True)
+
+
+@pytest.mark.parametrize('countries', [['Chile', 'Peru', 'Chile'], ['Viet Nam', 'Peru', 'Vietnam']])
+def test_world_values_reject_duplicates(countries):
+    with pytest.raises(ValueError, match='Chile|Vietnam'):
+        to_world_values(countries, [1.0, 2.0, 3.0])
@@ -0,0 +1,250 @@
+import gzip
+import hashlib
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src import utils
+
+CONTENT = os.urandom(300_000)
+
+
+class DatasetHandler(BaseHTTPRequestHandler):
+    # Set by the tests: the served file and its ETag, compress the response,
+    # stop after this many bytes on the next request
+    content = CONTENT
+    etag = '"v1"'
+    gzip = False
+    cut_after = None
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        content, etag = type(self).content, type(self).etag
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = content
+        offset = 0
+        # A Range request for another version of the file gets the whole file
+        if self.headers.get('Range') and self.headers.get('If-Range', etag) == etag:
+            offset = int(self.headers['Range'].removeprefix('bytes=').rstrip('-'))
+            body = content[offset:]
+        if self.gzip:
+            body = gzip.compress(body)
+
+        self.send_response(206 if offset else 200)
+        if offset:
+            self.send_header('Content-Range', f'bytes {offset}-{len(content) - 1}/{len(content)}')
+        if self.gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+
+        if type(self).cut_after is not None:
+            body = body[:type(self).cut_after]
+            type(self).cut_after = None
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    DatasetHandler.content = CONTENT
+    DatasetHandler.etag = '"v1"'
+    DatasetHandler.gzip = False
+    DatasetHandler.cut_after = None
+    DatasetHandler.requests = []
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), DatasetHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}/data.bin'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def dat(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'PATH_TO_DAT', tmp_path)
+    monkeypatch.setattr(utils, 'PATH_TO_CACHE', tmp_path / 'cache')
+    return tmp_path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_download(server, dat):
+    assert utils.download_dataset(url=server)
+    assert read(dat / 'data.bin') == CONTENT
+    assert DatasetHandler.requests[0]['Accept-Encoding'] == 'identity'
+
+
+def test_download_with_content_encoding(server, dat):
+    DatasetHandler.gzip = True
+
+    assert utils.download_dataset(url=server)
+    assert read(dat / 'data.bin') == CONTENT
+
+
+def test_resume_short_interrupted_transfer(server, dat):
+    DatasetHandler.cut_after = 200_000
+
+    assert not utils.download_dataset(url=server)
+    part_size = os.path.getsize(dat / 'data.bin.part')
+    assert 0 < part_size <= 200_000
+
+    assert utils.download_dataset(url=server)
+    assert DatasetHandler.requests[-1]['Range'] == f'bytes={part_size}-'
+    assert DatasetHandler.requests[-1]['If-Range'] == '"v1"'
+    assert read(dat / 'data.bin') == CONTENT
+    assert not os.path.exists(dat / 'data.bin.part')
+    assert utils._get_download_validators(dat / 'data.bin.part') is None
+
+
+def test_changed_file_restarts_interrupted_transfer(server, dat):
+    DatasetHandler.cut_after = 200_000
+    assert not utils.download_dataset(url=server)
+
+    DatasetHandler.content = os.urandom(250_000)
+    DatasetHandler.etag = '"v2"'
+    assert utils.download_dataset(url=server)
+    assert DatasetHandler.requests[-1]['If-Range'] == '"v1"'
+    assert read(dat / 'data.bin') == DatasetHandler.content
+
+
+def test_interrupted_transfer_without_validators_restarts(server, dat):
+    DatasetHandler.etag = None
+    DatasetHandler.cut_after = 200_000
+    assert not utils.download_dataset(url=server)
+
+    assert utils.download_dataset(url=server)
+    assert 'Range' not in DatasetHandler.requests[-1]
+    assert read(dat / 'data.bin') == CONTENT
+
+
+def test_zip_is_extracted(server, dat):
+    archive = dat / 'archive.zip'
+    with zipfile.ZipFile(archive, 'w') as zip_ref:
+        zip_ref.writestr('data.csv', CONTENT)
+        zip_ref.writestr('docs/readme.txt', 'readme')
+        zip_ref.writestr('../outside.txt', 'outside')
+    DatasetHandler.content = read(archive)
+    archive.unlink()
+
+    assert utils.download_dataset(file_path='data.csv', url=server.replace('data.bin', 'data.zip'))
+    assert read(dat / 'data.csv') == CONTENT
+    assert read(dat / 'docs' / 'readme.txt') == b'readme'
+    # Members outside of the folder are skipped, the archive is removed
+    assert not os.path.exists(dat.parent / 'outside.txt')
+    assert sorted(os.listdir(dat)) == ['cache', 'data.csv', 'docs']
+
+
+def test_hash_mismatch(server, dat):
+    assert not utils.download_dataset(url=server, sha256='0' * 64)
+    assert not os.path.exists(dat / 'data.bin')
+    assert not os.path.exists(dat / 'data.bin.part')
+
+    assert utils.download_dataset(url=server, sha256=hashlib.sha256(CONTENT).hexdigest())
+
+
+def test_refresh_sends_validators(server, dat):
+    assert utils.download_dataset(url=server)
+    modified = os.stat(dat / 'data.bin').st_mtime_ns
+
+    assert utils.download_dataset(url=server, refresh=True)
+    assert DatasetHandler.requests[-1]['If-None-Match'] == '"v1"'
+    assert os.stat(dat / 'data.bin').st_mtime_ns == modified
+
+
+@pytest.fixture
+def invalidated(monkeypatch):
+    """
+    Records the sources of which download_dataset removes the cached data.
+    """
+    sources = []
+    monkeypatch.setattr(utils, 'invalidate_cache', lambda source: sources.append(source) or 0)
+    return sources
+
+
+def test_changed_file_invalidates_the_cache(server, dat, invalidated):
+    assert utils.download_dataset(url=server)
+    assert invalidated == []
+
+    DatasetHandler.content = os.urandom(1000)
+    DatasetHandler.etag = '"v2"'
+    assert utils.download_dataset(url=server, refresh=True)
+    assert read(dat / 'data.bin') == DatasetHandler.content
+    assert invalidated == ['data']
+
+
+def test_same_bytes_keep_the_cache(server, dat, invalidated):
+    assert utils.download_dataset(url=server)
+    modified = os.stat(dat / 'data.bin').st_mtime_ns
+
+    # The server sends the whole file again, e.g. after a new ETag
+    DatasetHandler.etag = '"v2"'
+    assert utils.download_dataset(url=server, refresh=True)
+    assert invalidated == []
+    assert os.stat(dat / 'data.bin').st_mtime_ns == modified
+    assert not os.path.exists(dat / 'data.bin.part')
+
+    # The new ETag was stored, the next check is answered with 304
+    assert utils.download_dataset(url=server, refresh=True)
+    assert DatasetHandler.requests[-1]['If-None-Match'] == '"v2"'
+    assert invalidated == []
+
+
+def test_progress(server, dat):
+    calls = []
+    assert utils.download_dataset(url=server, progress=lambda received, total: calls.append((received, total)))
+
+    received = [call[0] for call in calls]
+    assert received == sorted(received)
+    assert calls[-1] == (len(CONTENT), len(CONTENT))
+
+
+def test_prefetch_prints_progress(server, dat, monkeypatch, capsys):
+    from src import datasets
+
+    monkeypatch.setattr(datasets, 'DATASETS', {'test': {'file_path': 'data.bin', 'url': server}})
+    monkeypatch.setattr(datasets, 'PREFETCH_PROGRESS_INTERVAL', 0)
+
+    assert datasets.prefetch() == {'test': True}
+    assert 'test: 0.3 MB of 0.3 MB (100 %)' in capsys.readouterr().out
+
+
+def test_prefetch_counts_only_transferred_bytes(server, dat, monkeypatch, capsys):
+    from src import datasets
+
+    monkeypatch.setattr(datasets, 'DATASETS', {'test': {'file_path': 'data.bin', 'url': server}})
+    DatasetHandler.cut_after = 200_000
+    assert datasets.prefetch() == {'test': False}
+    missing = len(CONTENT) - os.path.getsize(dat / 'data.bin.part')
+    assert f'{missing / 1e6:.1f}' != f'{len(CONTENT) / 1e6:.1f}'
+    capsys.readouterr()
+
+    assert datasets.prefetch() == {'test': True}
+    assert f'Downloaded {missing / 1e6:.1f} MB' in capsys.readouterr().out
+
+
+def test_main_rejects_unknown_datasets(monkeypatch, capsys):
+    from src import datasets
+
+    monkeypatch.setattr('sys.argv', ['datasets', 'unknown'])
+    with pytest.raises(SystemExit) as exit_info:
+        datasets.main()
+    assert exit_info.value.code == 2
+    assert 'Unknown datasets: unknown' in capsys.readouterr().err
@@ -0,0 +1,47 @@
+import importlib
+import multiprocessing
+import sys
+from pathlib import Path
+
+from src import utils
+
+
+def _record_fingerprints(cache_path, worker, n_figures):
+    utils.PATH_TO_CACHE = Path(cache_path)
+    for figure in range(n_figures):
+        file_path = Path(cache_path) / f'fig_{worker}_{figure}.pdf'
+        file_path.write_bytes(b'%PDF')
+        utils._set_figure_fingerprint(file_path, f'{worker}-{figure}', 'vector')
+
+
+def test_manifest_keeps_entries_of_all_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'PATH_TO_CACHE', tmp_path)
+    n_workers, n_figures = 4, 25
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_record_fingerprints, args=(str(tmp_path), worker, n_figures))
+                 for worker in range(n_workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    fingerprints = sorted(entry['fingerprint'] for entry in utils._read_figure_manifest().values())
+    assert fingerprints == sorted(f'{worker}-{figure}' for worker in range(n_workers) for figure in range(n_figures))
+
+
+def test_fingerprint_covers_the_module_of_the_code(tmp_path, monkeypatch):
+    module_path = tmp_path / 'figure_module.py'
+    module_path.write_text('def helper():\n    return 1\n\n\ndef plot():\n    return helper()\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'figure_module', raising=False)
+    module = importlib.import_module('figure_module')
+    fingerprint = utils.figure_fingerprint('data', code=module.plot)
+    assert utils.figure_fingerprint('data', code=[module.plot]) == fingerprint
+
+    # Only the helper changes, not the function itself
+    module_path.write_text('def helper():\n    return 10\n\n\ndef plot():\n    return helper()\n')
+    module = importlib.reload(module)
+    assert utils.figure_fingerprint('data', code=module.plot) != fingerprint
+    assert utils.figure_fingerprint('other data', code=module.plot) != utils.figure_fingerprint('data', code=module.plot)
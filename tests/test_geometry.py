@@ -0,0 +1,49 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+from src import utils
+from src.geometry import get_pixel_size, simplify_shared_borders
+
+# Zigzag border from (1, 0) to (1, 1), shared by a left and a right country
+BORDER = [(1 + 0.01 * (i % 2), i / 20) for i in range(21)]
+LEFT = Polygon([(0, 0), *BORDER, (0, 1)])
+RIGHT = Polygon([(2, 0), (2, 1), *BORDER[::-1]])
+
+
+def test_shared_border_is_simplified_once():
+    left, right = simplify_shared_borders([LEFT, RIGHT], 0.05)
+    assert shapely.get_num_coordinates(left) < shapely.get_num_coordinates(LEFT)
+    assert left.intersection(right).area == 0
+    assert left.union(right).area == LEFT.union(RIGHT).area
+    assert shapely.hausdorff_distance(left, LEFT) <= 0.05
+
+
+def test_collapsed_arcs_keep_their_detail():
+    # An island of two countries, all of its arcs would collapse to the line between the ends of the border
+    top = Polygon([(0, 0), (0.3, 0.1), (0.7, 0.1), (1, 0), (0.5, -0.05)][::-1])
+    bottom = Polygon([(0, 0), (0.5, -0.05), (1, 0), (0.7, -0.1), (0.3, -0.1)][::-1])
+    result = simplify_shared_borders([top, bottom], 1)
+    assert shapely.is_valid(result).all()
+    assert np.allclose(shapely.area(result), [top.area, bottom.area])
+    assert result[0].intersection(result[1]).area == 0
+
+
+def test_rows_are_kept():
+    far = Polygon([(10, 10), (11, 10), (11, 11), (10, 11)])
+    result = simplify_shared_borders([LEFT, far, RIGHT], 0.05)
+    assert len(result) == 3
+    assert result[1].equals(far)
+
+
+def test_pixel_size_uses_profile_dpi(monkeypatch):
+    # The figure dpi only sets the size on screen, the saved file has the dpi of the profile
+    fig, ax = plt.subplots(figsize=(4, 2), dpi=100)
+    width_inches = ax.get_position().width * 4
+    monkeypatch.setattr(utils, 'DEFAULT_FIG_PROFILE', 'png')
+    assert np.isclose(get_pixel_size(ax), 360 / (width_inches * utils.FIG_PROFILES['png']['dpi']))
+    monkeypatch.setattr(utils, 'DEFAULT_FIG_PROFILE', 'vector')
+    assert np.isclose(get_pixel_size(ax), 360 / (width_inches * utils.FIG_PROFILES['vector']['dpi']))
+    assert np.isclose(get_pixel_size(ax, dpi=50), 360 / (width_inches * 50))
+    plt.close(fig)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from src import parallel, resampling
+from src.resampling import bootstrap, compare_groups, correlation, f_statistic, mean_difference, permutation_test
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(4)
+    values = np.concatenate([rng.normal(0, 1, 30), rng.normal(0.5, 1, 25)])
+    labels = np.arange(55) >= 30
+    return values, labels
+
+
+def test_statistics_match_scipy(samples):
+    values, labels = samples
+    groups = np.arange(55) % 3
+
+    assert np.isclose(mean_difference(values, labels), values[labels].mean() - values[~labels].mean())
+    assert np.isclose(correlation(values, np.arange(55)), stats.pearsonr(values, np.arange(55)).statistic)
+    assert np.isclose(f_statistic(values, groups), stats.f_oneway(*(values[groups == g] for g in range(3))).statistic)
+
+    # One statistic per row of a batch
+    rows = np.stack([values, values[::-1]])
+    expected = [stats.f_oneway(*(row[groups == g] for g in range(3))).statistic for row in rows]
+    assert np.allclose(f_statistic(rows, groups), expected)
+
+
+@pytest.mark.parametrize('alternative', ['two-sided', 'greater', 'less'])
+def test_permutation_test_matches_scipy(samples, alternative):
+    values, labels = samples
+    statistic, p_value, replicates = permutation_test(mean_difference, values, labels, 20000, alternative, seed=1)
+
+    expected = stats.permutation_test((values[labels], values[~labels]), lambda a, b: a.mean() - b.mean(),
+                                      n_resamples=20000, alternative=alternative, random_state=1)
+    assert np.isclose(statistic, expected.statistic)
+    assert abs(p_value - expected.pvalue) < 0.02
+    assert replicates.shape == (20000,)
+
+
+def test_bootstrap_matches_scipy(samples):
+    values, _ = samples
+    _, (low, high), _ = bootstrap(lambda sample: sample.mean(axis=-1), values, 20000, seed=1)
+    expected = stats.bootstrap((values,), np.mean, n_resamples=20000, method='percentile', random_state=1)
+    assert np.allclose([low, high], [expected.confidence_interval.low, expected.confidence_interval.high], atol=0.02)
+
+
+def test_results_do_not_depend_on_workers(samples, monkeypatch):
+    values, labels = samples
+    # Several batches, so the workers get different parts of the replicates
+    monkeypatch.setattr(resampling, 'RESAMPLING_BATCH_SIZE', 1000)
+    _, p_value, replicates = permutation_test(mean_difference, values, labels, 2500, seed=7)
+    _, pooled_p_value, pooled = permutation_test(mean_difference, values, labels, 2500, seed=7, workers=2)
+
+    assert pooled_p_value == p_value
+    assert np.array_equal(pooled, replicates)
+
+
+@pytest.mark.parametrize('test', [
+    lambda values, labels: permutation_test(mean_difference, values, labels, 0),
+    lambda values, labels: bootstrap(mean_difference, [values, labels], 0),
+])
+def test_zero_replicates(samples, test):
+    with pytest.raises(ValueError, match='at least 1'):
+        test(*samples)
+
+
+def test_compare_groups(samples, monkeypatch):
+    values, labels = samples
+    data = pd.DataFrame({'Withdrawal': values, 'Rainfall': values[::-1], 'Scarce': labels,
+                         'Region': np.array(['North', 'South', 'West'])[np.arange(55) % 3]})
+    data.loc[3, 'Region'] = None
+
+    two = compare_groups(data, ['Withdrawal', 'Rainfall'], 'Scarce', 2000, seed=1)
+    assert two.loc['Withdrawal', 'Statistic'] == pytest.approx(values[labels].mean() - values[~labels].mean())
+    assert (two['Observations'] == 55).all()
+    assert (two['CI low'] < two['Statistic']).all() and (two['Statistic'] < two['CI high']).all()
+
+    three = compare_groups(data, 'Withdrawal', 'Region', 2000, seed=1)
+    rows = data.dropna()
+    expected = stats.f_oneway(*(group['Withdrawal'] for _, group in rows.groupby('Region')))
+    assert three.loc['Withdrawal', 'Observations'] == 54
+    assert three.loc['Withdrawal', 'Statistic'] == pytest.approx(expected.statistic)
+
+    # One pool of processes for all variables gives the same result
+    pools = []
+
+    class CountedExecutor(parallel.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(parallel, 'ProcessPoolExecutor', CountedExecutor)
+    pd.testing.assert_frame_equal(compare_groups(data, ['Withdrawal', 'Rainfall'], 'Scarce', 2000, seed=1,
+                                                 workers=2), two)
+    assert len(pools) == 1
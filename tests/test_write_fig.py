@@ -0,0 +1,61 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from src import utils
+
+
+@pytest.fixture(autouse=True)
+def no_latex(monkeypatch):
+    # The tueplots bundle of src.utils renders text with LaTeX, which is not needed to check the layers
+    monkeypatch.setitem(plt.rcParams, 'text.usetex', False)
+
+
+def _rasterized_while_saving(fig, monkeypatch, **kwargs):
+    artists = {'mesh': fig.axes[0].collections[0], 'scatter': fig.axes[0].collections[1],
+               'line': fig.axes[0].lines[0]}
+    states = {}
+    savefig = fig.savefig
+
+    def record(*args, **savefig_kwargs):
+        states.update({name: artist.get_rasterized() for name, artist in artists.items()})
+        return savefig(*args, **savefig_kwargs)
+
+    monkeypatch.setattr(fig, 'savefig', record)
+    utils.write_fig(fig, kwargs.pop('file_path'), **kwargs)
+    return states, {name: artist.get_rasterized() for name, artist in artists.items()}
+
+
+def _make_fig():
+    fig, ax = plt.subplots()
+    ax.pcolormesh(np.arange(12).reshape(3, 4))
+    ax.scatter([0, 1], [0, 1])
+    ax.plot([0, 1], [1, 0])
+    ax.grid()
+    return fig
+
+
+def test_hybrid_rasterizes_only_meshes(tmp_path, monkeypatch):
+    fig = _make_fig()
+    states, after = _rasterized_while_saving(fig, monkeypatch, file_path=tmp_path / 'fig.pdf', profile='hybrid')
+    assert states == {'mesh': True, 'scatter': False, 'line': False}
+    assert not any(after.values())
+    plt.close(fig)
+
+
+def test_hybrid_rasterizes_given_artists(tmp_path, monkeypatch):
+    fig = _make_fig()
+    scatter = fig.axes[0].collections[1]
+    states, after = _rasterized_while_saving(fig, monkeypatch, file_path=tmp_path / 'fig.pdf', profile='hybrid',
+                                             rasterize=[scatter])
+    assert states == {'mesh': True, 'scatter': True, 'line': False}
+    assert not any(after.values())
+    plt.close(fig)
+
+
+def test_vector_rasterizes_nothing(tmp_path, monkeypatch):
+    fig = _make_fig()
+    states, _ = _rasterized_while_saving(fig, monkeypatch, file_path=tmp_path / 'fig.pdf', profile='vector',
+                                         rasterize=[fig.axes[0].collections[1]])
+    assert not any(states.values())
+    plt.close(fig)
@@ -0,0 +1,162 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+import xarray as xr
+from shapely import affinity
+
+from src import utils, zonal_stats
+from src.zonal_stats import get_cell_bounds, get_country_series, to_aquastat_frame
+
+POLYGONS = [
+    shapely.box(170, -20, 180, 10),
+    shapely.box(-180, -20, -172, 10),
+    shapely.box(-7, -5, 23, 12),
+    shapely.Polygon([(30, 60), (80, 60), (50, 88)]),
+]
+
+
+def test_cell_bounds():
+    south, north = get_cell_bounds([-60, -30, 0, 30, 60])
+    assert np.array_equal(south, [-75, -45, -15, 15, 45])
+    assert np.array_equal(north, [-45, -15, 15, 45, 75])
+
+
+def test_cell_bounds_descending_and_limits():
+    south, north = get_cell_bounds([80, 40, 0, -40, -80], limits=(-90, 90))
+    assert np.array_equal(south, [60, 20, -20, -60, -90])
+    assert np.array_equal(north, [90, 60, 20, -20, -60])
+
+
+def test_cell_bounds_single_cell():
+    with pytest.raises(ValueError):
+        get_cell_bounds([0])
+
+
+def _reference_weights(lat, lon):
+    south, north = get_cell_bounds(lat, limits=(-90, 90))
+    west, east = get_cell_bounds(lon)
+    weights = np.zeros((len(POLYGONS), len(lat), len(lon)))
+    for row, polygon in enumerate(POLYGONS):
+        # The same polygon one turn to the west and to the east, so cells in any longitude range see it
+        copies = [affinity.translate(polygon, xoff=turn * 360) for turn in (-1, 0, 1)]
+        for i in range(len(lat)):
+            for j in range(len(lon)):
+                box = shapely.box(west[j], south[i], east[j], north[i])
+                area = sum(copy.intersection(box).area for copy in copies)
+                weights[row, i, j] = area * np.cos(np.radians((south[i] + north[i]) / 2))
+    return weights.reshape(len(POLYGONS), -1)
+
+
+@pytest.mark.parametrize('lon', [np.arange(0, 360, 10), np.arange(-180, 180, 10), np.arange(175, -185, -10)],
+                         ids=['0 to 360', 'date line', 'descending'])
+def test_polygon_weights(monkeypatch, lon):
+    monkeypatch.setattr(zonal_stats, 'get_world', lambda: gpd.GeoDataFrame(geometry=POLYGONS))
+    lat = np.arange(85, -90, -10)
+
+    weights = zonal_stats._get_polygon_weights(lat, lon)
+    assert weights.shape == (len(POLYGONS), len(lat) * len(lon))
+    assert np.allclose(weights.toarray(), _reference_weights(lat, lon))
+
+
+def test_polygon_weights_cover_the_polygons(monkeypatch):
+    monkeypatch.setattr(zonal_stats, 'get_world', lambda: gpd.GeoDataFrame(geometry=POLYGONS))
+    lat = np.arange(-89.5, 90)
+    lon = np.arange(0.5, 360)
+
+    weights = zonal_stats._get_polygon_weights(lat, lon).toarray().reshape(len(POLYGONS), len(lat), len(lon))
+    # Without the cosine, the weights of a polygon add up to its area
+    areas = (weights / np.cos(np.radians(lat))[:, None]).sum(axis=(1, 2))
+    assert np.allclose(areas, shapely.area(POLYGONS))
+
+
+# Country of every polygon, the first two are the halves of one country across the date line
+COUNTRIES = ['Fiji', 'Chad', 'Atlantis']
+POLYGON_CODES = np.array([0, 0, 1, -1])
+LAT = np.arange(85, -90, -10)
+LON = np.arange(0, 360, 10)
+# Bytes of one time step of the test grid
+STEP_BYTES = len(LAT) * len(LON) * 8
+
+
+@pytest.fixture
+def grid_file(tmp_path, monkeypatch):
+    """
+    Monthly values of 2000 and 2001 on the 10 degree grid, with a single depth level before the grid dimensions.
+    Some cells are NaN and all cells of Chad are NaN in March 2001.
+    """
+    monkeypatch.setattr(zonal_stats, 'get_world', lambda: gpd.GeoDataFrame(geometry=POLYGONS))
+    monkeypatch.setattr(zonal_stats, 'get_country_index',
+                        lambda: (pd.DataFrame({'Country': COUNTRIES}), POLYGON_CODES))
+    monkeypatch.setattr(zonal_stats, 'get_world_cache_key', lambda: 'world')
+    monkeypatch.setattr(zonal_stats, 'get_aquastat_cache_key', lambda: 'aquastat')
+    monkeypatch.setattr(utils, 'PATH_TO_CACHE', tmp_path / 'cache')
+
+    rng = np.random.default_rng(7)
+    time = pd.date_range('2000-01-01', '2001-12-01', freq='MS')
+    values = rng.normal(20, 5, size=(len(time), len(LAT), len(LON)))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[14, 7:10, :3] = values[14, 7:10, -1] = np.nan
+
+    # The dimensions are in another order than in get_country_series
+    data = xr.Dataset({'sst': (('time', 'lat', 'lon'), values)}, coords={'time': time, 'lat': LAT, 'lon': LON})
+    data['sst'] = data['sst'].expand_dims(depth=[0.5]).transpose('lat', 'depth', 'time', 'lon')
+    file_path = tmp_path / 'grid.nc'
+    data.to_netcdf(file_path)
+    return str(file_path)
+
+
+def _reference_series(file_path, window=None) -> pd.DataFrame:
+    """
+    Returns the weighted means of every country with dense weights of the reference polygons.
+    """
+    polygon_weights = _reference_weights(LAT, LON)
+    weights = np.stack([polygon_weights[POLYGON_CODES == code].sum(axis=0) for code in range(len(COUNTRIES))])
+
+    with xr.open_dataset(file_path) as data:
+        data_array = data['sst'].isel(depth=0).transpose('time', 'lat', 'lon')
+        if window is not None:
+            data_array = data_array.sel(time=slice(*window))
+        values = data_array.to_numpy().reshape(data_array.sizes['time'], -1)
+        time = data_array.indexes['time']
+
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore'):
+        means = (np.where(valid, values, 0) @ weights.T) / (valid @ weights.T)
+    return pd.DataFrame(means, index=time, columns=pd.Index(COUNTRIES, name='Country'))
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 5 * STEP_BYTES, 100 * STEP_BYTES], ids=['one step', '5 steps', 'one chunk'])
+@pytest.mark.parametrize('window', [None, ('2000-05', '2001-04')], ids=['all', 'window'])
+def test_country_series_match_dense_means(grid_file, chunk_bytes, window):
+    series = get_country_series(grid_file, 'sst', window=window, chunk_bytes=chunk_bytes)
+    expected = _reference_series(grid_file, window)
+    pd.testing.assert_frame_equal(series, expected, check_freq=False)
+
+    assert series['Atlantis'].isna().all()
+    assert np.isnan(series.loc['2001-03-01', 'Chad'])
+    assert series[['Fiji', 'Chad']].notna().sum().sum() == 2 * len(series) - 1
+
+
+def test_country_series_rejects_extra_entries(grid_file, tmp_path):
+    with xr.open_dataset(grid_file) as data:
+        data = data.reindex(depth=[0.5, 1.5]).load()
+    file_path = tmp_path / 'depths.nc'
+    data.to_netcdf(file_path)
+
+    with pytest.raises(ValueError, match='depth'):
+        get_country_series(str(file_path), 'sst')
+
+
+def test_aquastat_frame(grid_file):
+    series = get_country_series(grid_file, 'sst')
+    frame = to_aquastat_frame(series, 'Sea temperature')
+    assert list(frame.columns) == ['Country', 'Year', 'Sea temperature']
+
+    # Countries without any value in a year have no row
+    expected = [(country, year, series.loc[str(year), country].mean())
+                for country in COUNTRIES for year in (2000, 2001) if series.loc[str(year), country].notna().any()]
+    expected = pd.DataFrame(expected, columns=['Country', 'Year', 'Sea temperature'])
+    pd.testing.assert_frame_equal(frame.sort_values(['Country', 'Year'], ignore_index=True),
+                                  expected.sort_values(['Country', 'Year'], ignore_index=True), check_dtype=False)